@@ -0,0 +1,108 @@
+""" Packed STR-tree (Sort-Tile-Recursive R-tree) of bounding boxes in numpy arrays
+
+Every level of the tree is a set of arrays (bbox, first child, child count),
+the leaves point to the boxes in STR order. Queries walk the tree level by
+level for whole arrays of points at once.
+
+Reference:
+
+- Leutenegger, Lopez, Edgington - STR: A Simple and Efficient Algorithm for R-Tree Packing, 1997
+"""
+
+import numpy as np
+
+
+def _str_order(bboxes, node_capacity):
+    """ Sort-Tile-Recursive order of the boxes: vertical slabs by x center, sorted by y center
+    """
+    count = len(bboxes)
+    center_x = (bboxes[:, 0] + bboxes[:, 2]) / 2.0
+    center_y = (bboxes[:, 1] + bboxes[:, 3]) / 2.0
+    nodes = int(np.ceil(count / float(node_capacity)))
+    slab_size = int(np.ceil(np.sqrt(nodes))) * node_capacity
+    order = np.argsort(center_x, kind='mergesort')
+    slab = np.arange(count) // slab_size
+    return order[np.lexsort((center_y[order], slab))]
+
+
+def _group(bboxes, node_capacity):
+    """ Nodes of node_capacity consecutive boxes, as (bbox, first child, child count)
+    """
+    starts = np.arange(0, len(bboxes), node_capacity)
+    counts = np.diff(np.append(starts, len(bboxes)))
+    node_bboxes = np.column_stack((np.minimum.reduceat(bboxes[:, 0], starts),
+                                   np.minimum.reduceat(bboxes[:, 1], starts),
+                                   np.maximum.reduceat(bboxes[:, 2], starts),
+                                   np.maximum.reduceat(bboxes[:, 3], starts)))
+    return node_bboxes, starts, counts
+
+
+def _expand(starts, counts):
+    """ Child indexes of nodes with children [start, start + count)
+    """
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets
+
+
+class STRTree:
+    """ Static R-tree of an (n, 4) array of boxes [min_x, min_y, max_x, max_y]
+    """
+
+    def __init__(self, bboxes, node_capacity=16):
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        self.node_capacity = node_capacity
+        self.order = _str_order(bboxes, node_capacity) if len(bboxes) > 0 else np.zeros(0, dtype=np.int64)
+        self.item_bboxes = bboxes[self.order]
+        # Levels from the leaves to the root, every level as (bbox, first child, child count)
+        self.levels = []
+        level_bboxes = self.item_bboxes
+        while len(level_bboxes) > 0:
+            node_bboxes, starts, counts = _group(level_bboxes, node_capacity)
+            if len(node_bboxes) > 1:
+                order = _str_order(node_bboxes, node_capacity)
+                node_bboxes, starts, counts = node_bboxes[order], starts[order], counts[order]
+            self.levels.append((node_bboxes, starts, counts))
+            if len(node_bboxes) == 1:
+                break
+            level_bboxes = node_bboxes
+
+    def __len__(self):
+        return len(self.order)
+
+    def _query(self, num_queries, intersects):
+        """ Walks the tree with pairs (query, node), intersects(query_indexes, bboxes) filters them.
+            Returns the (query, item) pairs, sorted by query and item.
+        """
+        if not self.levels:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        query = np.arange(num_queries)
+        node = np.zeros(num_queries, dtype=np.int64)
+        for node_bboxes, starts, counts in reversed(self.levels):
+            keep = intersects(query, node_bboxes[node])
+            query, node = query[keep], node[keep]
+            query = np.repeat(query, counts[node])
+            node = _expand(starts[node], counts[node])
+        keep = intersects(query, self.item_bboxes[node])
+        query, item = query[keep], self.order[node[keep]]
+        sort = np.lexsort((item, query))
+        return query[sort], item[sort]
+
+    def query_points(self, x, y):
+        """ Boxes containing the points (x, y), as arrays (point index, box index)
+        """
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+
+        def contains(query, bboxes):
+            return ((x[query] >= bboxes[:, 0]) & (x[query] <= bboxes[:, 2]) &
+                    (y[query] >= bboxes[:, 1]) & (y[query] <= bboxes[:, 3]))
+        return self._query(len(x), contains)
+
+    def query_bbox(self, bbox):
+        """ Sorted indexes of the boxes intersecting bbox [min_x, min_y, max_x, max_y]
+        """
+        min_x, min_y, max_x, max_y = bbox
+
+        def intersects(query, bboxes):
+            return (bboxes[:, 0] <= max_x) & (bboxes[:, 2] >= min_x) & (bboxes[:, 1] <= max_y) & (bboxes[:, 3] >= min_y)
+        return self._query(1, intersects)[1]
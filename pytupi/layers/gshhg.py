@@ -1,68 +1,323 @@
 
+import os
+import threading
+import collections
+
+import numpy as np
 from osgeo import ogr
 import shapefile
 
+import _strtree
+
 
 class GSHHG:
+    """ GSHHG coastline shapefile. The shape bounding boxes and vertices are kept in packed
+        arrays, cached next to the shapefile in a memory mapped .npy file, and the OGR polygons
+        are built on first use. Scenes should query the coastline through subset(bbox).
+    """
+
+    CACHE_VERSION = 1
 
-    def __init__(self, file):
+    # Cache header: version, size and modification time of the .shp file, shapes, vertices
+    CACHE_HEADER_SIZE = 5
+
+    SUBSET_CACHE_SIZE = 16
+
+    def __init__(self, file, use_cache=True):
         self.file = file
-        self.shape = shapefile.Reader(file)
-        self.shapes = self.shape.shapes()
-        self.total_shapes = len(self.shapes)
+        self.use_cache = use_cache
+        self._reader = None
+        self._shapes = None
+
+        arrays = self._load_cache()
+        if arrays is None:
+            arrays = self._pack_shapes()
+            self._save_cache(arrays)
+        self.vertices = arrays['vertices']
+        self.offsets = arrays['offsets']
+        self.bbox_cache = arrays['bbox']
+        self.total_shapes = len(self.bbox_cache)
         self.range_shapes = range(self.total_shapes)
 
-        self.bbox_cache = []
-        self.polygon_cache = []
-        self.polygon_ogr_cache = []
+        self._polygon_ogr_cache = {}
         self.relevant_index_set = None
+        self._index = None
+        self._relevant_mask = None
+        self._relevant_mask_source = None
+        self._subset_cache = collections.OrderedDict()
+        self._subset_lock = threading.Lock()
+
+    @property
+    def shape(self):
+        """ pyshp reader of the shapefile, opened on first use
+        """
+        self.getShapes()
+        return self._reader
+
+    @property
+    def shapes(self):
+        return self.getShapes()
+
+    @property
+    def polygon_cache(self):
+        """ Read only sequence of the vertices of every shape, see getPoints
+        """
+        return _LazySequence(self.getPoints, self.total_shapes)
+
+    @property
+    def polygon_ogr_cache(self):
+        """ Read only sequence of the OGR polygon of every shape, built on first access
+        """
+        return _LazySequence(self._get_ogr_polygon, self.total_shapes)
+
+    def _get_cache_file(self):
+        return os.path.splitext(self.file)[0] + '.gshhg.npy'
 
-        for i in self.range_shapes:
-            self.bbox_cache.append(self.shapes[i].bbox)
-            self.polygon_cache.append(self.shapes[i].points)
-            self.polygon_ogr_cache.append(self._create_ogr_polygon(self.shapes[i].points))
+    def _get_cache_key(self):
+        """ Version and size and modification time of the .shp file, a cache with another key is outdated
+        """
+        stat = os.stat(os.path.splitext(self.file)[0] + '.shp')
+        return np.asarray([self.CACHE_VERSION, stat.st_size, stat.st_mtime], dtype=np.float64)
+
+    def _load_cache(self):
+        """ Packed arrays of the cache file, None when it is missing or outdated. The bboxes
+            and vertices are memory mapped.
+        """
+        if not self.use_cache:
+            return None
+        try:
+            cache_key = self._get_cache_key()
+            cache = np.load(self._get_cache_file(), mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+        header_size = self.CACHE_HEADER_SIZE
+        if cache.ndim != 1 or len(cache) < header_size or not np.array_equal(cache[0:3], cache_key):
+            return None
+        shapes, vertices = int(cache[3]), int(cache[4])
+        if len(cache) != header_size + 5 * shapes + 1 + 2 * vertices:
+            return None
+        offsets_start = header_size + 4 * shapes
+        vertices_start = offsets_start + shapes + 1
+        return {'bbox': cache[header_size:offsets_start].reshape(shapes, 4),
+                'offsets': np.asarray(cache[offsets_start:vertices_start], dtype=np.int64),
+                'vertices': cache[vertices_start:].reshape(vertices, 2)}
+
+    def _save_cache(self, arrays):
+        """ Writes the packed arrays in one float64 array after the cache header, the file
+            is replaced at once so that concurrent readers never see a partial cache
+        """
+        if not self.use_cache:
+            return
+        cache_file = self._get_cache_file()
+        temp_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+        try:
+            header = np.append(self._get_cache_key(), [len(arrays['bbox']), len(arrays['vertices'])])
+            cache = np.concatenate((header, arrays['bbox'].ravel(), arrays['offsets'], arrays['vertices'].ravel()))
+            with open(temp_file, 'wb') as f:
+                np.save(f, cache.astype(np.float64))
+            os.rename(temp_file, cache_file)
+        except (IOError, OSError):
+            # Read only directories are used without cache
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def _pack_shapes(self):
+        """ Vertices of all the shapes in one (points, 2) array, shape i has the vertices
+            offsets[i]:offsets[i+1], and the (shapes, 4) array of bounding boxes
+        """
+        shapes = self.getShapes()
+        counts = [len(shape.points) for shape in shapes]
+        offsets = np.zeros(shape=(len(shapes) + 1,), dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        vertices = np.zeros(shape=(offsets[-1], 2), dtype=np.float64)
+        for i, shape in enumerate(shapes):
+            if counts[i] > 0:
+                vertices[offsets[i]:offsets[i + 1]] = np.asarray(shape.points, dtype=np.float64)[:, 0:2]
+        bbox = np.asarray([shape.bbox for shape in shapes], dtype=np.float64).reshape(-1, 4)
+        return {'vertices': vertices, 'offsets': offsets, 'bbox': bbox}
 
     def _create_ogr_point(self, point):
         ogr_point = ogr.Geometry(ogr.wkbPoint)
         ogr_point.AddPoint(point[0], point[1])
         return ogr_point
 
-    def _lines(self, polygon):
-        p0 = polygon[-1]
-        for p1 in polygon:
-            yield p0, p1
-            p0 = p1
-
     def _create_ogr_polygon(self, polygon):
         ring = ogr.Geometry(ogr.wkbLinearRing)
-        for line_point in self._lines(polygon):
-            ring.AddPoint(line_point[0][0], line_point[0][1])
-            ring.AddPoint(line_point[1][0], line_point[1][1])
+        for point in polygon:
+            ring.AddPoint(float(point[0]), float(point[1]))
+        if len(polygon) > 0 and tuple(polygon[0]) != tuple(polygon[-1]):
+            ring.AddPoint(float(polygon[0][0]), float(polygon[0][1]))
         ogr_poly = ogr.Geometry(ogr.wkbPolygon)
         ogr_poly.AddGeometry(ring)
         return ogr_poly
 
+    def _get_ogr_polygon(self, shape_index):
+        polygon_ogr = self._polygon_ogr_cache.get(shape_index)
+        if polygon_ogr is None:
+            polygon_ogr = self._create_ogr_polygon(self.getPoints(shape_index))
+            self._polygon_ogr_cache[shape_index] = polygon_ogr
+        return polygon_ogr
+
     def getShapes(self):
-        return self.shapes
+        """ pyshp shapes, read from the shapefile on first use
+        """
+        if self._shapes is None:
+            self._reader = shapefile.Reader(self.file)
+            self._shapes = self._reader.shapes()
+        return self._shapes
 
     def getPoints(self, shape_index):
-        return self.shapes[shape_index].points
+        """ (points, 2) array of the (lon, lat) vertices of a shape
+        """
+        return self.vertices[self.offsets[shape_index]:self.offsets[shape_index + 1]]
 
-    def isOverLand(self, point_lon_lat):
+    def _get_index(self):
+        """ STR-tree of the shape bounding boxes, built on first use
+        """
+        if self._index is None:
+            self._index = _strtree.STRTree(self.bbox_cache)
+        return self._index
+
+    def _get_relevant_mask(self):
+        """ Boolean mask of the shapes of relevant_index_set, None when it is not set
+        """
+        relevant_index_set = self.relevant_index_set
+        if relevant_index_set is None:
+            return None
+        if self._relevant_mask_source is not relevant_index_set:
+            relevant_mask = np.zeros(shape=(self.total_shapes,), dtype=bool)
+            relevant_mask[list(relevant_index_set)] = True
+            self._relevant_mask, self._relevant_mask_source = relevant_mask, relevant_index_set
+        return self._relevant_mask
+
+    def _get_candidates(self, points, shape_mask=None):
+        """ Pairs (point index, shape index) of the points inside the bounding box of a shape
+            of shape_mask (all the shapes when None), sorted by point and shape
+        """
+        point_index, shape_index = self._get_index().query_points(points[:, 0], points[:, 1])
+        if shape_mask is not None:
+            relevant = shape_mask[shape_index]
+            point_index, shape_index = point_index[relevant], shape_index[relevant]
+        return point_index, shape_index
+
+    def _is_over_land(self, point_lon_lat, shape_mask):
+        point = np.asarray(point_lon_lat, dtype=np.float64).reshape(1, 2)
         point_ogr_lon_lat = self._create_ogr_point(point_lon_lat)
-        loop_set = self.relevant_index_set
-        if loop_set is None:
-            loop_set = self.range_shapes
-        for i in loop_set:
-            polygon_ogr = self.polygon_ogr_cache[i]
+        for i in self._get_candidates(point, shape_mask)[1]:
+            polygon_ogr = self._get_ogr_polygon(i)
             if polygon_ogr.Contains(point_ogr_lon_lat):
                 return True
         return False
 
+    def _is_over_land_many(self, points_lon_lat, shape_mask):
+        points = np.asarray(points_lon_lat, dtype=np.float64).reshape(-1, 2)
+        over_land = np.zeros(shape=(len(points),), dtype=bool)
+        for j, i in zip(*self._get_candidates(points, shape_mask)):
+            if not over_land[j] and self._get_ogr_polygon(i).Contains(self._create_ogr_point(points[j])):
+                over_land[j] = True
+        return over_land
+
+    def isOverLand(self, point_lon_lat):
+        return self._is_over_land(point_lon_lat, self._get_relevant_mask())
+
+    def isOverLand_many(self, points_lon_lat):
+        """ isOverLand for an array of (lon, lat) points, returns a boolean array.
+            The candidate polygons of all the points come from one query of the STR-tree.
+        """
+        return self._is_over_land_many(points_lon_lat, self._get_relevant_mask())
+
+    def _find_shapes(self, polygon):
+        """ Sorted indexes of the shapes that intersect polygon [(lon, lat), ...], only the
+            shapes with a bounding box intersecting the one of polygon are tested
+        """
+        points = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        envelope = [points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max()]
+        polygon_bbox = self._create_ogr_polygon(polygon)
+        return [int(i) for i in self._get_index().query_bbox(envelope)
+                if polygon_bbox.Intersects(self._get_ogr_polygon(i))]
+
+    def subset(self, bbox):
+        """ Immutable view of the shapes that intersect bbox [min_lon, min_lat, max_lon, max_lat].
+            Views are kept in a LRU cache of SUBSET_CACHE_SIZE bboxes, and several threads can
+            use different views of the same coastline at the same time.
+        """
+        key = tuple(float(b) for b in bbox)
+        with self._subset_lock:
+            view = self._subset_cache.pop(key, None)
+            if view is not None:
+                self._subset_cache[key] = view
+                return view
+        min_lon, min_lat, max_lon, max_lat = key
+        corners = [(min_lon, min_lat), (min_lon, max_lat), (max_lon, max_lat), (max_lon, min_lat), (min_lon, min_lat)]
+        view = GSHHGSubset(self, key, self._find_shapes(corners))
+        with self._subset_lock:
+            self._subset_cache[key] = view
+            while len(self._subset_cache) > self.SUBSET_CACHE_SIZE:
+                self._subset_cache.popitem(last=False)
+        return view
+
     def buildRelevantSet(self, bbox):
-        self.relevant_index_set = []
-        polygon_bbox = self._create_ogr_polygon(bbox)
-        for i in self.range_shapes:
-            polygon_ogr = self._create_ogr_polygon(self.polygon_cache[i])
-            if polygon_bbox.Intersects(polygon_ogr):
-                self.relevant_index_set.append(i)
+        """ Restricts the queries of this object to the shapes that intersect the polygon bbox,
+            prefer subset() when the coastline is shared by several scenes
+        """
+        self.relevant_index_set = self._find_shapes(bbox)
+
+
+class _LazySequence(object):
+    """ Read only sequence of getter(i) for i in range(length)
+    """
+
+    def __init__(self, getter, length):
+        self._getter = getter
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._getter(j) for j in range(*i.indices(self._length))]
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(i)
+        return self._getter(i)
+
+
+class GSHHGSubset(object):
+    """ Read only view of the shapes of a GSHHG coastline that intersect a bbox
+    """
+
+    def __init__(self, gshhg, bbox, shape_indexes):
+        self._gshhg = gshhg
+        self._bbox = bbox
+        self._shape_indexes = tuple(shape_indexes)
+        self._shape_mask = np.zeros(shape=(gshhg.total_shapes,), dtype=bool)
+        self._shape_mask[list(self._shape_indexes)] = True
+        self._shape_mask.flags.writeable = False
+
+    @property
+    def bbox(self):
+        return self._bbox
+
+    @property
+    def shape_indexes(self):
+        return self._shape_indexes
+
+    @property
+    def relevant_index_set(self):
+        return list(self._shape_indexes)
+
+    def __len__(self):
+        return len(self._shape_indexes)
+
+    def getPoints(self, shape_index):
+        return self._gshhg.getPoints(shape_index)
+
+    def isOverLand(self, point_lon_lat):
+        return self._gshhg._is_over_land(point_lon_lat, self._shape_mask)
+
+    def isOverLand_many(self, points_lon_lat):
+        """ isOverLand for an array of (lon, lat) points, returns a boolean array
+        """
+        return self._gshhg._is_over_land_many(points_lon_lat, self._shape_mask)
@@ -0,0 +1,221 @@
+""" Scene land mask rasterized from the GSHHG coastline
+
+The GSHHG polygons relevant for a scene are filled once on a regular lon/lat
+raster with an even-odd scanline fill, and the raster is sampled at the
+geolocation of the image grid. The mask is stored in cells of step x step
+image pixels, land buffering is a Euclidean distance transform of the mask,
+and land lookups of detections are O(1).
+"""
+
+import os
+
+import numpy as np
+from scipy import ndimage
+
+
+# Largest difference in degrees between the image corners of a scene and the ones of a cached mask
+GEOLOCATION_TOLERANCE = 1e-4
+
+
+def _fill_polygon(raster, polygon, lon0, lat0, d_lon, d_lat):
+    """ Even-odd scanline fill of polygon [(lon, lat), ...] in the boolean raster, where the
+        pixel (row, col) has its center at (lon0 + (col + 0.5)*d_lon, lat0 + (row + 0.5)*d_lat)
+    """
+    points = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 3:
+        return
+    rows, cols = raster.shape
+    # Raster coordinates, pixel centers at integer positions
+    u1 = (points[:, 0] - lon0) / d_lon - 0.5
+    v1 = (points[:, 1] - lat0) / d_lat - 0.5
+    u2 = np.roll(u1, -1)
+    v2 = np.roll(v1, -1)
+
+    # Rows crossed by every edge, [row_start, row_stop)
+    row_start = np.clip(np.ceil(np.minimum(v1, v2)), 0, rows).astype(np.int64)
+    row_stop = np.clip(np.ceil(np.maximum(v1, v2)), 0, rows).astype(np.int64)
+    counts = row_stop - row_start
+    if counts.sum() == 0:
+        return
+    edge = np.repeat(np.arange(len(counts)), counts)
+    crossing_row = row_start[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(counts) - counts, counts)
+    crossing_u = u1[edge] + (crossing_row - v1[edge]) * (u2[edge] - u1[edge]) / (v2[edge] - v1[edge])
+
+    # Every crossing toggles the pixels to its right, only the window of the polygon is filled
+    r0, r1 = crossing_row.min(), crossing_row.max() + 1
+    crossing_col = np.clip(np.floor(crossing_u) + 1, 0, cols).astype(np.int64)
+    c0, c1 = crossing_col.min(), crossing_col.max()
+    if c1 <= c0:
+        return
+    width = c1 - c0 + 1
+    toggles = np.bincount((crossing_row - r0) * width + crossing_col - c0, minlength=(r1 - r0) * width)
+    inside = np.cumsum(toggles.reshape(r1 - r0, width)[:, :-1], axis=1) % 2 == 1
+    raster[r0:r1, c0:c1] |= inside
+
+
+class LandMask:
+    """ Boolean land mask of a scene on the image grid, in cells of step x step pixels.
+        corners is the (4, 2) array of the [lat, lon] image corners and coastline_file the
+        coastline of the mask, both identify the scene in a cache file.
+    """
+
+    def __init__(self, mask, step, image_shape, corners=None, coastline_file=''):
+        self.mask = np.asarray(mask, dtype=bool)
+        self.step = step
+        self.image_shape = tuple(image_shape)
+        self.corners = None if corners is None else np.asarray(corners, dtype=np.float64).reshape(4, 2)
+        self.coastline_file = coastline_file
+
+    def buffered(self, buffer_pixels):
+        """ Land mask grown by buffer_pixels image pixels, with a Euclidean distance transform
+        """
+        if buffer_pixels <= 0 or not self.mask.any() or self.mask.all():
+            mask = self.mask.copy()
+        else:
+            mask = ndimage.distance_transform_edt(~self.mask, sampling=self.step) <= buffer_pixels
+        return LandMask(mask, self.step, self.image_shape, self.corners, self.coastline_file)
+
+    def _cell(self, x, y):
+        rows, cols = self.mask.shape
+        row = np.clip(np.asarray(y, dtype=np.int64) // self.step, 0, rows - 1)
+        col = np.clip(np.asarray(x, dtype=np.int64) // self.step, 0, cols - 1)
+        return row, col
+
+    def is_land(self, x, y):
+        """ Land flag of the image points (x, y), scalars or arrays
+        """
+        return self.mask[self._cell(x, y)]
+
+    def keep_mask(self, detections):
+        """ Boolean mask of the detections [(x, y)] over sea
+        """
+        detections = np.asarray(detections, dtype=np.float64).reshape(-1, 2)
+        if len(detections) == 0:
+            return np.zeros(shape=(0,), dtype=bool)
+        return ~self.is_land(detections[:, 0], detections[:, 1])
+
+    def get_window(self, x0, y0, x1, y1):
+        """ Full resolution land mask of the image window [y0:y1, x0:x1]
+        """
+        row, col = self._cell(np.arange(x0, x1), np.arange(y0, y1))
+        return self.mask[row[:, np.newaxis], col[np.newaxis, :]]
+
+    def fill_land(self, roi, offset_x=0, offset_y=0):
+        """ Fills, in place, the land pixels of roi, whose top left corner is (offset_x, offset_y)
+            in the image, with the mean of its sea pixels
+        """
+        size_y, size_x = roi.shape
+        land = self.get_window(offset_x, offset_y, offset_x + size_x, offset_y + size_y)
+        if land.any() and not land.all():
+            roi[land] = np.mean(roi[~land])
+        return roi
+
+    def matches(self, image_shape, step, corners, coastline_file):
+        """ True when the mask is the one of a scene of image_shape, step, image corners and
+            coastline file, the corners are compared with GEOLOCATION_TOLERANCE
+        """
+        return (self.image_shape == tuple(image_shape) and self.step == step and
+                self.coastline_file == coastline_file and self.corners is not None and
+                np.allclose(self.corners, corners, rtol=0, atol=GEOLOCATION_TOLERANCE))
+
+    def save(self, cache_file):
+        arrays = {'mask': self.mask, 'step': self.step, 'image_shape': self.image_shape,
+                  'coastline_file': self.coastline_file}
+        if self.corners is not None:
+            arrays['corners'] = self.corners
+        # Written aside and renamed, readers never see a partial file
+        temp_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+        try:
+            with open(temp_file, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.rename(temp_file, cache_file)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    @staticmethod
+    def load(cache_file):
+        with np.load(cache_file) as cache:
+            corners = cache['corners'] if 'corners' in cache.files else None
+            coastline_file = str(cache['coastline_file']) if 'coastline_file' in cache.files else ''
+            return LandMask(cache['mask'], int(cache['step']), tuple(int(s) for s in cache['image_shape']),
+                            corners, coastline_file)
+
+
+def rasterize_land_mask(sar_sensor, gshhs_map, image_shape, step=8):
+    """ Land mask of an image of image_shape (lines, samples). sar_sensor.getGeoLocation(x, y)
+        geolocates arrays of image points to [lat, lon] and gshhs_map is a GSHHG coastline,
+        only its subset of the scene bounding box is read, gshhs_map itself is not modified.
+        Scenes crossing the antimeridian are rasterized with longitudes unwrapped to [0, 360),
+        and the coastline west of the antimeridian is shifted by 360 degrees.
+    """
+    lines, samples = image_shape
+    xs = np.arange(0, samples, step) + (step - 1) / 2.0
+    ys = np.arange(0, lines, step) + (step - 1) / 2.0
+    grid_x, grid_y = np.meshgrid(np.minimum(xs, samples - 1), np.minimum(ys, lines - 1))
+    lat, lon = sar_sensor.getGeoLocation(grid_x, grid_y)
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if lon.max() - lon.min() > 180:
+        lon = np.where(lon < 0, lon + 360, lon)
+
+    # Lon/lat raster over the scene, twice as fine as the mask cells
+    raster_shape = (2 * len(ys), 2 * len(xs))
+    d_lon = max((lon.max() - lon.min()) / (raster_shape[1] - 2), 1e-9)
+    d_lat = max((lat.max() - lat.min()) / (raster_shape[0] - 2), 1e-9)
+    lon0 = lon.min() - d_lon
+    lat0 = lat.min() - d_lat
+    lon1 = lon0 + raster_shape[1] * d_lon
+    lat1 = lat0 + raster_shape[0] * d_lat
+    raster = np.zeros(shape=raster_shape, dtype=bool)
+    # The coastline beyond the antimeridian is read and filled 360 degrees away
+    shifts = [0.0] + ([360.0] if lon1 > 180 else []) + ([-360.0] if lon0 < -180 else [])
+    for shift in shifts:
+        scene_map = gshhs_map.subset([lon0 - shift, lat0, lon1 - shift, lat1])
+        for i in scene_map.shape_indexes:
+            points = np.asarray(scene_map.getPoints(i), dtype=np.float64).reshape(-1, 2)
+            if shift != 0:
+                points = points + [shift, 0.0]
+            _fill_polygon(raster, points, lon0, lat0, d_lon, d_lat)
+
+    # Sample the raster at the geolocation of the mask cells
+    row = np.clip(((lat - lat0) / d_lat).astype(np.int64), 0, raster_shape[0] - 1)
+    col = np.clip(((lon - lon0) / d_lon).astype(np.int64), 0, raster_shape[1] - 1)
+    return LandMask(raster[row, col], step, image_shape)
+
+
+def _get_image_corners(sar_sensor, image_shape):
+    """ (4, 2) array of the [lat, lon] geolocation of the corners of an image of image_shape
+    """
+    lines, samples = image_shape
+    x = np.array([0, samples - 1, 0, samples - 1], dtype=np.float64)
+    y = np.array([0, 0, lines - 1, lines - 1], dtype=np.float64)
+    lat, lon = sar_sensor.getGeoLocation(x, y)
+    return np.column_stack((np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)))
+
+
+def get_land_mask(sar_sensor, gshhs_map, image_shape, step=8, cache_file=None):
+    """ Land mask of a scene, read from cache_file (.npz) when it exists for the same image
+        shape, step, coastline file and geolocation of the image corners, otherwise rasterized
+        and written to cache_file. Scenes of the same orbit and frame share their cache file
+        only while their footprints match.
+    """
+    corners = _get_image_corners(sar_sensor, image_shape)
+    coastline_file = getattr(gshhs_map, 'file', None)
+    coastline_file = os.path.abspath(coastline_file) if coastline_file else ''
+    if cache_file is not None:
+        try:
+            land_mask = LandMask.load(cache_file)
+            if land_mask.matches(image_shape, step, corners, coastline_file):
+                return land_mask
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+    land_mask = rasterize_land_mask(sar_sensor, gshhs_map, image_shape, step)
+    land_mask.corners = corners
+    land_mask.coastline_file = coastline_file
+    if cache_file is not None:
+        try:
+            land_mask.save(cache_file)
+        except (IOError, OSError):
+            pass
+    return land_mask
@@ -7,6 +7,12 @@ from roi_frame import ROIFrame
 
 from roi_tools import fiil_in_lower_regions
 
+from cfar_tools import CFARDetector
 from cfar_tools import cfar_roi
+from cfar_tools import cfar_measure_roi
+from cfar_tools import cfar_scene
+from cfar_tools import cfar_prescreen
+from cfar_tools import image_pyramid
 from cfar_tools import filter_detections
+from cfar_tools import land_keep_mask
 
@@ -1,7 +1,22 @@
 
+import collections
+import multiprocessing
+from multiprocessing import sharedctypes
+
 import numpy as np
 from scipy import ndimage
-from scipy import signal
+from scipy.fftpack import next_fast_len
+
+from roi_frame import ROIFrame
+
+
+BG_WINDOW_SIZE = 64
+
+# Directions of the land probes around a detection
+LAND_PROBES = [(-1, -1), (-1, 1), (1, -1), (1, 1), (-1, 0), (1, 0), (0, -1), (0, 1)]
+
+# Scene image shared with the cfar_scene pool workers, set by the pool initializer
+_scene = {}
 
 
 def _create_bg_window(bg_window_size, guard_window_size=None):
@@ -21,61 +36,382 @@ def _create_target_window(bg_window_size, target_window_size):
 
 
 def _clear_border(_roi, border_size):
-    _roi[0:border_size, :] = 0.0
-    _roi[-border_size:, :] = 0.0
-    _roi[:, 0:border_size] = 0.0
-    _roi[:, -border_size:] = 0.0
+    _roi[..., 0:border_size, :] = 0.0
+    _roi[..., -border_size:, :] = 0.0
+    _roi[..., :, 0:border_size] = 0.0
+    _roi[..., :, -border_size:] = 0.0
     return _roi
 
 
-def cfar_roi(roi):
-
-    roi_target = roi.copy()
-    roi_bg = roi.copy()
-
-    # Truncate background values
-    img_mean = np.mean(roi)
-    img_std = np.std(roi)
-    roi_bg[roi > 5.0*img_mean] = 5.0*img_mean
-    bg_window_size = 64
-    border_size = bg_window_size/2
-    target_window_size = 6
-    bg_window = _create_bg_window(bg_window_size)
-    target_window = _create_target_window(bg_window_size, target_window_size)
-
-    # CFAR
-    cfar_img = np.zeros(shape=roi_target.shape)
-    mean_cfar = signal.fftconvolve(roi_bg, bg_window, mode='same') / np.sum(bg_window)
-    mean_cfar = _clear_border(mean_cfar, border_size)
-    sigma_cfar = signal.fftconvolve(abs(roi_bg - mean_cfar), bg_window, mode='same') / np.sum(bg_window)
-    sigma_cfar = _clear_border(sigma_cfar, border_size)
-    target_cfar = signal.fftconvolve(roi_target, target_window, mode='same') / np.sum(target_window)
-    target_cfar = _clear_border(target_cfar, border_size)
-    th_scale = 10.0
-    th_matrix = img_mean/10.0 + mean_cfar + th_scale*sigma_cfar
-    cfar_img[target_cfar > th_matrix] = 1
-
-    # Detections
-    s = np.ones(shape=(3, 3))
-    all_labels = ndimage.measurements.label(cfar_img, structure=s)
-    label_list = np.unique(all_labels[0])
-    inv_detections = ndimage.measurements.center_of_mass(cfar_img, all_labels[0], label_list[1:])
-    detections = [(int(x[1]), int(x[0])) for x in inv_detections]
+def _sliding_sums(img, window_profile, axis):
+    """ Sums of img along axis over the runs of ones of a 1-D binary window, with the same
+        alignment and zero padding as a 'same' convolution, from one cumulative sum.
+        The cumulative sum and the sums are float64, float32 prefix sums lose the small window
+        sums of long rows.
+    """
+    axis = axis % img.ndim
+    size = img.shape[axis]
+    center = (len(window_profile) - 1) // 2
+    shape = list(img.shape)
+    shape[axis] = 1
+    cum = np.concatenate([np.zeros(shape=shape), np.cumsum(img, axis=axis, dtype=np.float64)], axis)
+    edges = np.diff(np.concatenate([[0], window_profile, [0]]))
+    index = np.arange(size)
+    sums = np.zeros(shape=img.shape)
+    for start, stop in zip(np.nonzero(edges > 0)[0], np.nonzero(edges < 0)[0]):
+        # Window cells [start, stop) cover the pixels [i + center - stop + 1, i + center - start]
+        upper = np.clip(index + center - start + 1, 0, size)
+        lower = np.clip(index + center - stop + 1, 0, size)
+        sums += np.take(cum, upper, axis=axis)
+        sums -= np.take(cum, lower, axis=axis)
+    return sums
+
+
+def _integral_convolve(img, window):
+    """ Same result as a 'same' FFT convolution of the last two axes of img with window, for
+        binary windows that are the outer product of a column and a row profile (box, box minus
+        cross), in O(1) per pixel for any window size.
+        Accumulates in float64, the result is float32 for float32 and small integer images,
+        float64 otherwise.
+    """
+    row_profile = window.max(axis=0)
+    col_profile = window.max(axis=1)
+    if not np.array_equal(window, np.outer(col_profile, row_profile)):
+        raise ValueError('Integral engine needs a separable binary window')
+    sums = _sliding_sums(img, col_profile, axis=-2)
+    sums = _sliding_sums(sums, row_profile, axis=-1)
+    return sums.astype(np.result_type(img.dtype, np.float32), copy=False)
+
+
+CFAR_ENGINES = ('fft', 'integral')
+
+DETECTION_DTYPE = np.dtype([('x', np.float64), ('y', np.float64), ('area', np.int64),
+                            ('x0', np.int64), ('y0', np.int64), ('x1', np.int64), ('y1', np.int64),
+                            ('peak', np.float64), ('mean', np.float64), ('snr', np.float64)])
+
+
+class CFARDetector(object):
+    """ CFAR detector with fixed parameters. The windows are built once and, for the 'fft'
+        engine, the window spectra are computed once per ROI shape and reused by every call.
+        Only the spectra of the last SPECTRA_CACHE_SIZE ROI shapes are kept.
+    """
+
+    SPECTRA_CACHE_SIZE = 4
+
+    def __init__(self, bg_window_size=BG_WINDOW_SIZE, guard_window_size=None, target_window_size=6,
+                 th_scale=10.0, engine='fft'):
+        if engine not in CFAR_ENGINES:
+            raise ValueError('Unknown CFAR engine {0}'.format(engine))
+        self.bg_window_size = bg_window_size
+        self.target_window_size = target_window_size
+        self.th_scale = th_scale
+        self.engine = engine
+        self.border_size = bg_window_size // 2
+        self.bg_window = _create_bg_window(bg_window_size, guard_window_size)
+        self.target_window = _create_target_window(bg_window_size, target_window_size)
+        self.bg_window_sum = np.sum(self.bg_window)
+        self.target_window_sum = np.sum(self.target_window)
+        self._spectra = collections.OrderedDict()
+
+    def _get_spectra(self, shape):
+        """ FFT shape and (bg, target) window spectra for ROIs of shape (rows, cols)
+        """
+        shape = tuple(shape)
+        spectra = self._spectra.pop(shape, None)
+        if spectra is None:
+            fft_shape = tuple(next_fast_len(size + self.bg_window_size - 1) for size in shape)
+            spectra = (fft_shape, np.fft.rfftn(self.bg_window, fft_shape),
+                       np.fft.rfftn(self.target_window, fft_shape))
+            while len(self._spectra) >= self.SPECTRA_CACHE_SIZE:
+                self._spectra.popitem(last=False)
+        self._spectra[shape] = spectra
+        return spectra
+
+    def _convolve(self, rois, window, spectrum):
+        """ 'same' convolution of every ROI of the (n, rows, cols) stack rois with window
+        """
+        if self.engine == 'integral':
+            return _integral_convolve(rois, window)
+        size_y, size_x = rois.shape[-2:]
+        fft_shape = self._get_spectra((size_y, size_x))[0]
+        full = np.fft.irfftn(np.fft.rfftn(rois, fft_shape, axes=(-2, -1)) * spectrum, fft_shape, axes=(-2, -1))
+        start = (self.bg_window_size - 1) // 2
+        return full[..., start:start + size_y, start:start + size_x]
+
+    def detect(self, roi, img_mean=None):
+        """ CFAR detections [(x, y)] of roi. img_mean is the image mean used for the background
+            truncation and the threshold, by default the mean of roi
+        """
+        return self.detect_batch(roi[np.newaxis], None if img_mean is None else [img_mean])[0]
+
+    def detect_batch(self, rois, img_means=None, batch_size=4):
+        """ CFAR detections of a (n, rows, cols) stack of ROIs, one list of detections per ROI.
+            img_means are the image means of the ROIs, by default the mean of every ROI.
+            The ROIs are convolved batch_size at a time, in one batched FFT per window.
+        """
+        return [[(int(d['x']), int(d['y'])) for d in measurements]
+                for measurements in self.measure_batch(rois, img_means, batch_size)]
+
+    def measure(self, roi, img_mean=None):
+        """ CFAR detections of roi with their measurements, as an array of DETECTION_DTYPE
+        """
+        return self.measure_batch(roi[np.newaxis], None if img_mean is None else [img_mean])[0]
+
+    def measure_batch(self, rois, img_means=None, batch_size=4):
+        """ Same as detect_batch, with one array of DETECTION_DTYPE per ROI
+        """
+        rois = np.asarray(rois)
+        if img_means is None:
+            img_means = [np.mean(roi) for roi in rois]
+        measurements = []
+        for i in range(0, len(rois), batch_size):
+            measurements.extend(self._measure_stack(rois[i:i + batch_size], img_means[i:i + batch_size]))
+        return measurements
+
+    def threshold(self, roi, img_mean=None):
+        """ Binary CFAR image of roi, True where the target mean is above the threshold
+        """
+        return self._threshold_stack(roi[np.newaxis], [np.mean(roi) if img_mean is None else img_mean])[0][0]
+
+    def _measure_stack(self, rois, img_means):
+        cfar_imgs, mean_cfar = self._threshold_stack(rois, img_means)
+        return [measure_detections(cfar_img, roi, bg_mean) for cfar_img, roi, bg_mean in zip(cfar_imgs, rois, mean_cfar)]
+
+    def _threshold_stack(self, rois, img_means):
+        """ Binary CFAR images and background means of a stack of ROIs
+        """
+        img_means = np.asarray(img_means, dtype=np.float64)[:, np.newaxis, np.newaxis]
+        bg_spectrum = target_spectrum = None
+        if self.engine == 'fft':
+            _, bg_spectrum, target_spectrum = self._get_spectra(rois.shape[-2:])
+
+        # Truncate background values
+        roi_bg = rois.copy()
+        truncate = rois > 5.0*img_means
+        roi_bg[truncate] = np.broadcast_to(5.0*img_means, rois.shape)[truncate]
+
+        # CFAR
+        mean_cfar = self._convolve(roi_bg, self.bg_window, bg_spectrum) / self.bg_window_sum
+        mean_cfar = _clear_border(mean_cfar, self.border_size)
+        sigma_cfar = self._convolve(abs(roi_bg - mean_cfar), self.bg_window, bg_spectrum) / self.bg_window_sum
+        sigma_cfar = _clear_border(sigma_cfar, self.border_size)
+        target_cfar = self._convolve(rois, self.target_window, target_spectrum) / self.target_window_sum
+        target_cfar = _clear_border(target_cfar, self.border_size)
+        th_matrix = img_means/10.0 + mean_cfar + self.th_scale*sigma_cfar
+        cfar_imgs = target_cfar > th_matrix
+        return cfar_imgs, mean_cfar
+
+
+def measure_detections(cfar_img, roi, bg_mean):
+    """ Measures the 8-connected components of the binary image cfar_img in one pass over
+        their pixels. Returns an array of DETECTION_DTYPE with, for every component, the
+        centroid (x, y), the area, the bounding box [x0, x1) x [y0, y1), the peak and mean
+        of roi, and the local SNR: mean of roi over mean of the background estimate bg_mean
+    """
+    labels, num_labels = ndimage.measurements.label(cfar_img, structure=np.ones(shape=(3, 3)))
+    detections = np.zeros(shape=(num_labels,), dtype=DETECTION_DTYPE)
+    if num_labels == 0:
+        return detections
+
+    # Measurements over the component pixels only
+    pixels = np.flatnonzero(labels)
+    pixel_labels = labels.ravel()[pixels]
+    ys, xs = np.divmod(pixels, labels.shape[1])
+    values = roi.ravel()[pixels].astype(np.float64)
+
+    area = np.bincount(pixel_labels, minlength=num_labels + 1)[1:]
+    detections['area'] = area
+    detections['x'] = np.bincount(pixel_labels, xs, minlength=num_labels + 1)[1:] / area
+    detections['y'] = np.bincount(pixel_labels, ys, minlength=num_labels + 1)[1:] / area
+    for detection, (rows, cols) in zip(detections, ndimage.find_objects(labels)):
+        detection['x0'], detection['x1'] = cols.start, cols.stop
+        detection['y0'], detection['y1'] = rows.start, rows.stop
+    detections['peak'] = ndimage.maximum(values, pixel_labels, np.arange(1, num_labels + 1))
+    detections['mean'] = np.bincount(pixel_labels, values, minlength=num_labels + 1)[1:] / area
+    bg = np.bincount(pixel_labels, bg_mean.ravel()[pixels], minlength=num_labels + 1)[1:] / area
+    with np.errstate(divide='ignore', invalid='ignore'):
+        detections['snr'] = np.where(bg > 0, detections['mean'] / bg, np.inf)
     return detections
 
 
-def filter_detections(sar_sensor, gshhs_map, global_detections):
-    filtered_detections = []
-    buffer_land = 500
-    for det in global_detections:
-        is_land = False
-        for a,b in [(-1,-1), (-1,1), (1,-1), (1,1), (-1,0), (1,0), (0,-1), (0,1)]:
-            absolute_x = det[0] + a*buffer_land
-            absolute_y = det[1] + b*buffer_land
-            lat, lon = sar_sensor.getGeoLocation(absolute_x, absolute_y)
-            is_land = is_land or gshhs_map.isOverLand([lon, lat])
-            if is_land:
-                break
-        if not is_land:
-            filtered_detections.append(det)
-    return filtered_detections
+def cfar_roi(roi, img_mean=None, engine='fft'):
+    """ CFAR detections [(x, y)] of roi with the default CFARDetector parameters.
+        img_mean is the image mean used for the background truncation and the threshold,
+        by default the mean of roi.
+        engine is 'fft' (FFT convolutions) or 'integral' (summed-area tables, cost independent
+        of the window sizes)
+    """
+    return CFARDetector(engine=engine).detect(roi, img_mean)
+
+
+def cfar_measure_roi(roi, img_mean=None, engine='fft'):
+    """ Same as cfar_roi, with the measurements of every detection as an array of DETECTION_DTYPE
+    """
+    return CFARDetector(engine=engine).measure(roi, img_mean)
+
+
+def _plan_tiles(shape, tile_size, halo, region=None):
+    """ Tiles of the region (x0, y0, x1, y1) of an image of the given shape, by default the
+        full image, as (core, frame), where core = (x0, y0, x1, y1) is the part of the image
+        owned by the tile and frame is the ROIFrame of the core extended by halo pixels on every side
+    """
+    size_y, size_x = shape
+    region_x0, region_y0, region_x1, region_y1 = region if region is not None else (0, 0, size_x, size_y)
+    tiles = []
+    for y0 in range(region_y0, region_y1, tile_size):
+        y1 = min(y0 + tile_size, region_y1)
+        for x0 in range(region_x0, region_x1, tile_size):
+            x1 = min(x0 + tile_size, region_x1)
+            frame_x0 = max(x0 - halo, 0)
+            frame_y0 = max(y0 - halo, 0)
+            frame = ROIFrame(frame_x0, frame_y0, min(x1 + halo, size_x) - frame_x0, min(y1 + halo, size_y) - frame_y0)
+            tiles.append(((x0, y0, x1, y1), frame))
+    return tiles
+
+
+def _block_mean(image, factor):
+    """ Means of the factor x factor blocks of image, partial blocks at the bottom and right borders
+    """
+    rows = np.arange(0, image.shape[0], factor)
+    cols = np.arange(0, image.shape[1], factor)
+    sums = np.add.reduceat(np.add.reduceat(image, rows, axis=0, dtype=np.float64), cols, axis=1)
+    counts = np.outer(np.diff(np.append(rows, image.shape[0])), np.diff(np.append(cols, image.shape[1])))
+    return sums / counts
+
+
+def image_pyramid(image, levels):
+    """ Decimated pyramid of image, the level i (from 1 to levels) is the 2^i x 2^i block mean of image
+    """
+    pyramid = []
+    for _ in range(levels):
+        image = _block_mean(image, 2)
+        pyramid.append(image)
+    return pyramid
+
+
+def cfar_prescreen(image, levels=2, th_scale=5.0, margin=2, cell_size=256, tile_size=2048, img_mean=None):
+    """ Candidate regions of image for the full resolution CFAR, as tiles (core, ROIFrame)
+        with a halo of the background window size (see cfar_scene).
+        A CFAR detector scaled to the pyramid level levels, with the relaxed threshold scale
+        th_scale, runs on the block means of the image. The cells of cell_size pixels with
+        coarse detections, dilated by margin coarse pixels, are the candidates, merged along
+        the rows in tiles of at most tile_size pixels.
+        The coarse detector has no statistics on its border, which is wider than the full
+        resolution border (BG_WINDOW_SIZE // 2 pixels) from levels 4. The part of its border
+        where the full run detects is always a candidate, so every full resolution detection
+        whose block mean passes the relaxed threshold, or that lies within the coarse border,
+        is found exactly as in a full run.
+    """
+    if img_mean is None:
+        img_mean = np.mean(image, dtype=np.float64)
+    factor = 2 ** levels
+    coarse = image_pyramid(image, levels)[-1]
+    detector = CFARDetector(bg_window_size=max(BG_WINDOW_SIZE // factor, 8), target_window_size=2, th_scale=th_scale)
+    candidates = detector.threshold(coarse, img_mean)
+    if margin > 0 and candidates.any():
+        candidates = ndimage.binary_dilation(candidates, structure=np.ones(shape=(3, 3)), iterations=margin)
+    # Coarse border pixels inside the full resolution detection area
+    coarse_border = detector.border_size
+    full_border = BG_WINDOW_SIZE // 2 // factor
+    if coarse_border > full_border:
+        edge = np.zeros(shape=coarse.shape, dtype=bool)
+        edge[full_border:coarse.shape[0] - full_border, full_border:coarse.shape[1] - full_border] = True
+        edge[coarse_border:-coarse_border, coarse_border:-coarse_border] = False
+        candidates |= edge
+    cells = _block_mean(candidates, max(cell_size // factor, 1)) > 0
+    cell_size = max(cell_size // factor, 1) * factor
+    max_run = max(tile_size // cell_size, 1)
+    size_y, size_x = image.shape
+    tiles = []
+    for row, cols in enumerate(cells):
+        y0 = row * cell_size
+        y1 = min(y0 + cell_size, size_y)
+        # Runs of consecutive candidate cells, split in runs of at most max_run cells
+        cols = np.flatnonzero(cols)
+        starts = np.flatnonzero(np.diff(np.append(-2, cols)) != 1)
+        for start, stop in zip(starts, np.append(starts[1:], len(cols))):
+            for run_start in range(start, stop, max_run):
+                run_stop = min(run_start + max_run, stop)
+                x0 = cols[run_start] * cell_size
+                x1 = min((cols[run_stop - 1] + 1) * cell_size, size_x)
+                tiles.extend(_plan_tiles(image.shape, tile_size, BG_WINDOW_SIZE, (x0, y0, x1, y1)))
+    return tiles
+
+
+def _init_scene(raw_image, shape, img_mean, engine):
+    _scene['image'] = np.frombuffer(raw_image, dtype=np.float32).reshape(shape)
+    _scene['img_mean'] = img_mean
+    _scene['detector'] = CFARDetector(engine=engine)
+
+
+def _cfar_tile(tile, image, img_mean, detector):
+    """ Detections of a (core, frame) tile of image owned by its core, in image coordinates
+    """
+    core, frame = tile
+    detections = detector.detect(frame.cut_image_roi(image), img_mean)
+    return [(x, y) for x, y in frame.transform_points_global(detections)
+            if core[0] <= x < core[2] and core[1] <= y < core[3]]
+
+
+def _cfar_scene_tile(tile):
+    return _cfar_tile(tile, _scene['image'], _scene['img_mean'], _scene['detector'])
+
+
+def cfar_scene(image, tile_size=2048, workers=None, engine='fft', prescreen_levels=None):
+    """ CFAR detections [(x, y)] of a full scene, computed on tiles of tile_size pixels
+        by a pool of workers processes (all cores when workers is None).
+        Every tile is read with a halo of the background window size, the detection
+        statistics of its core are then the same as the ones of cfar_roi on the full
+        image, and detections are kept only by the tile that owns them.
+        The image is shared with the workers as float32 and is never pickled, every worker
+        builds one CFARDetector and reuses its window spectra for all its tiles.
+        engine is the cfar_roi engine.
+        With prescreen_levels, only the candidate regions of cfar_prescreen at that pyramid
+        level are processed at full resolution.
+    """
+    shape = image.shape
+    img_mean = np.mean(image, dtype=np.float64)
+    if prescreen_levels:
+        tiles = cfar_prescreen(image, prescreen_levels, tile_size=tile_size, img_mean=img_mean)
+    else:
+        tiles = _plan_tiles(shape, tile_size, BG_WINDOW_SIZE)
+    if not tiles:
+        return []
+    if workers == 1 or len(tiles) == 1:
+        image = image.astype(np.float32, copy=False)
+        detector = CFARDetector(engine=engine)
+        results = [_cfar_tile(tile, image, img_mean, detector) for tile in tiles]
+    else:
+        raw_image = sharedctypes.RawArray('f', image.size)
+        np.frombuffer(raw_image, dtype=np.float32).reshape(shape)[...] = image
+        pool = multiprocessing.Pool(workers, initializer=_init_scene, initargs=(raw_image, shape, img_mean, engine))
+        try:
+            results = pool.map(_cfar_scene_tile, tiles, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return sorted(set(det for detections in results for det in detections), key=lambda det: (det[1], det[0]))
+
+
+def land_keep_mask(sar_sensor, gshhs_map, global_detections, buffer_land=500, probes=LAND_PROBES):
+    """ Boolean mask of the detections to keep, False for the detections with a probe point over land.
+        The probe points of a detection (x, y) are (x + a*buffer_land, y + b*buffer_land) for every
+        (a, b) of probes. All the probe points are geolocated with one sar_sensor.getGeoLocation call
+        and tested with one gshhs_map.isOverLand_many call.
+    """
+    detections = np.asarray(global_detections, dtype=np.float64).reshape(-1, 2)
+    if len(detections) == 0:
+        return np.zeros(shape=(0,), dtype=bool)
+    offsets = np.asarray(probes, dtype=np.float64).reshape(-1, 2) * buffer_land
+    probe_x = detections[:, 0:1] + offsets[:, 0]
+    probe_y = detections[:, 1:2] + offsets[:, 1]
+    lat, lon = sar_sensor.getGeoLocation(probe_x.ravel(), probe_y.ravel())
+    is_land = gshhs_map.isOverLand_many(np.column_stack((lon, lat)))
+    return ~np.asarray(is_land, dtype=bool).reshape(probe_x.shape).any(axis=1)
+
+
+def filter_detections(sar_sensor, gshhs_map, global_detections, buffer_land=500, probes=LAND_PROBES):
+    """ Detections without land at buffer_land pixels in the directions probes, see land_keep_mask
+    """
+    keep = land_keep_mask(sar_sensor, gshhs_map, global_detections, buffer_land, probes)
+    return [det for det, keep_det in zip(global_detections, keep) if keep_det]
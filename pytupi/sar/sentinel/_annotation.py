@@ -0,0 +1,141 @@
+""" Streaming parsers for Sentinel-1 annotation and calibration XML files
+
+The parsers never build the full XML tree, every element is released once it
+has been read, and every record (grid point, burst, calibration vector) is
+converted to numbers before its subtree is released.
+Both return a flat dict of scalars and numpy arrays, which can be stored
+as-is in a .npz file.
+"""
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+import numpy as np
+
+
+ANNOTATION_FIELDS = {
+    'product/adsHeader/productType': ('productType', str),
+    'product/adsHeader/polarisation': ('polarisation', str),
+    'product/adsHeader/swath': ('swath', str),
+    'product/adsHeader/mode': ('mode', str),
+    'product/generalAnnotation/productInformation/rangeSamplingRate': ('rangeSamplingRate', float),
+    'product/imageAnnotation/imageInformation/productFirstLineUtcTime': ('productFirstLineUtcTime', str),
+    'product/imageAnnotation/imageInformation/productLastLineUtcTime': ('productLastLineUtcTime', str),
+    'product/imageAnnotation/imageInformation/slantRangeTime': ('slantRangeTime', float),
+    'product/imageAnnotation/imageInformation/rangePixelSpacing': ('rangePixelSpacing', float),
+    'product/imageAnnotation/imageInformation/azimuthPixelSpacing': ('azimuthPixelSpacing', float),
+    'product/imageAnnotation/imageInformation/azimuthTimeInterval': ('azimuthTimeInterval', float),
+    'product/imageAnnotation/imageInformation/numberOfSamples': ('numberOfSamples', int),
+    'product/imageAnnotation/imageInformation/numberOfLines': ('numberOfLines', int),
+    'product/swathTiming/linesPerBurst': ('linesPerBurst', int),
+    'product/swathTiming/samplesPerBurst': ('samplesPerBurst', int),
+}
+
+GEOLOCATION_GRID_POINT = 'product/geolocationGrid/geolocationGridPointList/geolocationGridPoint'
+BURST = 'product/swathTiming/burstList/burst'
+CALIBRATION_VECTOR = 'calibration/calibrationVectorList/calibrationVector'
+
+
+def _iter_elements(xml_file, records=()):
+    """ Streams (path, element) for every closed element of xml_file (file name or file object).
+        Every element is detached from its parent once it has been consumed, except the
+        descendants of the records paths, which are kept until their record is consumed.
+    """
+    path = []
+    parents = []
+    record_depth = None
+    for event, elem in ElementTree.iterparse(xml_file, events=('start', 'end')):
+        if event == 'start':
+            path.append(elem.tag)
+            parents.append(elem)
+            if record_depth is None and '/'.join(path) in records:
+                record_depth = len(path)
+        else:
+            yield '/'.join(path), elem
+            depth = len(path)
+            path.pop()
+            parents.pop()
+            if record_depth is not None and depth > record_depth:
+                continue
+            if depth == record_depth:
+                record_depth = None
+            if parents:
+                parents[-1].remove(elem)
+
+
+def _seconds_from(time_strings, reference_time_string):
+    """ Seconds from reference_time_string for a list of UTC time strings
+    """
+    times = np.array(time_strings, dtype='datetime64[us]')
+    reference = np.datetime64(reference_time_string, 'us')
+    return (times - reference).astype(np.float64) / 1e6
+
+
+def parse_annotation(xml_file):
+    """ Parses a product annotation XML. Returns the scalars of ANNOTATION_FIELDS, the
+        geolocation grid as (azimuth, range) arrays and the burst list as arrays.
+    """
+    annotation = {}
+    grid = {'azimuthTime': [], 'slantRangeTime': [], 'pixel': [], 'latitude': [], 'longitude': [],
+            'incidenceAngle': []}
+    bursts = {'azimuthTime': [], 'firstValidSample': [], 'lastValidSample': []}
+    for path, elem in _iter_elements(xml_file, (GEOLOCATION_GRID_POINT, BURST)):
+        if path in ANNOTATION_FIELDS:
+            name, convert = ANNOTATION_FIELDS[path]
+            annotation[name] = convert(elem.text)
+        elif path == GEOLOCATION_GRID_POINT:
+            for key in grid:
+                grid[key].append(elem.findtext(key))
+            elem.clear()
+        elif path == BURST:
+            bursts['azimuthTime'].append(elem.findtext('azimuthTime'))
+            bursts['firstValidSample'].append(np.fromstring(elem.findtext('firstValidSample'), dtype=np.int64, sep=' '))
+            bursts['lastValidSample'].append(np.fromstring(elem.findtext('lastValidSample'), dtype=np.int64, sep=' '))
+            elem.clear()
+
+    first_line_time = annotation['productFirstLineUtcTime']
+
+    # Geolocation grid, the range period is the distance to the next grid point with the first pixel
+    pixel = np.asarray(grid['pixel'], dtype=np.float64)
+    repeated = np.nonzero(pixel[1:] == pixel[0])[0]
+    range_period = repeated[0] + 1 if len(repeated) > 0 else len(pixel)
+    grid_shape = (len(pixel) // range_period, range_period)
+    annotation['grid_pixel'] = pixel.reshape(grid_shape)
+    annotation['grid_azimuth_time'] = _seconds_from(grid['azimuthTime'], first_line_time).reshape(grid_shape)
+    annotation['grid_slant_range_time'] = np.asarray(grid['slantRangeTime'], dtype=np.float64).reshape(grid_shape)
+    annotation['grid_lat'] = np.asarray(grid['latitude'], dtype=np.float64).reshape(grid_shape)
+    annotation['grid_lon'] = np.asarray(grid['longitude'], dtype=np.float64).reshape(grid_shape)
+    annotation['grid_inc'] = np.asarray(grid['incidenceAngle'], dtype=np.float64).reshape(grid_shape)
+
+    # Burst list, empty for GRD products
+    lines_per_burst = annotation.get('linesPerBurst', 0)
+    annotation['burst_azimuth_time'] = _seconds_from(bursts['azimuthTime'], first_line_time)
+    for key, name in [('firstValidSample', 'burst_first_valid_sample'), ('lastValidSample', 'burst_last_valid_sample')]:
+        if bursts[key]:
+            annotation[name] = np.vstack(bursts[key])
+        else:
+            annotation[name] = np.zeros(shape=(0, lines_per_burst), dtype=np.int64)
+    return annotation
+
+
+def parse_calibration(xml_file):
+    """ Parses a calibration XML into the line index vector and the
+        (lines, pixels) pixel index, sigma, beta, gamma and dn arrays
+    """
+    lines = []
+    vectors = {'pixel': [], 'sigmaNought': [], 'betaNought': [], 'gamma': [], 'dn': []}
+    for path, elem in _iter_elements(xml_file, (CALIBRATION_VECTOR,)):
+        if path == CALIBRATION_VECTOR:
+            lines.append(int(elem.findtext('line')))
+            for key in vectors:
+                vectors[key].append(np.fromstring(elem.findtext(key), dtype=np.float64, sep=' '))
+            elem.clear()
+    calibration = {'cal_line_index': np.asarray(lines, dtype=np.int64),
+                   'cal_pixels_index': np.vstack(vectors['pixel']).astype(np.int64),
+                   'cal_sigma_mat': np.vstack(vectors['sigmaNought']),
+                   'cal_beta_mat': np.vstack(vectors['betaNought']),
+                   'cal_gamma_mat': np.vstack(vectors['gamma']),
+                   'cal_dn_mat': np.vstack(vectors['dn'])}
+    return calibration
@@ -0,0 +1,164 @@
+""" Persistent catalog of Sentinel-1 products
+
+The catalog keeps the basic info of every product of an archive (name, pass
+direction, start/stop time and footprint) in a SQLite database. Scans are
+incremental: only products with a new modification time or size are read,
+and their manifests are parsed in a process pool. Footprint bounding boxes
+are indexed with an R*Tree and start and stop times with B-trees.
+
+Footprints crossing the antimeridian are stored with longitudes unwrapped to
+[0, 360), so their max_lon is above 180, and queries test both the bbox and
+the bbox shifted by 360 degrees.
+"""
+
+import os
+import sqlite3
+import warnings
+import multiprocessing
+
+import tools
+
+
+def _get_product_stat(s1_file):
+    """ Modification time and size of a product, for SAFE directories of its manifest file
+    """
+    if os.path.isdir(s1_file):
+        s1_file = os.path.join(s1_file, 'manifest.safe')
+    stat = os.stat(s1_file)
+    return stat.st_mtime, stat.st_size
+
+
+def _extract_basic_info(s1_file):
+    """ (s1_file, basic info, None) of a product, or (s1_file, None, error message) when it can not be read
+    """
+    try:
+        if os.path.isdir(s1_file):
+            return s1_file, tools.get_basic_info_from_safe_dir(s1_file), None
+        return s1_file, tools.get_basic_info_from_compressed_file(s1_file), None
+    except Exception as e:
+        return s1_file, None, str(e)
+
+
+def parse_footprint(coordinates):
+    """ Bounding box [min_lon, min_lat, max_lon, max_lat] of a footprint string 'lat,lon lat,lon ...'.
+        Footprints spanning more than 180 degrees of longitude cross the antimeridian, their
+        negative longitudes are shifted by 360 degrees.
+    """
+    points = [p.split(',') for p in coordinates.split()]
+    lats = [float(p[0]) for p in points]
+    lons = [float(p[1]) for p in points]
+    if max(lons) - min(lons) > 180:
+        lons = [lon + 360 if lon < 0 else lon for lon in lons]
+    return [min(lons), min(lats), max(lons), max(lats)]
+
+
+class Catalog:
+
+    PRODUCT_FIELDS = ['path', 'name', 'pass', 'start_time', 'stop_time', 'coordinates',
+                      'min_lon', 'min_lat', 'max_lon', 'max_lat']
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._connection = sqlite3.connect(db_file)
+        self._create_tables()
+        self.skipped_files = []
+
+    def _create_tables(self):
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS products ('
+                                     'id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER, '
+                                     'name TEXT, pass TEXT, start_time TEXT, stop_time TEXT, coordinates TEXT, '
+                                     'min_lon REAL, min_lat REAL, max_lon REAL, max_lat REAL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS products_start_time ON products (start_time)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS products_stop_time ON products (stop_time)')
+            self._connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS products_bbox '
+                                     'USING rtree(id, min_lon, max_lon, min_lat, max_lat)')
+
+    def close(self):
+        self._connection.close()
+
+    def scan(self, dir_path, processes=None):
+        """ Incremental scan of dir_path, new or modified products are parsed with a pool of
+            processes and products that are not in dir_path anymore are removed.
+            Returns the number of added or updated products, the products that can not be
+            read are warned about and listed in skipped_files.
+        """
+        s1_files = [f for files in tools.search_images(dir_path).values() for f in files]
+        known = dict((row[0], (row[1], row[2])) for row in
+                     self._connection.execute('SELECT path, mtime, size FROM products'))
+
+        stats = {}
+        for s1_file in s1_files:
+            stats[s1_file] = _get_product_stat(s1_file)
+        to_parse = [f for f in s1_files if known.get(f) != stats[f]]
+
+        results = []
+        if to_parse:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_extract_basic_info, to_parse)
+            finally:
+                pool.close()
+                pool.join()
+
+        root = os.path.join(os.path.abspath(dir_path), '')
+        removed = [p for p in known if os.path.abspath(p).startswith(root) and p not in stats]
+        updated = 0
+        self.skipped_files = []
+        with self._connection:
+            for path in removed:
+                self._delete(path)
+            for s1_file, basic_info, error in results:
+                if basic_info is None:
+                    warnings.warn('Skipping {0}: {1}'.format(s1_file, error))
+                    self.skipped_files.append(s1_file)
+                    continue
+                self._delete(s1_file)
+                self._insert(s1_file, stats[s1_file], basic_info)
+                updated += 1
+        return updated
+
+    def _delete(self, path):
+        self._connection.execute('DELETE FROM products_bbox WHERE id IN (SELECT id FROM products WHERE path = ?)',
+                                 (path,))
+        self._connection.execute('DELETE FROM products WHERE path = ?', (path,))
+
+    def _insert(self, path, stat, basic_info):
+        bbox = parse_footprint(basic_info['coordinates'])
+        cursor = self._connection.execute(
+            'INSERT INTO products (path, mtime, size, name, pass, start_time, stop_time, coordinates, '
+            'min_lon, min_lat, max_lon, max_lat) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, stat[0], stat[1], basic_info['name'], basic_info.get('OrbitReference'),
+             basic_info['startTime'], basic_info['stopTime'], basic_info['coordinates'],
+             bbox[0], bbox[1], bbox[2], bbox[3]))
+        self._connection.execute('INSERT INTO products_bbox (id, min_lon, max_lon, min_lat, max_lat) '
+                                 'VALUES (?, ?, ?, ?, ?)', (cursor.lastrowid, bbox[0], bbox[2], bbox[1], bbox[3]))
+
+    def query(self, bbox=None, start_time=None, stop_time=None):
+        """ Products whose footprint bounding box intersects bbox [min_lon, min_lat, max_lon, max_lat]
+            and whose acquisition intersects [start_time, stop_time], times as ISO strings
+            'YYYY-MM-DDTHH:MM:SS'. Returns a list of dicts with PRODUCT_FIELDS, ordered by start time.
+            The longitudes of bbox are in [-180, 180].
+        """
+        sql = 'SELECT {0} FROM products p'.format(', '.join(['p.' + f for f in self.PRODUCT_FIELDS]))
+        conditions = []
+        parameters = []
+        if bbox is not None:
+            # The shifted bbox finds the unwrapped footprints crossing the antimeridian
+            bbox_sql = ('SELECT id FROM products_bbox '
+                        'WHERE max_lon >= ? AND min_lon <= ? AND max_lat >= ? AND min_lat <= ?')
+            conditions.append('p.id IN ({0} UNION {0})'.format(bbox_sql))
+            conditions.append('p.max_lat >= ? AND p.min_lat <= ? AND ((p.max_lon >= ? AND p.min_lon <= ?) OR '
+                              '(p.max_lon >= ? AND p.min_lon <= ?))')
+            parameters.extend([bbox[0], bbox[2], bbox[1], bbox[3], bbox[0] + 360, bbox[2] + 360, bbox[1], bbox[3]])
+            parameters.extend([bbox[1], bbox[3], bbox[0], bbox[2], bbox[0] + 360, bbox[2] + 360])
+        if start_time is not None:
+            conditions.append('p.stop_time >= ?')
+            parameters.append(start_time)
+        if stop_time is not None:
+            conditions.append('p.start_time <= ?')
+            parameters.append(stop_time)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY p.start_time'
+        return [dict(zip(self.PRODUCT_FIELDS, row)) for row in self._connection.execute(sql, parameters)]
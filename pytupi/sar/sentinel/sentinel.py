@@ -9,30 +9,66 @@ C. Bentes - 2016
 """
 
 import os
+import io
 import datetime
+import zipfile
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import gdal
 from PIL import Image
 import xmltodict
-import scipy.ndimage
+
+import _annotation
 
 
 class Sentinel(object):
-    """ Sentinel 1A 1B representation
+    """ Sentinel 1A 1B representation. Every swath and polarisation of the product
+        is prepared as a SentinelProduct, by process() or by process_all()
     """
 
     __version__ = 'v1.0_r3'
 
-    def __init__(self, base_dir):
-
+    def __init__(self, base_dir, cache_dir=None, use_cache=True):
+        """ base_dir is a SAFE directory or a zip file with a SAFE directory, zip files are
+            read in place without extraction.
+            The parsed metadata of every product is cached in a <product id>.npz sidecar file,
+            written in cache_dir or next to base_dir when cache_dir is None
+        """
         self.base_dir = base_dir
-        self.base_name_id = os.path.basename(base_dir)
-        self.sentinel_input_file = os.path.join(base_dir, 'manifest.safe')
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self.is_zip = os.path.isfile(base_dir) and zipfile.is_zipfile(base_dir)
+        if self.is_zip:
+            with zipfile.ZipFile(base_dir) as zfile:
+                self.safe_dir = sorted(zfile.namelist())[0].split('/')[0]
+        else:
+            self.safe_dir = None
+        self.base_name_id = self.safe_dir if self.is_zip else os.path.basename(base_dir)
+        self.sentinel_input_file = self._get_product_path('manifest.safe')
         self.object_files = self._decode_manifest()
+        self.product = None
+        self._quick_img = None
+
+    def _get_product_path(self, relative_path):
+        """ Path of a file of the product, for zip files a GDAL /vsizip/ path
+        """
+        relative_path = os.path.normpath(relative_path).replace(os.sep, '/')
+        if self.is_zip:
+            return '/vsizip/{0}/{1}/{2}'.format(os.path.abspath(self.base_dir), self.safe_dir, relative_path)
+        return os.path.join(self.base_dir, relative_path)
+
+    def _open_product_file(self, product_path):
+        """ Opens a file of the product for reading, from the zip file when needed
+        """
+        if self.is_zip:
+            member = product_path[len('/vsizip/{0}/'.format(os.path.abspath(self.base_dir))):]
+            with zipfile.ZipFile(self.base_dir) as zfile:
+                return zfile.open(member)
+        return open(product_path, 'rb')
 
     def _decode_manifest(self):
-        with open(self.sentinel_input_file, 'r') as f:
+        with self._open_product_file(self.sentinel_input_file) as f:
             manifest_tree = xmltodict.parse(f.read())
         object_files = {}
         for dataObject in manifest_tree['xfdu:XFDU']['dataObjectSection']['dataObject']:
@@ -42,17 +78,6 @@ class Sentinel(object):
             object_files[key].append(dataObject['byteStream']['fileLocation']['@href'])
         return object_files
 
-    def _load_tiff_image(self, img_file_name):
-        dataset = gdal.Open(img_file_name, gdal.GA_ReadOnly)
-        band = dataset.GetRasterBand(1)
-        dataArray = band.ReadAsArray()
-        return dataArray
-
-    def _convert_str_to_date(self, time_str):
-        data_format = "%Y-%m-%dT%H:%M:%S.%f"
-        datetime_obj = datetime.datetime.strptime(time_str, data_format)
-        return datetime_obj
-
     def get_sensor_name(self):
         return 'Sentinel'
 
@@ -66,148 +91,358 @@ class Sentinel(object):
             product_indexes[i] = id_name
         return product_indexes
 
+    def get_quicklook(self):
+        """ Quick look image of the product, shared by all its swaths and polarisations
+        """
+        if self._quick_img is None:
+            quicklook_file = self._get_product_path(self.object_files['s1Level1QuickLookSchema'][0])
+            with self._open_product_file(quicklook_file) as f:
+                self._quick_img = np.asarray(Image.open(io.BytesIO(f.read())))
+        return self._quick_img
+
+    def get_product(self, product_index):
+        """ Prepares the swath and polarisation product_index, see get_product_indexes
+        """
+        return SentinelProduct(self, product_index)
+
     def process(self, product_index):
+        """ Prepares product_index as the current product, its attributes and methods
+            are then available on this object
+        """
+        self.product = self.get_product(product_index)
+        return self.product
+
+    def process_all(self, workers=None):
+        """ Prepares all the products of get_product_indexes on a pool of worker threads,
+            one per product when workers is None. The XML parsing and the GDAL and zip I/O
+            of the swaths overlap. Returns a dict {product_index: SentinelProduct}.
+        """
+        product_indexes = sorted(self.get_product_indexes().keys())
+        self.get_quicklook()
+        pool = ThreadPool(workers or len(product_indexes))
+        try:
+            products = pool.map(self.get_product, product_indexes)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(product_indexes, products))
+
+    def __getattr__(self, name):
+        # Attributes and methods of the current product, as before the split in SentinelProduct
+        product = self.__dict__.get('product')
+        if product is None or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(product, name)
+
+
+class SentinelProduct(object):
+    """ One swath and polarisation of a Sentinel product: metadata, calibration,
+        geolocation grid and measurement image
+    """
+
+    CACHE_VERSION = 1
+
+    CALIBRATION_LUTS = {'sigma': 'cal_sigma_mat', 'beta': 'cal_beta_mat', 'gamma': 'cal_gamma_mat', 'dn': 'cal_dn_mat'}
+
+    def __init__(self, sentinel, product_index):
+        self.sentinel = sentinel
+        self.product_index = product_index
+        self.product_id = sentinel.get_product_indexes()[product_index]
+
         # Retrieve file locations
-        self.image_file = os.path.join(self.base_dir, self.object_files['s1Level1MeasurementSchema'][product_index])
-        self.calibration_file = os.path.join(self.base_dir, self.object_files['s1Level1CalibrationSchema'][product_index])
-        self.metadata_file = os.path.join(self.base_dir,  self.object_files['s1Level1ProductSchema'][product_index])
-        self.quicklook_file = os.path.join(self.base_dir, self.object_files['s1Level1QuickLookSchema'][0])
-        self.quick_img = np.asarray(Image.open(self.quicklook_file))
-
-        # Build metadata tree fom XML
-        self.metadata_tree = None
-        with open(self.metadata_file, 'r') as f:
-            self.metadata_tree = xmltodict.parse(f.read())
-
-        self.productType = self.metadata_tree['product']['adsHeader']['productType']
+        object_files = sentinel.object_files
+        self.image_file = sentinel._get_product_path(object_files['s1Level1MeasurementSchema'][product_index])
+        self.calibration_file = sentinel._get_product_path(object_files['s1Level1CalibrationSchema'][product_index])
+        self.metadata_file = sentinel._get_product_path(object_files['s1Level1ProductSchema'][product_index])
+        self.quicklook_file = sentinel._get_product_path(object_files['s1Level1QuickLookSchema'][0])
+        self.quick_img = sentinel.get_quicklook()
+        self._image_dataset = None
+        self._burst_cut_table = None
+
+        # Read metadata and calibration arrays, from the sidecar cache when it is up to date
+        metadata = self._load_cache()
+        if metadata is None:
+            with sentinel._open_product_file(self.metadata_file) as f:
+                metadata = _annotation.parse_annotation(f)
+            with sentinel._open_product_file(self.calibration_file) as f:
+                metadata.update(_annotation.parse_calibration(f))
+            self._save_cache(metadata)
+
+        self.productType = str(metadata['productType'])
         assert self.productType in ['SLC', 'GRD']
-        self.polarisation = self.metadata_tree['product']['adsHeader']['polarisation']
-        self.swath = self.metadata_tree['product']['adsHeader']['swath']
-        self.mode = self.metadata_tree['product']['adsHeader']['mode']
-        self.rangePixelSpacing = float(self.metadata_tree['product']['imageAnnotation']['imageInformation']['rangePixelSpacing'])
-        self.azimuthPixelSpacing = float(self.metadata_tree['product']['imageAnnotation']['imageInformation']['azimuthPixelSpacing'])
-        self.azimuthTimeInterval = float(self.metadata_tree['product']['imageAnnotation']['imageInformation']['azimuthTimeInterval'])
-        self.slantRangeTime = float(self.metadata_tree['product']['imageAnnotation']['imageInformation']['slantRangeTime'])
-        self.productFirstLineUtcTime = self._convert_str_to_date(self.metadata_tree['product']['imageAnnotation']['imageInformation']['productFirstLineUtcTime'])
-        self.productLastLineUtcTime = self._convert_str_to_date(self.metadata_tree['product']['imageAnnotation']['imageInformation']['productLastLineUtcTime'])
-        self.rangeSamplingRate = float(self.metadata_tree['product']['generalAnnotation']['productInformation']['rangeSamplingRate'])
-        self.slantRangeTime = float(self.metadata_tree['product']['imageAnnotation']['imageInformation']['slantRangeTime'])
-
-        # Reads the geogrid data table
-        self.azimuth_time_table = []
-        self.range_time_table = []
-        self.range_index_table = []
-        self.datagrid_table = []
-        for geolocationGridPoint in self.metadata_tree['product']['geolocationGrid']['geolocationGridPointList']['geolocationGridPoint']:
-            azimuthTime = self._convert_str_to_date(geolocationGridPoint['azimuthTime'])
-            slantRangeTime = float(geolocationGridPoint['slantRangeTime'])
-            pixel = long(geolocationGridPoint['pixel'])
-            lat = float(geolocationGridPoint['latitude'])
-            lon = float(geolocationGridPoint['longitude'])
-            inc = float(geolocationGridPoint['incidenceAngle'])
-            grid = {'lon': lon, 'lat': lat, 'inc': inc}
-            self.azimuth_time_table.append(azimuthTime)
-            self.range_time_table.append(slantRangeTime)
-            self.range_index_table.append(pixel)
-            self.datagrid_table.append(grid)
-
-        # Build calibration tree fom XML
-        self.cal_tree = None
-        with open(self.calibration_file, 'r') as f:
-            self.cal_tree = xmltodict.parse(f.read())
-
-        self.cal_line_index = []
-        self.cal_pixels_index = []
-        self.cal_sigma_mat = []
-        self.cal_beta_mat = []
-        self.cal_gamma_mat = []
-        self.cal_dn_mat = []
-
-        for calibrationVector in self.cal_tree['calibration']['calibrationVectorList']['calibrationVector']:
-            line = long(calibrationVector['line'])
-            pixels = map(long, calibrationVector['pixel']['#text'].split())
-            sigmaNought = map(float, calibrationVector['sigmaNought']['#text'].split())
-            betaNought = map(float, calibrationVector['betaNought']['#text'].split())
-            gamma = map(float, calibrationVector['gamma']['#text'].split())
-            dn = map(float, calibrationVector['dn']['#text'].split())
-            self.cal_line_index.append(line)
-            self.cal_pixels_index.append(pixels)
-            self.cal_sigma_mat.append(sigmaNought)
-            self.cal_beta_mat.append(betaNought)
-            self.cal_gamma_mat.append(gamma)
-            self.cal_dn_mat.append(dn)
-
-        self.cal_line_index = np.asarray(self.cal_line_index)
-        self.cal_pixels_index = np.asarray(self.cal_pixels_index)
-        self.cal_sigma_mat = np.asarray(self.cal_sigma_mat)
-        self.cal_beta_mat = np.asarray(self.cal_beta_mat)
-        self.cal_gamma_mat = np.asarray(self.cal_gamma_mat)
-        self.cal_dn_mat = np.asarray(self.cal_dn_mat)
+        self.polarisation = str(metadata['polarisation'])
+        self.swath = str(metadata['swath'])
+        self.mode = str(metadata['mode'])
+        self.rangePixelSpacing = float(metadata['rangePixelSpacing'])
+        self.azimuthPixelSpacing = float(metadata['azimuthPixelSpacing'])
+        self.azimuthTimeInterval = float(metadata['azimuthTimeInterval'])
+        self.slantRangeTime = float(metadata['slantRangeTime'])
+        self.productFirstLineUtcTime = self._convert_str_to_date(str(metadata['productFirstLineUtcTime']))
+        self.productLastLineUtcTime = self._convert_str_to_date(str(metadata['productLastLineUtcTime']))
+        self.rangeSamplingRate = float(metadata['rangeSamplingRate'])
+        self.numberOfSamples = int(metadata['numberOfSamples'])
+        self.numberOfLines = int(metadata['numberOfLines'])
+        self.linesPerBurst = int(metadata['linesPerBurst'])
+        self.samplesPerBurst = int(metadata['samplesPerBurst'])
+
+        # Geolocation grid, (azimuth, range) arrays with azimuth times in seconds from productFirstLineUtcTime
+        self.grid_pixel = metadata['grid_pixel']
+        self.grid_azimuth_time = metadata['grid_azimuth_time']
+        self.grid_slant_range_time = metadata['grid_slant_range_time']
+        self.grid_lat = metadata['grid_lat']
+        self.grid_lon = metadata['grid_lon']
+        self.grid_inc = metadata['grid_inc']
+        self._build_geolocation_grid()
+
+        # Bursts, with azimuth times in seconds from productFirstLineUtcTime
+        self.burst_azimuth_time = metadata['burst_azimuth_time']
+        self.burst_first_valid_sample = metadata['burst_first_valid_sample']
+        self.burst_last_valid_sample = metadata['burst_last_valid_sample']
+
+        # Calibration vectors
+        self.cal_line_index = metadata['cal_line_index']
+        self.cal_pixels_index = metadata['cal_pixels_index']
+        self.cal_sigma_mat = metadata['cal_sigma_mat']
+        self.cal_beta_mat = metadata['cal_beta_mat']
+        self.cal_gamma_mat = metadata['cal_gamma_mat']
+        self.cal_dn_mat = metadata['cal_dn_mat']
+
+    def _load_tiff_image(self, img_file_name):
+        dataset = gdal.Open(img_file_name, gdal.GA_ReadOnly)
+        band = dataset.GetRasterBand(1)
+        dataArray = band.ReadAsArray()
+        return dataArray
+
+    def _get_image_band(self):
+        if self._image_dataset is None:
+            self._image_dataset = gdal.Open(self.image_file, gdal.GA_ReadOnly)
+        return self._image_dataset.GetRasterBand(1)
+
+    def _convert_str_to_date(self, time_str):
+        data_format = "%Y-%m-%dT%H:%M:%S.%f"
+        datetime_obj = datetime.datetime.strptime(time_str, data_format)
+        return datetime_obj
+
+    def get_sensor_name(self):
+        return self.sentinel.get_sensor_name()
+
+    def _get_cache_file(self):
+        cache_dir = self.sentinel.cache_dir
+        if cache_dir is None:
+            cache_dir = os.path.dirname(os.path.abspath(self.sentinel.base_dir))
+        return os.path.join(cache_dir, '{0}.npz'.format(self.product_id))
+
+    def _get_cache_key(self):
+        """ Modification times and sizes of the parsed files, a cache with another key is outdated
+        """
+        key = []
+        for file_name in [self.sentinel.base_dir] if self.sentinel.is_zip else [self.metadata_file, self.calibration_file]:
+            stat = os.stat(file_name)
+            key.extend([stat.st_mtime, stat.st_size])
+        key.append(self.CACHE_VERSION)
+        return np.asarray(key, dtype=np.float64)
+
+    def _load_cache(self):
+        if not self.sentinel.use_cache:
+            return None
+        cache_file = self._get_cache_file()
+        if not os.path.exists(cache_file):
+            return None
+        with np.load(cache_file) as cache:
+            if 'cache_key' not in cache or not np.array_equal(cache['cache_key'], self._get_cache_key()):
+                return None
+            return dict((key, cache[key]) for key in cache.files)
+
+    def _save_cache(self, metadata):
+        if not self.sentinel.use_cache:
+            return
+        cache_file = self._get_cache_file()
+        temp_file = cache_file + '.tmp'
+        try:
+            with open(temp_file, 'wb') as f:
+                np.savez(f, cache_key=self._get_cache_key(), **metadata)
+            os.rename(temp_file, cache_file)
+        except (IOError, OSError):
+            # Read only archives are processed without cache
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
 
     def get_image(self):
-        img = self.get_raw_image()
         if self.productType == 'GRD':
-            return img
+            return self.get_raw_image()
         else:
-            return self._deburst_image(img)
+            deburst_lines, deburst_samples = self.get_deburst_shape()
+            return self.read_deburst_window(0, 0, deburst_samples, deburst_lines)
 
     def get_expanded_sigma_mat(self):
-        expand_x = int(np.ceil(self.cal_pixels_index[0][-1] * 1.0 / self.cal_sigma_mat.shape[1]))
-        expand_y = int(np.ceil(self.cal_line_index[-1] * 1.0 / self.cal_sigma_mat.shape[0]))
-        expand_factor = (expand_y, expand_x)
-        expand_sigma_mat = scipy.ndimage.zoom(self.cal_sigma_mat, expand_factor, order=1)
-        return expand_sigma_mat
+        """ Full resolution float32 sigma LUT, prefer calibrated_blocks for large images
+        """
+        return self.get_calibration_lut(0, 0, self.numberOfSamples, self.numberOfLines, 'sigma')
+
+    def get_calibration_lut(self, x0, y0, x1, y1, lut='sigma'):
+        """ Bi-linear interpolation of the calibration LUT ('sigma', 'beta', 'gamma' or 'dn')
+            over the raw image window [y0:y1, x0:x1], at the real pixel/line positions
+            of the calibration vectors. Lines before the first or after the last vector
+            take the value of that vector. Returns a float32 (y1-y0, x1-x0) array.
+        """
+        lut_mat = getattr(self, self.CALIBRATION_LUTS[lut])
+        lines = np.arange(y0, y1, dtype=np.float64)
+        pixels = np.arange(x0, x1, dtype=np.float64)
+        # Calibration vectors before and after every line
+        v_index = np.searchsorted(self.cal_line_index, lines, side='right') - 1
+        v_index = np.clip(v_index, 0, len(self.cal_line_index)-2)
+        line_min = self.cal_line_index[v_index]
+        line_max = self.cal_line_index[v_index + 1]
+        w = np.clip((lines - line_min) / (line_max - line_min), 0, 1).astype(np.float32)[:, np.newaxis]
+        # Range interpolation only for the vectors used by this window
+        used = np.arange(v_index.min(), v_index.max() + 2) if len(lines) > 0 else np.arange(0)
+        vectors = np.empty(shape=(len(used), len(pixels)), dtype=np.float32)
+        for i, v in enumerate(used):
+            vectors[i] = np.interp(pixels, self.cal_pixels_index[v], lut_mat[v])
+        row = v_index - (used[0] if len(used) > 0 else 0)
+        lut_window = vectors[row] * (1 - w)
+        lut_window += vectors[row + 1] * w
+        return lut_window
+
+    def calibrate(self, dn, x0, y0, lut='sigma', out=None):
+        """ Calibrates the raw image block dn with top left corner (x0, y0) in a single
+            float32 pass, |DN|^2 / A^2 where A is the calibration LUT ('sigma', 'beta' or 'gamma')
+        """
+        size_y, size_x = dn.shape
+        lut_window = self.get_calibration_lut(x0, y0, x0 + size_x, y0 + size_y, lut)
+        if out is None:
+            out = np.empty(shape=dn.shape, dtype=np.float32)
+        np.abs(dn, out=out)
+        np.divide(out, lut_window, out=out)
+        np.square(out, out=out)
+        return out
+
+    def calibrated_blocks(self, lut='sigma', block_shape=(1024, 1024)):
+        """ Generator of calibrated raw image blocks ((x0, y0, x1, y1), block), see iter_blocks.
+            The LUT is interpolated per block and never at full resolution.
+        """
+        for window, dn in self.iter_blocks(block_shape):
+            yield window, self.calibrate(dn, window[0], window[1], lut)
+
+    def get_calibrated_window(self, x0, y0, x1, y1, lut='sigma'):
+        """ Reads and calibrates the raw image window [y0:y1, x0:x1]
+        """
+        x0 = max(x0, 0)
+        y0 = max(y0, 0)
+        return self.calibrate(self.read_window(x0, y0, x1, y1), x0, y0, lut)
+
+    def read_window(self, x0, y0, x1, y1):
+        """ Reads the raw image window [y0:y1, x0:x1] from the measurement file
+            -   x0, x1 = range indexes, where x1 > x0
+            -   y0, y1 = azimuth indexes, where y1 > y0
+            The window is clipped to the image, a window without pixels raises ValueError.
+        """
+        band = self._get_image_band()
+        x0 = max(x0, 0)
+        y0 = max(y0, 0)
+        x1 = min(x1, band.XSize)
+        y1 = min(y1, band.YSize)
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError('Empty image window [{0}:{1}, {2}:{3}]'.format(y0, y1, x0, x1))
+        return band.ReadAsArray(x0, y0, x1 - x0, y1 - y0)
+
+    def iter_blocks(self, block_shape=None):
+        """ Generator of raw image blocks ((x0, y0, x1, y1), block). The block shape (rows, cols)
+            is rounded up to a multiple of the native block size of the file, by default
+            the native block size.
+        """
+        band = self._get_image_band()
+        native_x, native_y = band.GetBlockSize()
+        block_y, block_x = block_shape if block_shape is not None else (native_y, native_x)
+        if block_y <= 0 or block_x <= 0:
+            raise ValueError('Empty block shape {0}'.format(block_shape))
+        block_y = int(np.ceil(block_y * 1.0 / native_y)) * native_y
+        block_x = int(np.ceil(block_x * 1.0 / native_x)) * native_x
+        for y0 in range(0, band.YSize, block_y):
+            y1 = min(y0 + block_y, band.YSize)
+            for x0 in range(0, band.XSize, block_x):
+                x1 = min(x0 + block_x, band.XSize)
+                yield (x0, y0, x1, y1), band.ReadAsArray(x0, y0, x1 - x0, y1 - y0)
 
     def get_raw_image(self):
         # return self._load_tiff_image(self.image_file)[::-1]
         return self._load_tiff_image(self.image_file)
 
-    def _deburst_image(self, img):
-        """ Deburst image using azimuth time
+    def _get_burst_cut_table(self):
+        """ Valid lines of every burst in the debursted image, as rows of
+            (raw_start, raw_stop, deburst_start), computed from the invalid first lines
+            (firstValidSample == -1) and the azimuth time overlap of consecutive bursts
         """
-        print '... start debursting process ...'
-        # Read relevant metadata
-        burst_list = []
-        for burst in self.metadata_tree['product']['swathTiming']['burstList']['burst']:
-            azimuthTime = self._convert_str_to_date(burst['azimuthTime'])
-            firstValidSample = [long(n) for n in burst['firstValidSample']['#text'].split(' ')]
-            lastValidSample = [long(n) for n in burst['lastValidSample']['#text'].split(' ')]
-            burst_list.append({'azimuthTime': azimuthTime, 'firstValidSample': firstValidSample, 'lastValidSample': lastValidSample })
-
-        linesPerBurst = long(self.metadata_tree['product']['swathTiming']['linesPerBurst'])
-        samplesPerBurst = long(self.metadata_tree['product']['swathTiming']['samplesPerBurst'])
-
-        i_burst = img[0:linesPerBurst][:]
-        deburst_array = [i_burst]
-        deburst_time_array = [burst_list[0]['azimuthTime']]
-
-        for i in range(1, len(burst_list)):
-            i_burst = img[i*linesPerBurst:(i+1)*linesPerBurst][:]
-            #Find number of invalid lines
+        if self._burst_cut_table is not None:
+            return self._burst_cut_table
+        lines_per_burst = self.linesPerBurst
+        first_time = self.burst_azimuth_time[0]
+        cuts = [[0, min(lines_per_burst, self.numberOfLines)]]
+        for i in range(1, len(self.burst_azimuth_time)):
+            # Find number of invalid lines
             invalid_lines = 0
-            for v in burst_list[i]['firstValidSample']:
+            for v in self.burst_first_valid_sample[i]:
                 if v != -1:
                     break
                 invalid_lines += 1
-            deburst_array.append(i_burst[invalid_lines::][:])
-            deburst_time_array.append(burst_list[i]['azimuthTime'] + datetime.timedelta(0, invalid_lines*self.azimuthTimeInterval))
-
-        def find_pixel_index(start_time, search_time):
-            diff_time = (search_time - start_time)
-            pixel_index = long(round(diff_time.total_seconds()/self.azimuthTimeInterval))
-            return pixel_index
-
-        first_start_time = deburst_time_array[0]
-        img_deburst = deburst_array[0]
-        # Cut the image in the overlapped position
-        for i in range(1, len(burst_list)):
-            index_to_cut = find_pixel_index(first_start_time, deburst_time_array[i])
-            img_deburst = img_deburst[0:index_to_cut, :]
-            img_deburst = np.concatenate((img_deburst, deburst_array[i]), axis=0)
+            burst_time = self.burst_azimuth_time[i] + invalid_lines*self.azimuthTimeInterval
+            index_to_cut = int(round((burst_time - first_time)/self.azimuthTimeInterval))
+            # Cut the previous bursts in the overlapped position
+            total = sum([c[1] - c[0] for c in cuts])
+            while total > index_to_cut and cuts:
+                excess = min(total - index_to_cut, cuts[-1][1] - cuts[-1][0])
+                cuts[-1][1] -= excess
+                total -= excess
+                if cuts[-1][1] == cuts[-1][0]:
+                    cuts.pop()
+            raw_start = i*lines_per_burst + invalid_lines
+            raw_stop = min((i+1)*lines_per_burst, self.numberOfLines)
+            if raw_stop > raw_start:
+                cuts.append([raw_start, raw_stop])
+        table = np.zeros(shape=(len(cuts), 3), dtype=np.int64)
+        table[:, 0:2] = cuts
+        table[1:, 2] = np.cumsum(table[:-1, 1] - table[:-1, 0])
+        self._burst_cut_table = table
+        return table
+
+    def get_deburst_shape(self):
+        table = self._get_burst_cut_table()
+        return int(table[-1, 2] + table[-1, 1] - table[-1, 0]), self.numberOfSamples
 
+    def _deburst_image(self, img):
+        """ Deburst image using azimuth time
+        """
+        print '... start debursting process ...'
+        img_deburst = np.empty(shape=(self.get_deburst_shape()[0],) + img.shape[1:], dtype=img.dtype)
+        for raw_start, raw_stop, deburst_start in self._get_burst_cut_table():
+            img_deburst[deburst_start:deburst_start + raw_stop - raw_start] = img[raw_start:raw_stop]
         print '... done ...'
         return img_deburst
 
+    def read_deburst_window(self, x0, y0, x1, y1):
+        """ Reads the window [y0:y1, x0:x1] of the debursted image, only the raw lines
+            of the window are read from the measurement file
+        """
+        deburst_lines, deburst_samples = self.get_deburst_shape()
+        x0 = max(x0, 0)
+        y0 = max(y0, 0)
+        x1 = min(x1, deburst_samples)
+        y1 = min(y1, deburst_lines)
+        window = None
+        for raw_start, raw_stop, deburst_start in self._get_burst_cut_table():
+            deburst_stop = deburst_start + raw_stop - raw_start
+            start = max(y0, deburst_start)
+            stop = min(y1, deburst_stop)
+            if start >= stop:
+                continue
+            block = self.read_window(x0, raw_start + start - deburst_start, x1, raw_start + stop - deburst_start)
+            if window is None:
+                window = np.empty(shape=(y1 - y0, x1 - x0), dtype=block.dtype)
+            window[start - y0:stop - y0] = block
+        if window is None:
+            window = np.empty(shape=(0, max(x1 - x0, 0)))
+        return window
+
     @staticmethod
     def _bilinear(x, y, f):
         r1 = (1-x) * f[0] + x * f[1]
@@ -215,52 +450,66 @@ class Sentinel(object):
         p = (1-y) * r1 + y * r2
         return p
 
-    def getGeoLocation(self, x, y):
-        """ GeoLocate the point (x,y) to (lat,lon)
+    def _build_geolocation_grid(self):
+        """ Builds the search arrays of the (azimuth, range) geolocation grid
+        """
+        # Pixels of all grid lines in one sorted array, line i shifted by i*grid_pixel_span
+        self.grid_pixel_min = self.grid_pixel.min()
+        self.grid_pixel_max = self.grid_pixel.max()
+        self.grid_pixel_span = self.grid_pixel_max - self.grid_pixel_min + 3
+        line_shift = np.arange(self.grid_pixel.shape[0])[:, np.newaxis] * self.grid_pixel_span
+        self.grid_pixel_search = (self.grid_pixel + line_shift).ravel()
+
+    def _interpolate_geolocation_grid(self, x, y):
+        """ Bi-linear interpolation of the geolocation grid for arrays of image points (x,y).
+            Returns [lat, lon, inc] arrays.
         """
-        # TODO: fix this better, here transform to float
-        x = float(x)
-        y = float(y)
-
-        y_time = datetime.timedelta(0, y*self.azimuthTimeInterval) + self.productFirstLineUtcTime
-
-        ## Find range period
-        range_period = 0
-        for i in range(1, len(self.range_index_table)):
-            if self.range_index_table[i] == self.range_index_table[0]:
-                range_period = i
-                break
-
-        # Calculate the azimuth index
-        azimuth_period = len(self.range_index_table)/range_period
-        a_index = 0
-        for i in range(0, len(self.azimuth_time_table), range_period):
-            if y_time <= self.azimuth_time_table[i]:
-                break
-            a_index = i/range_period
-
-        # Calculate the range index
-        r_index = 0
-        for i in range(range_period):
-            if x <= self.range_index_table[a_index*range_period + i]:
-                break
-            r_index = i
-        quad_a = max(min(a_index, azimuth_period-2), 0)
-        quad_r = max(min(r_index, range_period-2), 0)
+        x = np.asarray(x, dtype=np.float64)
+        y_time = np.asarray(y, dtype=np.float64) * self.azimuthTimeInterval
+        azimuth_period, range_period = self.grid_pixel.shape
+
+        # Last grid line (and pixel of that line) before the point
+        a_index = np.searchsorted(self.grid_azimuth_time[:, 0], y_time, side='left') - 1
+        a_index = np.clip(a_index, 0, azimuth_period-1)
+        x_search = np.clip(x, self.grid_pixel_min - 1, self.grid_pixel_max + 1) + a_index * self.grid_pixel_span
+        r_index = np.searchsorted(self.grid_pixel_search, x_search, side='left') - a_index * range_period - 1
+        quad_a = np.clip(a_index, 0, azimuth_period-2)
+        quad_r = np.clip(r_index, 0, range_period-2)
 
         # Get fractions
-        r_min = self.range_index_table[(quad_a + 0)*range_period + (quad_r + 0)]
-        r_max = self.range_index_table[(quad_a + 0)*range_period + (quad_r + 1)]
+        r_min = self.grid_pixel[quad_a, quad_r]
+        r_max = self.grid_pixel[quad_a, quad_r + 1]
         x_frac = (x - r_min)/(r_max - r_min)
-        a_max = self.azimuth_time_table[(quad_a + 1)*range_period + (quad_r + 1)]
-        a_min = self.azimuth_time_table[(quad_a + 0)*range_period + (quad_r + 0)]
-        y_frac = ((y_time - a_min).total_seconds())/((a_max - a_min).total_seconds())
-
-        # Retrieve grid points to bi-linear interpolation
-        p1 = self.datagrid_table[(quad_a + 0)*range_period + (quad_r + 0)]
-        p2 = self.datagrid_table[(quad_a + 0)*range_period + (quad_r + 1)]
-        p3 = self.datagrid_table[(quad_a + 1)*range_period + (quad_r + 1)]
-        p4 = self.datagrid_table[(quad_a + 1)*range_period + (quad_r + 0)]
-        bi_lon = Sentinel._bilinear(x_frac, y_frac, [p1['lon'], p2['lon'], p3['lon'], p4['lon']])
-        bi_lat = Sentinel._bilinear(x_frac, y_frac, [p1['lat'], p2['lat'], p3['lat'], p4['lat']])
-        return [bi_lat, bi_lon]
+        a_min = self.grid_azimuth_time[quad_a, quad_r]
+        a_max = self.grid_azimuth_time[quad_a + 1, quad_r + 1]
+        y_frac = (y_time - a_min)/(a_max - a_min)
+
+        result = []
+        for grid in [self.grid_lat, self.grid_lon, self.grid_inc]:
+            f = [grid[quad_a, quad_r], grid[quad_a, quad_r + 1], grid[quad_a + 1, quad_r + 1], grid[quad_a + 1, quad_r]]
+            result.append(SentinelProduct._bilinear(x_frac, y_frac, f))
+        return result
+
+    def geolocation_planes(self, block_shape=(1024, 1024)):
+        """ Generator of full resolution geolocation blocks ((x0, y0, x1, y1), lat, lon, inc),
+            where lat, lon and inc are float32 arrays of the block shape (rows, cols)
+        """
+        number_of_samples = self.numberOfSamples
+        number_of_lines = self.numberOfLines
+        block_y, block_x = block_shape
+        for y0 in range(0, number_of_lines, block_y):
+            y1 = min(y0 + block_y, number_of_lines)
+            for x0 in range(0, number_of_samples, block_x):
+                x1 = min(x0 + block_x, number_of_samples)
+                xs, ys = np.meshgrid(np.arange(x0, x1), np.arange(y0, y1))
+                lat, lon, inc = self._interpolate_geolocation_grid(xs, ys)
+                yield (x0, y0, x1, y1), lat.astype(np.float32), lon.astype(np.float32), inc.astype(np.float32)
+
+    def getGeoLocation(self, x, y):
+        """ GeoLocate the point (x,y) to (lat,lon),
+            x and y can be scalars or arrays of the same shape
+        """
+        lat, lon, _ = self._interpolate_geolocation_grid(x, y)
+        if lat.ndim == 0:
+            return [float(lat), float(lon)]
+        return [lat, lon]
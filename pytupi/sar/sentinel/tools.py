@@ -5,7 +5,10 @@ import fnmatch
 import zipfile
 from collections import defaultdict
 
-import xmltodict
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
 
 
 def search_images(dir_path):
@@ -34,25 +37,46 @@ def get_basic_info_from_compressed_file(s1_compressed_file):
 
     zfile = zipfile.ZipFile(s1_compressed_file)
     files = sorted(zfile.namelist())
-    base_name = files[0]
+    base_name = files[0].split('/')[0] + '/'
     manifest_file = base_name+'manifest.safe'
     with zfile.open(manifest_file, 'r') as f:
-        manifest_tree = xmltodict.parse(f.read())
-
-    basic_info = {}
+        basic_info = _parse_basic_info(f)
     basic_info['name'] = base_name[:-1] # remove last / in the name
+    return basic_info
 
-    for d in manifest_tree['xfdu:XFDU']['metadataSection']['metadataObject']:
 
-        if d['@ID'] == 'measurementOrbitReference':
-            orbit_ref = d['metadataWrap']['xmlData']['safe:orbitReference']
-            basic_info['OrbitReference'] = orbit_ref['safe:extension']['s1:orbitProperties']['s1:pass']
-        if d['@ID'] == 'acquisitionPeriod':
-            ac_period = d['metadataWrap']['xmlData']['safe:acquisitionPeriod']
-            basic_info['startTime'] = ac_period['safe:startTime']
-            basic_info['stopTime'] = ac_period['safe:stopTime']
-        if d['@ID'] == 'measurementFrameSet':
-            frame = d['metadataWrap']['xmlData']['safe:frameSet']['safe:frame']
-            basic_info['coordinates'] = frame['safe:footPrint']['gml:coordinates']
+def get_basic_info_from_safe_dir(s1_safe_dir):
+
+    with open(os.path.join(s1_safe_dir, 'manifest.safe'), 'rb') as f:
+        basic_info = _parse_basic_info(f)
+    basic_info['name'] = os.path.basename(os.path.normpath(s1_safe_dir))
+    return basic_info
 
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _parse_basic_info(manifest_file):
+    """ Streams the metadataSection of a manifest file, the dataObjectSection is never parsed
+    """
+    basic_info = {}
+    object_id = None
+    for event, elem in ElementTree.iterparse(manifest_file, events=('start', 'end')):
+        name = _local_name(elem.tag)
+        if event == 'start':
+            if name == 'metadataObject':
+                object_id = elem.get('ID')
+            elif name == 'dataObjectSection':
+                break
+            continue
+        if object_id == 'measurementOrbitReference' and name == 'pass':
+            basic_info['OrbitReference'] = elem.text
+        elif object_id == 'acquisitionPeriod' and name in ['startTime', 'stopTime']:
+            basic_info[name] = elem.text
+        elif object_id == 'measurementFrameSet' and name == 'coordinates':
+            basic_info.setdefault('coordinates', elem.text)
+        elif name == 'metadataObject':
+            object_id = None
+            elem.clear()
     return basic_info
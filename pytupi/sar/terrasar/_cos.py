@@ -0,0 +1,142 @@
+import struct
+
+import numpy as np
+
+# Reference:
+#
+# Level 1B Product Format Specifications - Section 4.2 COSAR binary format
+#
+# A COS file is a sequence of bursts. Every burst starts with 4 annotation
+# lines, followed by one line per azimuth sample. Every line has 2 annotation
+# columns (first and last valid range sample) followed by the range samples.
+# All cells are 4 bytes wide, a sample is a big-endian int16 pair (real, imag).
+
+
+class COSFile:
+    """ Memory mapped view of a COS image file
+    """
+
+    ANNOTATION_LINES = 4
+    ANNOTATION_COLUMNS = 2
+    CELL_BYTES = 4
+    COS_DTYPE = np.dtype([('r', '>i2'), ('i', '>i2')])
+
+    def __init__(self, cos_file):
+        self.cos_file = cos_file
+        self.range_size = None
+        self.line_size = None
+        self.bursts = []
+        self._read_burst_headers()
+        self.azimuth_size = sum([b[1] for b in self.bursts])
+        self.shape = (self.azimuth_size, self.range_size)
+        total_lines = self.bursts[-1][0] + self.bursts[-1][1]
+        self._map = np.memmap(self.cos_file, dtype=self.COS_DTYPE, mode='r',
+                              shape=(total_lines, self.line_size))
+
+    def _read_burst_headers(self):
+        """ Reads the burst headers and fills self.bursts with (first_line, azimuth_size),
+            where first_line is the index of the first data line of the burst in the file
+        """
+        header_unpacker = struct.Struct('>lllll')
+        with open(self.cos_file, 'rb') as f:
+            line = 0
+            header = f.read(header_unpacker.size)
+            while len(header) == header_unpacker.size:
+                header = header_unpacker.unpack_from(header)
+                if self.range_size is None:
+                    self.range_size = header[2]
+                    self.line_size = self.range_size + self.ANNOTATION_COLUMNS
+                azimuth_size = header[3]
+                line += self.ANNOTATION_LINES
+                self.bursts.append((line, azimuth_size))
+                line += azimuth_size
+                f.seek(line * self.line_size * self.CELL_BYTES, 0)
+                header = f.read(header_unpacker.size)
+
+    def _burst_view(self, burst_index):
+        first_line, azimuth_size = self.bursts[burst_index]
+        return self._map[first_line:first_line + azimuth_size, self.ANNOTATION_COLUMNS:]
+
+    def get_bursts(self):
+        """ Returns the bursts as memory mapped views without reading any pixel. When all
+            bursts have the same azimuth size (the usual case) the result is a single
+            (bursts, azimuth, range) view over the file, built with stride tricks to skip the
+            annotation lines of every burst, otherwise a list of (azimuth, range) views.
+        """
+        azimuth_sizes = set([b[1] for b in self.bursts])
+        if len(azimuth_sizes) > 1:
+            return [self._burst_view(i) for i in range(len(self.bursts))]
+        first_line, azimuth_size = self.bursts[0]
+        row_stride, cell_stride = self._map.strides
+        burst_stride = (self.ANNOTATION_LINES + azimuth_size) * self.line_size * self.CELL_BYTES
+        return np.lib.stride_tricks.as_strided(self._map[first_line:, self.ANNOTATION_COLUMNS:],
+                                               shape=(len(self.bursts), azimuth_size, self.range_size),
+                                               strides=(burst_stride, row_stride, cell_stride), subok=True)
+
+    def get_image(self):
+        """ Returns the image as a (azimuth, range) array of COS_DTYPE.
+            Single burst images (Stripmap, Spotlight) are returned as a memory mapped
+            view without reading any pixel. The lines of multi burst images are not
+            contiguous in the file, their bursts are copied into one array, use
+            get_bursts or read_window to avoid the copy.
+        """
+        if len(self.bursts) == 1:
+            return self._burst_view(0)
+        bursts = self.get_bursts()
+        if isinstance(bursts, np.ndarray):
+            return bursts.reshape(self.shape)
+        return np.concatenate(bursts)
+
+    def read_window(self, x0, y0, x1, y1):
+        """ Reads only the rows y0:y1 and columns x0:x1 of the image
+            -   x0, x1 = range indexes, where x1 > x0
+            -   y0, y1 = azimuth indexes, where y1 > y0
+        """
+        x0 = max(x0, 0)
+        y0 = max(y0, 0)
+        x1 = min(x1, self.range_size)
+        y1 = min(y1, self.azimuth_size)
+        window = np.empty(shape=(max(y1 - y0, 0), max(x1 - x0, 0)), dtype=self.COS_DTYPE)
+        burst_start = 0
+        for first_line, azimuth_size in self.bursts:
+            burst_end = burst_start + azimuth_size
+            start = max(y0, burst_start)
+            end = min(y1, burst_end)
+            if start < end:
+                file_start = first_line + start - burst_start
+                file_end = first_line + end - burst_start
+                cols = slice(self.ANNOTATION_COLUMNS + x0, self.ANNOTATION_COLUMNS + x1)
+                window[start - y0:end - y0] = self._map[file_start:file_end, cols]
+            burst_start = burst_end
+        return window
+
+
+def to_complex(data, out=None):
+    """ Converts an array of COS_DTYPE to complex64
+    """
+    if out is None:
+        out = np.empty(shape=data.shape, dtype=np.complex64)
+    out.real[...] = data['r']
+    out.imag[...] = data['i']
+    return out
+
+
+def to_amplitude(data, out=None):
+    """ Converts an array of COS_DTYPE to amplitude |z| in float32
+    """
+    if out is None:
+        out = np.empty(shape=data.shape, dtype=np.float32)
+    np.hypot(data['r'], data['i'], out=out, dtype=np.float32)
+    return out
+
+
+def to_intensity(data, out=None):
+    """ Converts an array of COS_DTYPE to intensity |z|^2 = r*r + i*i in float32
+    """
+    if out is None:
+        out = np.empty(shape=data.shape, dtype=np.float32)
+    imag = np.empty(shape=data.shape, dtype=np.float32)
+    np.square(data['r'], out=out, dtype=np.float32)
+    np.square(data['i'], out=imag, dtype=np.float32)
+    out += imag
+    return out
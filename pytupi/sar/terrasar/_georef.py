@@ -1,7 +1,12 @@
 
-from xml.dom import minidom
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
 import datetime
 
+import numpy as np
+
 
 class GeoRef:
 
@@ -26,95 +31,75 @@ class GeoRef:
 
     DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 
+    GRID_POINT_TAGS = [TAG_POINT_T, TAG_POINT_TAU, TAG_POINT_LAT, TAG_POINT_LON,
+                       TAG_POINT_INC, TAG_POINT_ELEV, TAG_POINT_HEIGHT]
+
     def __init__(self, xml_file):
         self.xml_file = xml_file
         self.locGrid = {}
-        xmldoc = minidom.parse(self.xml_file)
-
-        geoObj = xmldoc.getElementsByTagName(self.TAG_GEOLOCATION_GRID)[0]
-        numberGridObj = geoObj.getElementsByTagName(self.TAG_NUMBER_GRID_POINTS)[0]
-        self.locGrid[self.TAG_NUMBER_GRID_POINTS] = self._getNumberGridPoints(numberGridObj)
-
-        spaceGridObj = geoObj.getElementsByTagName(self.TAG_SPACING_GRID_POINTS)[0]
-        self.locGrid[self.TAG_SPACING_GRID_POINTS] = self._getSpacingNumberGrid(spaceGridObj)
-
-        self.locGrid[self.TAG_tREFERENCE_TIME_UTC] = self._getTReferenceTimeUTC(geoObj)
-        self.locGrid[self.TAG_tauREFERENCE_TIME] = self._getTauReferenceTime(geoObj)
-
-        num_range = self.locGrid[self.TAG_NUMBER_GRID_POINTS][self.TAG_NUMBER_RANGE]
-        num_azimuth = self.locGrid[self.TAG_NUMBER_GRID_POINTS][self.TAG_NUMBER_AZIMUTH]
-
-        self.locGrid[self.TAG_GRID_POINT] = [[{} for a in range(num_azimuth)] for r in range(num_range)]
-        gridPoints = geoObj.getElementsByTagName(self.TAG_GRID_POINT)
-
-        for gridPoint in gridPoints:
-            iaz = long(gridPoint.getAttribute("iaz"))
-            irg = long(gridPoint.getAttribute("irg"))
-            point = {}
-            point[self.TAG_POINT_T] = self._getPointT(gridPoint)
-            point[self.TAG_POINT_TAU] = self._getPointTau(gridPoint)
-            point[self.TAG_POINT_LAT] = self._getPointLat(gridPoint)
-            point[self.TAG_POINT_LON] = self._getPointLon(gridPoint)
-            point[self.TAG_POINT_INC] = self._getPointInc(gridPoint)
-            point[self.TAG_POINT_ELEV] = self._getPointElev(gridPoint)
-            point[self.TAG_POINT_HEIGHT] = self._getPointHeight(gridPoint)
-            self.locGrid[self.TAG_GRID_POINT][irg - 1][iaz - 1] = point
+        self.grids = {}
+        self._parse()
+
+    def _parse(self):
+        """ Streams GEOREF.xml and fills one (range, azimuth) float64 array per grid point tag
+        """
+        geo_obj = None
+        for event, elem in ElementTree.iterparse(self.xml_file, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == self.TAG_GEOLOCATION_GRID:
+                    geo_obj = elem
+                continue
+            if geo_obj is None:
+                continue
+            if elem.tag == self.TAG_GRID_POINT:
+                irg = int(elem.get('irg')) - 1
+                iaz = int(elem.get('iaz')) - 1
+                for tag in self.GRID_POINT_TAGS:
+                    self.grids[tag][irg, iaz] = float(elem.findtext(tag))
+                # Grid points are not needed anymore, release them while streaming
+                geo_obj.clear()
+            elif elem.tag == self.TAG_NUMBER_GRID_POINTS:
+                self.locGrid[self.TAG_NUMBER_GRID_POINTS] = self._getNumberGridPoints(elem)
+                num_range = self.locGrid[self.TAG_NUMBER_GRID_POINTS][self.TAG_NUMBER_RANGE]
+                num_azimuth = self.locGrid[self.TAG_NUMBER_GRID_POINTS][self.TAG_NUMBER_AZIMUTH]
+                for tag in self.GRID_POINT_TAGS:
+                    self.grids[tag] = np.zeros(shape=(num_range, num_azimuth), dtype=np.float64)
+            elif elem.tag == self.TAG_SPACING_GRID_POINTS:
+                self.locGrid[self.TAG_SPACING_GRID_POINTS] = self._getSpacingNumberGrid(elem)
+            elif elem.tag == self.TAG_tREFERENCE_TIME_UTC:
+                self.locGrid[self.TAG_tREFERENCE_TIME_UTC] = elem.text
+            elif elem.tag == self.TAG_tauREFERENCE_TIME:
+                self.locGrid[self.TAG_tauREFERENCE_TIME] = float(elem.text)
+            elif elem.tag == self.TAG_GEOLOCATION_GRID:
+                break
 
     def _getNumberGridPoints(self, xml):
         numberGrid = {}
-        numberGrid[self.TAG_NUMBER_TOTAL] = long(xml.getElementsByTagName(self.TAG_NUMBER_TOTAL)[0].firstChild.nodeValue)
-        numberGrid[self.TAG_NUMBER_AZIMUTH] = long(xml.getElementsByTagName(self.TAG_NUMBER_AZIMUTH)[0].firstChild.nodeValue)
-        numberGrid[self.TAG_NUMBER_RANGE] = long(xml.getElementsByTagName(self.TAG_NUMBER_RANGE)[0].firstChild.nodeValue)
+        numberGrid[self.TAG_NUMBER_TOTAL] = int(xml.findtext(self.TAG_NUMBER_TOTAL))
+        numberGrid[self.TAG_NUMBER_AZIMUTH] = int(xml.findtext(self.TAG_NUMBER_AZIMUTH))
+        numberGrid[self.TAG_NUMBER_RANGE] = int(xml.findtext(self.TAG_NUMBER_RANGE))
         return numberGrid
 
     def _getSpacingNumberGrid(self, xml):
         spaceGrid = {}
-        spaceGrid[self.TAG_SPACING_AZIMUTH] = float(xml.getElementsByTagName(self.TAG_SPACING_AZIMUTH)[0].firstChild.nodeValue)
-        spaceGrid[self.TAG_SPACING_RANGE] = float(xml.getElementsByTagName(self.TAG_SPACING_RANGE)[0].firstChild.nodeValue)
+        spaceGrid[self.TAG_SPACING_AZIMUTH] = float(xml.findtext(self.TAG_SPACING_AZIMUTH))
+        spaceGrid[self.TAG_SPACING_RANGE] = float(xml.findtext(self.TAG_SPACING_RANGE))
         return spaceGrid
 
-    def _getTReferenceTimeUTC(self, xml):
-        return xml.getElementsByTagName(self.TAG_tREFERENCE_TIME_UTC)[0].firstChild.nodeValue
-
-    def _getTauReferenceTime(self, xml):
-        return float(xml.getElementsByTagName(self.TAG_tauREFERENCE_TIME)[0].firstChild.nodeValue)
-
-    def _getPointT(self, xml):
-        return float(xml.getElementsByTagName(self.TAG_POINT_T)[0].firstChild.nodeValue)
-
-    def _getPointTau(self, xml):
-        return float(xml.getElementsByTagName(self.TAG_POINT_TAU)[0].firstChild.nodeValue)
-
-    def _getPointLat(self, xml):
-        return float(xml.getElementsByTagName(self.TAG_POINT_LAT)[0].firstChild.nodeValue)
-
-    def _getPointLon(self, xml):
-        return float(xml.getElementsByTagName(self.TAG_POINT_LON)[0].firstChild.nodeValue)
-
-    def _getPointInc(self, xml):
-        return float(xml.getElementsByTagName(self.TAG_POINT_INC)[0].firstChild.nodeValue)
-
-    def _getPointElev(self, xml):
-        return float(xml.getElementsByTagName(self.TAG_POINT_ELEV)[0].firstChild.nodeValue)
-
-    def _getPointHeight(self, xml):
-        return float(xml.getElementsByTagName(self.TAG_POINT_HEIGHT)[0].firstChild.nodeValue)
+    def getGrid(self, tag):
+        """ Returns the (range, azimuth) float64 grid of a grid point tag, e.g. TAG_POINT_LAT
+        """
+        return self.grids[tag]
 
     def getLatLonGrid(self):
-        parserGrid = self.locGrid[self.TAG_GRID_POINT]
-        x_grid_size = len(parserGrid)
-        y_grid_size = len(parserGrid[0])
-        grid = [[[parserGrid[x][y][self.TAG_POINT_LAT], parserGrid[x][y][self.TAG_POINT_LON]]
-                 for y in range(y_grid_size)] for x in range(x_grid_size)]
-        return grid
+        """ Returns a (range, azimuth, 2) array with [lat, lon] per grid point
+        """
+        return np.dstack((self.grids[self.TAG_POINT_LAT], self.grids[self.TAG_POINT_LON]))
 
     def getIncGrid(self):
-        parserGrid = self.locGrid[self.TAG_GRID_POINT]
-        x_grid_size = len(parserGrid)
-        y_grid_size = len(parserGrid[0])
-        grid = [[[parserGrid[x][y][self.TAG_POINT_INC]]
-                 for y in range(y_grid_size)] for x in range(x_grid_size)]
-        return grid
+        """ Returns a (range, azimuth, 1) array with [inc] per grid point
+        """
+        return self.grids[self.TAG_POINT_INC][:, :, np.newaxis]
 
     def getSpacingGridAzimuth(self):
         return self.locGrid[self.TAG_SPACING_GRID_POINTS][self.TAG_SPACING_AZIMUTH]
@@ -1,14 +1,21 @@
 
 import numpy as np
-import scipy.optimize as optimize
+import scipy.spatial as spatial
 
 from .. import sarimage
+from . import _cos
 
 
 class TSXImage(sarimage.SARImage):
 
+    INVERSE_ITERATIONS = 6
+
+    # Grid cells with a smaller Jacobian determinant (degrees^2) are degenerate for the inverse
+    INVERSE_MIN_DET = 1e-12
+
     def __init__(self):
         self.img = None
+        self.cos_file = None
         self.shape = None
         self.center_timestamp = None
         self.row_spacing = None
@@ -25,40 +32,57 @@ class TSXImage(sarimage.SARImage):
         self.range_resolution = None
         self.azimuth_resolution = None
         self.cal_factor = None
+        self._grid_steps = None
+        self._inverse_tree = None
 
     def get_shape(self):
         return self.shape
 
     def get_incidence_angle(self, x, y):
-        """ Convert (x,y) from image coordinate to incidence angle
+        """ Convert (x,y) from image coordinate to incidence angle,
+            x and y can be scalars or arrays of the same shape
         """
         geogrid_tau_pos, geogrid_t_pos = self._get_geogrid_tau_and_t_pos(x, y)
         inc = self._t_tau_to_inc(geogrid_tau_pos, geogrid_t_pos)
         return inc
 
     def convert_to_img_coordinates(self, lon, lat):
-        """ Convert (lat,lon) to image coordinate (x,y)
+        """ Convert (lat,lon) to image coordinate (x,y),
+            lon and lat can be scalars or arrays of the same shape
         """
-        def cost_function(xy):
-            x = xy[0]
-            y = xy[1]
-            t_lon, t_lat = self.convert_to_geo_coordinates(x, y)
-            cost = (lat - t_lat)**2 + (lon - t_lon)**2
-            return cost
-        x0y0 = [self.range_size/2, self.azimuth_size/2]
-        xyop = optimize.fmin(cost_function, x0y0, xtol=1e-5, disp=False)
-        x_best = int(round(xyop[0]))
-        y_best = int(round(xyop[1]))
+        geogrid_tau_pos, geogrid_t_pos = self._geo_to_t_tau(lon, lat)
+        range_step, azimuth_step = self._get_grid_steps()
+        x_best = np.rint(geogrid_tau_pos * range_step).astype(int)
+        y_best = np.rint(geogrid_t_pos * azimuth_step).astype(int)
+        if x_best.ndim == 0:
+            return [int(x_best), int(y_best)]
         return [x_best, y_best]
 
     def convert_to_geo_coordinates(self, x, y):
-        """ Convert (x,y) from image coordinate to (lon, lat)
+        """ Convert (x,y) from image coordinate to (lon, lat),
+            x and y can be scalars or arrays of the same shape
         """
         geogrid_tau_pos, geogrid_t_pos = self._get_geogrid_tau_and_t_pos(x, y)
         lon = self._t_tau_to_lon(geogrid_tau_pos, geogrid_t_pos)
         lat = self._t_tau_to_lat(geogrid_tau_pos, geogrid_t_pos)
         return [lon, lat]
 
+    def geolocation_planes(self, block_shape=(1024, 1024)):
+        """ Generator of full resolution geolocation blocks ((x0, y0, x1, y1), lat, lon, inc),
+            where lat, lon and inc are float32 arrays of the block shape (rows, cols)
+        """
+        block_y, block_x = block_shape
+        range_step, azimuth_step = self._get_grid_steps()
+        for y0 in range(0, self.azimuth_size, block_y):
+            y1 = min(y0 + block_y, self.azimuth_size)
+            for x0 in range(0, self.range_size, block_x):
+                x1 = min(x0 + block_x, self.range_size)
+                tau_pos, t_pos = np.meshgrid(np.arange(x0, x1) / range_step, np.arange(y0, y1) / azimuth_step)
+                lat = self._t_tau_to_lat(tau_pos, t_pos).astype(np.float32)
+                lon = self._t_tau_to_lon(tau_pos, t_pos).astype(np.float32)
+                inc = self._t_tau_to_inc(tau_pos, t_pos).astype(np.float32)
+                yield (x0, y0, x1, y1), lat, lon, inc
+
     def get_center_timestamp(self):
         return self.center_timestamp
 
@@ -68,72 +92,114 @@ class TSXImage(sarimage.SARImage):
     def get_col_spacing(self):
         return self.col_spacing
 
-    def get_roi(self, x0, y0, x1, y1):
-        """
+    def get_roi(self, x0, y0, x1, y1, out=None):
+        """ Returns the complex64 ROI
             -   x0, x1 = range indexes, where x1 > x0
             -   y0, y1 = azimuth indexes, where y1 > y0
+            -   out = optional complex64 array with the ROI shape to write the result
+        """
+        return _cos.to_complex(self._get_cos_roi(x0, y0, x1, y1), out)
+
+    def get_amplitude_roi(self, x0, y0, x1, y1, out=None):
+        """ Returns the float32 amplitude ROI, see get_roi
+        """
+        return _cos.to_amplitude(self._get_cos_roi(x0, y0, x1, y1), out)
+
+    def get_intensity_roi(self, x0, y0, x1, y1, out=None):
+        """ Returns the float32 intensity ROI, see get_roi
         """
-        sub_roi = self.img[y0:y1, x0:x1]
-        size_y, size_x = sub_roi.shape
-        result = np.ndarray(shape=(size_y, size_x), dtype=np.complex)
-        for j in xrange(size_y):
-            for i in range(size_x):
-                result[j][i] = complex(sub_roi[j][i]['r'], sub_roi[j][i]['i'])
-        return result
+        return _cos.to_intensity(self._get_cos_roi(x0, y0, x1, y1), out)
+
+    def _get_cos_roi(self, x0, y0, x1, y1):
+        if self.img is not None:
+            return self.img[y0:y1, x0:x1]
+        return self.cos_file.read_window(x0, y0, x1, y1)
 
     def _get_geogrid_tau_and_t_pos(self, x, y):
-        range_step = self._calculate_range_grid_step()
-        azimuth_step = self._calculate_azimuth_grid_step()
-        geogrid_tau_pos = x/range_step
-        geogrid_t_pos = y/azimuth_step
+        range_step, azimuth_step = self._get_grid_steps()
+        geogrid_tau_pos = np.asarray(x, dtype=np.float64)/range_step
+        geogrid_t_pos = np.asarray(y, dtype=np.float64)/azimuth_step
         return [geogrid_tau_pos, geogrid_t_pos]
 
+    def _get_grid_steps(self):
+        if self._grid_steps is None:
+            self._grid_steps = (self._calculate_range_grid_step(), self._calculate_azimuth_grid_step())
+        return self._grid_steps
+
     def _t_tau_to_lat(self, x, y):
         """ Convert (y,x)=(t,tau) to Latitude
         """
-        x_grid_size = len(self.latlon_grid)
-        y_grid_size = len(self.latlon_grid[0])
-        quad_x = min(int(x), x_grid_size-2)
-        quad_y = min(int(y), y_grid_size-2)
-        f = []
-        quad_x = quad_x if quad_x > 0 else 0
-        quad_y = quad_y if quad_y > 0 else 0
-        f.append(self.latlon_grid[quad_x+0][quad_y+0][0])
-        f.append(self.latlon_grid[quad_x+1][quad_y+0][0])
-        f.append(self.latlon_grid[quad_x+1][quad_y+1][0])
-        f.append(self.latlon_grid[quad_x+0][quad_y+1][0])
-        bi_lat = self._bilinear(x-quad_x, y-quad_y, f)
-        return bi_lat
+        return self._interpolate_grid(np.asarray(self.latlon_grid)[:, :, 0], x, y)
 
     def _t_tau_to_lon(self, x, y):
         """ Convert (y,x)=(t,tau) to Longitude
         """
-        x_grid_size = len(self.latlon_grid)
-        y_grid_size = len(self.latlon_grid[0])
-        quad_x = min(int(x), x_grid_size-2)
-        quad_y = min(int(y), y_grid_size-2)
-        f = list()
-        quad_x = quad_x if quad_x > 0 else 0
-        quad_y = quad_y if quad_y > 0 else 0
-        f.append(self.latlon_grid[quad_x+0][quad_y+0][1])
-        f.append(self.latlon_grid[quad_x+1][quad_y+0][1])
-        f.append(self.latlon_grid[quad_x+1][quad_y+1][1])
-        f.append(self.latlon_grid[quad_x+0][quad_y+1][1])
-        bi_lon = self._bilinear(x-quad_x, y-quad_y, f)
-        return bi_lon
+        return self._interpolate_grid(np.asarray(self.latlon_grid)[:, :, 1], x, y)
 
     def _t_tau_to_inc(self, x, y):
         """ Convert (y,x)=(t,tau) to Incidence angle
         """
-        quad_x = int(x)
-        quad_y = int(y)
-        f = list()
-        f.append(self.inc_grid[quad_x+0][quad_y+0][0])
-        f.append(self.inc_grid[quad_x+1][quad_y+0][0])
-        f.append(self.inc_grid[quad_x+1][quad_y+1][0])
-        f.append(self.inc_grid[quad_x+0][quad_y+1][0])
-        inc = self._bilinear(x-quad_x, y-quad_y, f)
-        return inc
+        return self._interpolate_grid(np.asarray(self.inc_grid)[:, :, 0], x, y)
+
+    def _interpolate_grid(self, grid, x, y):
+        """ Bi-linear interpolation of grid[tau, t] for arrays of grid positions (x,y)=(tau,t)
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        x_grid_size, y_grid_size = grid.shape
+        quad_x = np.clip(x.astype(np.intp), 0, x_grid_size-2)
+        quad_y = np.clip(y.astype(np.intp), 0, y_grid_size-2)
+        f = [grid[quad_x+0, quad_y+0],
+             grid[quad_x+1, quad_y+0],
+             grid[quad_x+1, quad_y+1],
+             grid[quad_x+0, quad_y+1]]
+        p = self._bilinear(x-quad_x, y-quad_y, f)
+        if p.ndim == 0:
+            return float(p)
+        return p
+
+    def _geo_to_t_tau(self, lon, lat, iterations=INVERSE_ITERATIONS):
+        """ Convert (lon, lat) to grid positions (x,y)=(tau,t). The nearest grid point is the
+            starting position of a few Newton steps on the bi-linear cell equations.
+            Points that reach a degenerate cell (|det| < INVERSE_MIN_DET) keep the nearest grid point.
+        """
+        shape = np.shape(lon)
+        lon = np.asarray(lon, dtype=np.float64).ravel()
+        lat = np.asarray(lat, dtype=np.float64).ravel()
+        if self._inverse_tree is None:
+            grid = np.asarray(self.latlon_grid)
+            nodes = np.column_stack((grid[:, :, 1].ravel(), grid[:, :, 0].ravel()))
+            self._inverse_tree = spatial.cKDTree(nodes)
+        lat_grid = np.asarray(self.latlon_grid)[:, :, 0]
+        lon_grid = np.asarray(self.latlon_grid)[:, :, 1]
+        x_grid_size, y_grid_size = lat_grid.shape
+        _, nearest = self._inverse_tree.query(np.column_stack((lon, lat)))
+        x = (nearest // y_grid_size).astype(np.float64)
+        y = (nearest % y_grid_size).astype(np.float64)
+        seed_x, seed_y = x.copy(), y.copy()
+        regular = np.ones(shape=x.shape, dtype=bool)
+        for _ in range(iterations):
+            quad_x = np.clip(x.astype(np.intp), 0, x_grid_size-2)
+            quad_y = np.clip(y.astype(np.intp), 0, y_grid_size-2)
+            u = x - quad_x
+            v = y - quad_y
+            f_lon = [lon_grid[quad_x+0, quad_y+0], lon_grid[quad_x+1, quad_y+0],
+                     lon_grid[quad_x+1, quad_y+1], lon_grid[quad_x+0, quad_y+1]]
+            f_lat = [lat_grid[quad_x+0, quad_y+0], lat_grid[quad_x+1, quad_y+0],
+                     lat_grid[quad_x+1, quad_y+1], lat_grid[quad_x+0, quad_y+1]]
+            r_lon = lon - self._bilinear(u, v, f_lon)
+            r_lat = lat - self._bilinear(u, v, f_lat)
+            # Jacobian of the bi-linear cell
+            lon_u = (1-v) * (f_lon[1] - f_lon[0]) + v * (f_lon[2] - f_lon[3])
+            lon_v = (1-u) * (f_lon[3] - f_lon[0]) + u * (f_lon[2] - f_lon[1])
+            lat_u = (1-v) * (f_lat[1] - f_lat[0]) + v * (f_lat[2] - f_lat[3])
+            lat_v = (1-u) * (f_lat[3] - f_lat[0]) + u * (f_lat[2] - f_lat[1])
+            det = lon_u * lat_v - lon_v * lat_u
+            regular &= np.abs(det) >= self.INVERSE_MIN_DET
+            det = np.where(regular, det, 1.0)
+            x = np.where(regular, x + (r_lon * lat_v - r_lat * lon_v) / det, seed_x)
+            y = np.where(regular, y + (r_lat * lon_u - r_lon * lat_u) / det, seed_y)
+        return [x.reshape(shape), y.reshape(shape)]
 
     @staticmethod
     def _bilinear(x, y, f):
@@ -1,12 +1,10 @@
 import os
-import struct
 
-import numpy as np
-from tqdm import trange
 from bs4 import BeautifulSoup
 import xmltodict
 
 from .. import sarsensor
+import _cos
 import _product
 import _georef
 import _tsximage
@@ -56,40 +54,22 @@ class TerraSARX(sarsensor.SARSensor):
             self.img_files.append(img_data)
         s_imgdata = soup.find('imagedatainfo')
         self.img_type = s_imgdata.imagedataformat.string
+        self._cos_files = {}
 
-    def _load_cos(self, img_data):
-        img_path = img_data['path']
-        img_name = img_data['filename']
+    def _open_cos(self, img_data):
         img_index = img_data['layerindex']
-        input_file = os.path.join(self.base_dir, img_path, img_name)
-        file_size = os.path.getsize(input_file)
-        gb_unit = 1024.0 ** 3
-        print 'Image {0} idx:{1} [{2:.2f} GB]'.format(img_name, img_index, file_size / gb_unit)
-        img_map = None
-        with open(input_file, 'rb') as f:
-            header_unpacker = struct.Struct('>lllll')
-            dt = np.dtype([('r', '>i2'), ('i', '>i2')])
-            burst_count = 0
-            long_size = 4
-            total_bytes = 7 * long_size
-            header = f.read(total_bytes)
-            header = header_unpacker.unpack_from(header)
-            range_size = header[2]
-            data_range_size = range_size + 2
-            header_total_bytes = 4 * data_range_size * long_size
-            f.seek(0, 0)
-            header = f.read(header_total_bytes)
-            while len(header) > 0:
-                header = header_unpacker.unpack_from(header)
-                azimuth_size = header[3]
-                burst_count += 1
-                data_burst = np.ndarray(shape=(azimuth_size, data_range_size), dtype=dt)
-                for i in trange(azimuth_size, leave=True):
-                    temp = np.fromfile(f, count=data_range_size, dtype=dt)
-                    data_burst[i][:] = temp
-                img_map = np.vstack((img_map, data_burst)) if img_map else data_burst
-                header = f.read(header_total_bytes)
-        return img_map
+        if img_index not in self._cos_files:
+            img_path = img_data['path']
+            img_name = img_data['filename']
+            input_file = os.path.join(self.base_dir, img_path, img_name)
+            file_size = os.path.getsize(input_file)
+            gb_unit = 1024.0 ** 3
+            print 'Image {0} idx:{1} [{2:.2f} GB]'.format(img_name, img_index, file_size / gb_unit)
+            self._cos_files[img_index] = _cos.COSFile(input_file)
+        return self._cos_files[img_index]
+
+    def _load_cos(self, img_data):
+        return self._open_cos(img_data).get_image()
 
     def load_all(self):
         imgs = []
@@ -107,15 +87,27 @@ class TerraSARX(sarsensor.SARSensor):
     def get_image_type(self):
         return self.img_type
 
-    def get_image(self, channel=0):
-        return self._build_sar_image(channel)
+    def get_image(self, channel=0, load_image=True):
+        """ Returns the TSXImage of the channel. With load_image=False the pixels are
+            not loaded and TSXImage.get_roi reads only the requested window.
+        """
+        return self._build_sar_image(channel, load_image)
+
+    def read_window(self, x0, y0, x1, y1, channel=0):
+        """ Reads the window [y0:y1, x0:x1] of the channel without loading the full image
+            -   x0, x1 = range indexes, where x1 > x0
+            -   y0, y1 = azimuth indexes, where y1 > y0
+        """
+        img_data = self.img_files[channel]
+        return self._open_cos(img_data).read_window(x0, y0, x1, y1)
 
-    def _build_sar_image(self, channel):
+    def _build_sar_image(self, channel, load_image=True):
         img_data = self.img_files[channel]
-        img = self._load_cos(img_data)
+        cos_file = self._open_cos(img_data)
         sar_img = _tsximage.TSXImage()
-        sar_img.img = img
-        sar_img.shape = img.shape
+        sar_img.cos_file = cos_file
+        sar_img.img = cos_file.get_image() if load_image else None
+        sar_img.shape = cos_file.shape
         sar_img.center_timestamp = self.product.get_scene_info_center_coord_azimuth_time()
         sar_img.row_spacing = self.product.get_row_spacing()
         sar_img.col_spacing = self.product.get_col_spacing()
@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+import zipfile
+
+try:
+    from ..pytupi.sar.sentinel import catalog
+except ImportError:
+    # catalog needs Python 2 implicit relative imports
+    catalog = None
+
+
+MANIFEST = ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1" xmlns:safe="http://www.esa.int/safe/sentinel-1.0">'
+            '<metadataSection>'
+            '<metadataObject ID="acquisitionPeriod"><metadataWrap><xmlData><safe:acquisitionPeriod>'
+            '<safe:startTime>{0}</safe:startTime><safe:stopTime>{1}</safe:stopTime>'
+            '</safe:acquisitionPeriod></xmlData></metadataWrap></metadataObject>'
+            '<metadataObject ID="measurementOrbitReference"><metadataWrap><xmlData><safe:orbitReference>'
+            '<safe:extension><s1:orbitProperties xmlns:s1="http://www.esa.int/safe/sentinel-1.0/sentinel-1">'
+            '<s1:pass>{2}</s1:pass></s1:orbitProperties></safe:extension>'
+            '</safe:orbitReference></xmlData></metadataWrap></metadataObject>'
+            '<metadataObject ID="measurementFrameSet"><metadataWrap><xmlData><safe:frameSet><safe:frame>'
+            '<safe:footPrint><gml:coordinates xmlns:gml="http://www.opengis.net/gml">{3}</gml:coordinates>'
+            '</safe:footPrint></safe:frame></safe:frameSet></xmlData></metadataWrap></metadataObject>'
+            '</metadataSection><dataObjectSection></dataObjectSection></xfdu:XFDU>')
+
+
+def make_manifest(start_time, stop_time, lat, lon):
+    """ Manifest of a product with a 1 x 2 degree footprint from (lat, lon)
+    """
+    coordinates = '{0},{1} {0},{3} {2},{3} {2},{1}'.format(lat, lon, lat + 1, lon + 2)
+    return MANIFEST.format(start_time, stop_time, 'ASCENDING', coordinates)
+
+
+def write_safe_dir(dir_path, name, manifest):
+    safe_dir = os.path.join(dir_path, name + '.SAFE')
+    os.makedirs(safe_dir)
+    with open(os.path.join(safe_dir, 'manifest.safe'), 'w') as f:
+        f.write(manifest)
+    return safe_dir
+
+
+def write_zip_file(dir_path, name, manifest):
+    zip_file = os.path.join(dir_path, name + '.zip')
+    with zipfile.ZipFile(zip_file, 'w') as z:
+        z.writestr(name + '.SAFE/manifest.safe', manifest)
+    return zip_file
+
+
+@unittest.skipIf(catalog is None, 'catalog is not available')
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.tmp_dir, 'archive')
+        os.makedirs(self.archive)
+        self.safe_dir = write_safe_dir(self.archive, 'S1A_IW_GRDH_1SDV_20160101T100000',
+                                       make_manifest('2016-01-01T10:00:00.000000', '2016-01-01T10:00:25.000000',
+                                                     50.0, 3.0))
+        self.zip_file = write_zip_file(self.archive, 'S1A_IW_SLC__1SDV_20160105T180000',
+                                       make_manifest('2016-01-05T18:00:00.000000', '2016-01-05T18:00:25.000000',
+                                                     -10.0, -40.0))
+        self.catalog = catalog.Catalog(os.path.join(self.tmp_dir, 'catalog.db'))
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_scan(self):
+        self.assertEqual(self.catalog.scan(self.archive, processes=2), 2)
+        products = self.catalog.query()
+        self.assertEqual([p['path'] for p in products], [self.safe_dir, self.zip_file])
+        self.assertEqual(products[0]['name'], 'S1A_IW_GRDH_1SDV_20160101T100000.SAFE')
+        self.assertEqual(products[1]['pass'], 'ASCENDING')
+        self.assertEqual([products[1][f] for f in ['min_lon', 'min_lat', 'max_lon', 'max_lat']],
+                         [-40.0, -10.0, -38.0, -9.0])
+
+        # Unchanged products are not parsed again
+        self.assertEqual(self.catalog.scan(self.archive, processes=2), 0)
+        self.assertEqual(len(self.catalog.query()), 2)
+
+    def test_scan_removed_product(self):
+        self.catalog.scan(self.archive, processes=2)
+        os.remove(self.zip_file)
+        self.assertEqual(self.catalog.scan(self.archive, processes=2), 0)
+        self.assertEqual([p['path'] for p in self.catalog.query()], [self.safe_dir])
+        self.assertEqual(self.catalog.query(bbox=[-41.0, -11.0, -39.0, -9.5]), [])
+
+    def test_query(self):
+        self.catalog.scan(self.archive, processes=2)
+        self.assertEqual([p['path'] for p in self.catalog.query(bbox=[4.5, 50.5, 10.0, 55.0])], [self.safe_dir])
+        self.assertEqual([p['path'] for p in self.catalog.query(bbox=[-39.0, -12.0, -30.0, -9.5])], [self.zip_file])
+        self.assertEqual(self.catalog.query(bbox=[0.0, 0.0, 1.0, 1.0]), [])
+
+        self.assertEqual([p['path'] for p in self.catalog.query(start_time='2016-01-01T10:00:20')],
+                         [self.safe_dir, self.zip_file])
+        self.assertEqual([p['path'] for p in self.catalog.query(start_time='2016-01-02T00:00:00')], [self.zip_file])
+        self.assertEqual([p['path'] for p in self.catalog.query(stop_time='2016-01-02T00:00:00')], [self.safe_dir])
+        self.assertEqual([p['path'] for p in self.catalog.query(bbox=[-50.0, -20.0, 10.0, 60.0],
+                                                                start_time='2016-01-05T18:00:10',
+                                                                stop_time='2016-01-05T18:00:15')], [self.zip_file])
+
+    def test_scan_skipped_product(self):
+        broken_file = write_zip_file(self.archive, 'S1A_IW_GRDH_1SDV_20160110T100000', '<xfdu:XFDU')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertEqual(self.catalog.scan(self.archive, processes=2), 2)
+        self.assertEqual(self.catalog.skipped_files, [broken_file])
+        self.assertEqual(len(caught), 1)
+        self.assertIn(broken_file, str(caught[0].message))
+        self.assertEqual(len(self.catalog.query()), 2)
+
+    def test_antimeridian(self):
+        self.assertEqual(catalog.parse_footprint('10.0,179.0 10.0,-179.0 11.0,-179.0 11.0,179.0'),
+                         [179.0, 10.0, 181.0, 11.0])
+        self.assertEqual(catalog.parse_footprint('10.0,-179.0 10.0,-177.0 11.0,-177.0'), [-179.0, 10.0, -177.0, 11.0])
+
+        manifest = MANIFEST.format('2016-01-08T10:00:00.000000', '2016-01-08T10:00:25.000000', 'DESCENDING',
+                                   '10.0,179.0 10.0,-179.0 11.0,-179.0 11.0,179.0')
+        safe_dir = write_safe_dir(self.archive, 'S1A_IW_GRDH_1SDV_20160108T100000', manifest)
+        self.catalog.scan(self.archive, processes=2)
+        product = self.catalog.query(start_time='2016-01-08T00:00:00')[0]
+        self.assertEqual([product[f] for f in ['min_lon', 'max_lon']], [179.0, 181.0])
+        # Both sides of the antimeridian find the product, the rest of the latitude band does not
+        self.assertEqual([p['path'] for p in self.catalog.query(bbox=[-179.5, 10.2, -179.2, 10.5])], [safe_dir])
+        self.assertEqual([p['path'] for p in self.catalog.query(bbox=[179.5, 10.2, 180.0, 10.5])], [safe_dir])
+        self.assertEqual([p['path'] for p in self.catalog.query(bbox=[-180.0, 10.2, 180.0, 10.5])], [safe_dir])
+        self.assertEqual(self.catalog.query(bbox=[0.0, 10.0, 1.0, 11.0]), [])
+        self.assertEqual(self.catalog.query(bbox=[178.0, 10.0, 178.5, 11.0]), [])
+        self.assertEqual(self.catalog.query(bbox=[-178.5, 10.0, -178.0, 11.0]), [])
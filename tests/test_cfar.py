@@ -0,0 +1,247 @@
+import unittest
+
+import numpy as np
+
+try:
+    from ..pytupi.sar.sar_tools import cfar_tools
+except ImportError:
+    # sar_tools needs matplotlib
+    cfar_tools = None
+
+
+def make_scene(size_y, size_x, targets, seed=0):
+    """ Speckle-like background with bright 3x3 targets centered at the (x, y) points
+    """
+    rand = np.random.RandomState(seed)
+    scene = rand.exponential(1.0, size=(size_y, size_x)).astype(np.float32)
+    for x, y in targets:
+        scene[y - 1:y + 2, x - 1:x + 2] = 200.0
+    return scene
+
+
+@unittest.skipIf(cfar_tools is None, 'sar_tools is not available')
+class TestCFARScene(unittest.TestCase):
+
+    def setUp(self):
+        # Targets inside tiles, on the tile seams (multiples of 150) and close to the border
+        self.targets = [(100, 80), (150, 150), (149, 280), (301, 151), (40, 260), (420, 35), (260, 199)]
+        self.scene = make_scene(330, 460, self.targets)
+
+    def test_plan_tiles(self):
+        tiles = cfar_tools._plan_tiles((330, 460), 150, 64)
+        self.assertEqual(len(tiles), 12)
+        core, frame = tiles[5]
+        self.assertEqual(core, (150, 150, 300, 300))
+        self.assertEqual((frame.offset_x, frame.offset_y, frame.roi_size_x, frame.roi_size_y), (86, 86, 278, 244))
+
+    def test_same_as_full_image(self):
+        expected = cfar_tools.cfar_roi(self.scene)
+        self.assertEqual(sorted(expected), sorted(self.targets))
+        for workers in [1, 2]:
+            detections = cfar_tools.cfar_scene(self.scene, tile_size=150, workers=workers)
+            self.assertEqual(sorted(detections), sorted(expected))
+            detections = cfar_tools.cfar_scene(self.scene, tile_size=150, workers=workers, engine='integral')
+            self.assertEqual(sorted(detections), sorted(expected))
+
+    def test_concurrent_scenes(self):
+        import threading
+        scenes = [self.scene, make_scene(330, 460, [(200, 100), (380, 250)], seed=1)]
+        expected = [sorted(cfar_tools.cfar_roi(scene)) for scene in scenes]
+        results = {}
+
+        def run(i, repeat):
+            results[i, repeat] = sorted(cfar_tools.cfar_scene(scenes[i], tile_size=150, workers=1))
+        threads = [threading.Thread(target=run, args=(i, repeat)) for repeat in range(3) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 6)
+        for (i, repeat), detections in results.items():
+            self.assertEqual(detections, expected[i])
+
+
+@unittest.skipIf(cfar_tools is None, 'sar_tools is not available')
+class TestCFAREngines(unittest.TestCase):
+
+    def test_integral_convolve(self):
+        from scipy import signal
+        img = np.random.RandomState(1).rand(150, 131)
+        for window in [cfar_tools._create_bg_window(64), cfar_tools._create_bg_window(129, 20),
+                       cfar_tools._create_target_window(64, 6)]:
+            np.testing.assert_allclose(cfar_tools._integral_convolve(img, window),
+                                       signal.fftconvolve(img, window, mode='same'), atol=1e-9)
+        self.assertRaises(ValueError, cfar_tools._integral_convolve, img, np.eye(5))
+
+    def test_integral_convolve_wide_float32(self):
+        from scipy import signal
+        img = np.random.RandomState(2).exponential(2000.0, size=(80, 20000)).astype(np.float32)
+        window = cfar_tools._create_bg_window(64)
+        sums = cfar_tools._integral_convolve(img, window)
+        self.assertEqual(sums.dtype, np.float32)
+        expected = signal.fftconvolve(img.astype(np.float64), window, mode='same')
+        np.testing.assert_allclose(sums, expected, rtol=1e-5)
+
+    def test_same_detections(self):
+        targets = [(60, 50), (120, 90), (180, 150)]
+        scene = make_scene(240, 260, targets)
+        for dtype in [np.float32, np.float64]:
+            detections = cfar_tools.cfar_roi(scene.astype(dtype), engine='integral')
+            self.assertEqual(sorted(detections), sorted(cfar_tools.cfar_roi(scene.astype(dtype))))
+            self.assertEqual(sorted(detections), targets)
+
+
+@unittest.skipIf(cfar_tools is None, 'sar_tools is not available')
+class TestCFARDetector(unittest.TestCase):
+
+    def test_detect_batch(self):
+        rois = np.array([make_scene(128, 160, [(50, 40), (100, 80)], seed=1),
+                         make_scene(128, 160, [], seed=2),
+                         make_scene(128, 160, [(70, 64)], seed=3)])
+        for engine in cfar_tools.CFAR_ENGINES:
+            detector = cfar_tools.CFARDetector(engine=engine)
+            detections = detector.detect_batch(rois, batch_size=2)
+            self.assertEqual(detections, [cfar_tools.cfar_roi(roi, engine=engine) for roi in rois])
+            self.assertEqual(detections, [[(50, 40), (100, 80)], [], [(70, 64)]])
+            self.assertEqual(list(detector._spectra.keys()), [(128, 160)] if engine == 'fft' else [])
+
+    def test_parameters(self):
+        detector = cfar_tools.CFARDetector(bg_window_size=128, target_window_size=4, th_scale=5.0)
+        self.assertEqual(detector.border_size, 64)
+        self.assertEqual(detector.target_window_sum, 16)
+        scene = make_scene(256, 256, [(128, 120)])
+        self.assertEqual(detector.detect(scene), [(128, 120)])
+        self.assertEqual(list(detector._spectra.keys()), [(256, 256)])
+        self.assertRaises(ValueError, cfar_tools.CFARDetector, engine='direct')
+
+    def test_spectra_cache(self):
+        detector = cfar_tools.CFARDetector()
+        for size in range(100, 100 + detector.SPECTRA_CACHE_SIZE + 2):
+            detector._get_spectra((size, 80))
+        detector._get_spectra((102, 80))
+        self.assertEqual(list(detector._spectra.keys()), [(103, 80), (104, 80), (105, 80), (102, 80)])
+
+    def test_scene_reuses_detector(self):
+        detectors = []
+
+        class CountingDetector(cfar_tools.CFARDetector):
+            def __init__(self, *args, **kwargs):
+                super(CountingDetector, self).__init__(*args, **kwargs)
+                detectors.append(self)
+
+        scene = make_scene(300, 300, [(100, 80), (250, 200)])
+        cfar_detector = cfar_tools.CFARDetector
+        cfar_tools.CFARDetector = CountingDetector
+        try:
+            self.assertEqual(cfar_tools.cfar_scene(scene, tile_size=150, workers=1), [(100, 80), (250, 200)])
+        finally:
+            cfar_tools.CFARDetector = cfar_detector
+        self.assertEqual(len(detectors), 1)
+
+
+@unittest.skipIf(cfar_tools is None, 'sar_tools is not available')
+class TestMeasureDetections(unittest.TestCase):
+
+    def test_measure_detections(self):
+        cfar_img = np.zeros(shape=(10, 12), dtype=bool)
+        cfar_img[1:3, 2:5] = True
+        cfar_img[3, 5] = True
+        cfar_img[7:9, 9] = True
+        roi = np.arange(120, dtype=np.float32).reshape(10, 12)
+        bg_mean = np.full((10, 12), 2.0)
+        detections = cfar_tools.measure_detections(cfar_img, roi, bg_mean)
+        self.assertEqual(detections.dtype, cfar_tools.DETECTION_DTYPE)
+        self.assertEqual(len(detections), 2)
+        first = detections[0]
+        self.assertEqual(first['area'], 7)
+        self.assertAlmostEqual(first['x'], (2 + 3 + 4) * 2 / 7.0 + 5 / 7.0)
+        self.assertAlmostEqual(first['y'], (1 * 3 + 2 * 3 + 3) / 7.0)
+        self.assertEqual((first['x0'], first['y0'], first['x1'], first['y1']), (2, 1, 6, 4))
+        self.assertEqual(first['peak'], 41.0)
+        expected_mean = roi[cfar_img & (np.arange(10) < 5)[:, np.newaxis]].mean(dtype=np.float64)
+        self.assertAlmostEqual(first['mean'], expected_mean)
+        self.assertAlmostEqual(first['snr'], expected_mean / 2.0)
+        self.assertEqual(detections[1]['area'], 2)
+        self.assertEqual(len(cfar_tools.measure_detections(cfar_img & False, roi, bg_mean)), 0)
+
+    def test_cfar_measure_roi(self):
+        scene = make_scene(200, 220, [(60, 50), (150, 140)])
+        detections = cfar_tools.cfar_measure_roi(scene)
+        self.assertEqual([(int(d['x']), int(d['y'])) for d in detections], cfar_tools.cfar_roi(scene))
+        self.assertTrue(np.all(detections['peak'] == 200.0))
+        self.assertTrue(np.all(detections['snr'] > 10.0))
+
+
+@unittest.skipIf(cfar_tools is None, 'sar_tools is not available')
+class TestCFARPrescreen(unittest.TestCase):
+
+    def test_image_pyramid(self):
+        image = np.arange(7 * 10, dtype=np.float32).reshape(7, 10)
+        level_1, level_2 = cfar_tools.image_pyramid(image, 2)
+        self.assertEqual(level_1.shape, (4, 5))
+        self.assertEqual(level_2.shape, (2, 3))
+        self.assertAlmostEqual(level_1[0, 0], image[0:2, 0:2].mean())
+        self.assertAlmostEqual(level_1[3, 4], image[6:7, 8:10].mean())
+        self.assertAlmostEqual(level_2[0, 0], image[0:4, 0:4].mean())
+
+    def test_recall(self):
+        rand = np.random.RandomState(4)
+        # Targets 32 to 64 pixels from the border and at random positions
+        targets = [(47, 502, 4, 200.0), (502, 40, 4, 200.0), (980, 300, 4, 200.0), (700, 975, 4, 200.0)]
+        for _ in range(12):
+            x, y = rand.randint(40, 980), rand.randint(40, 980)
+            size = rand.randint(1, 4)
+            targets.append((x, y, size, rand.uniform(20.0, 400.0)))
+        scene = rand.exponential(1.0, size=(1024, 1024)).astype(np.float32)
+        for x, y, size, amplitude in targets:
+            scene[y:y + size, x:x + size] = amplitude
+
+        full = cfar_tools.cfar_scene(scene, tile_size=512, workers=1)
+        self.assertGreaterEqual(len(full), 14)
+        tiles = cfar_tools.cfar_prescreen(scene, levels=2, cell_size=128, tile_size=512)
+        area = sum((x1 - x0) * (y1 - y0) for (x0, y0, x1, y1), _ in tiles)
+        self.assertLess(area, 0.35 * scene.size)
+        self.assertTrue(set([(49, 504), (504, 42), (982, 302), (702, 977)]) <= set(full))
+        for levels in [2, 3, 4]:
+            prescreened = cfar_tools.cfar_scene(scene, tile_size=512, workers=1, prescreen_levels=levels)
+            self.assertEqual(prescreened, full)
+
+    def test_empty_scene(self):
+        scene = np.ones(shape=(300, 300), dtype=np.float32)
+        self.assertEqual(cfar_tools.cfar_prescreen(scene), [])
+        self.assertEqual(cfar_tools.cfar_scene(scene, workers=1, prescreen_levels=2), [])
+
+
+class PlaneSensor(object):
+    """ Sensor with lat = y / 100 and lon = x / 100
+    """
+
+    def getGeoLocation(self, x, y):
+        return [np.asarray(y) / 100.0, np.asarray(x) / 100.0]
+
+
+class HalfPlaneLand(object):
+    """ Land east of lon = 10
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def isOverLand_many(self, points_lon_lat):
+        self.calls += 1
+        return np.asarray(points_lon_lat)[:, 0] > 10.0
+
+
+@unittest.skipIf(cfar_tools is None, 'sar_tools is not available')
+class TestFilterDetections(unittest.TestCase):
+
+    def test_filter_detections(self):
+        land = HalfPlaneLand()
+        detections = [(100, 100), (450, 300), (600, 50), (1200, 80)]
+        self.assertEqual(cfar_tools.filter_detections(PlaneSensor(), land, detections), [(100, 100), (450, 300)])
+        self.assertEqual(land.calls, 1)
+        keep = cfar_tools.land_keep_mask(PlaneSensor(), land, detections, buffer_land=700)
+        np.testing.assert_array_equal(keep, [True, False, False, False])
+        keep = cfar_tools.land_keep_mask(PlaneSensor(), land, detections, buffer_land=150, probes=[(-1, 0)])
+        np.testing.assert_array_equal(keep, [True, True, True, False])
+        self.assertEqual(cfar_tools.filter_detections(PlaneSensor(), land, []), [])
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    import shapefile
+    from ..pytupi.layers import gshhg
+except ImportError:
+    # gshhg needs GDAL and pyshp
+    gshhg = None
+
+
+def write_shapefile(file_name, polygons):
+    writer = shapefile.Writer(file_name)
+    writer.field('id', 'N')
+    for i, polygon in enumerate(polygons):
+        writer.poly([polygon])
+        writer.record(i)
+    writer.close()
+
+
+def square(lon, lat, size):
+    return [(lon, lat), (lon, lat + size), (lon + size, lat + size), (lon + size, lat), (lon, lat)]
+
+
+@unittest.skipIf(gshhg is None, 'gshhg is not available')
+class TestGSHHG(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file = os.path.join(self.tmp_dir, 'land')
+        # A row of 1 degree islands, 3 degrees apart
+        self.polygons = [square(lon, 10.0, 1.0) for lon in range(-30, 30, 3)]
+        write_shapefile(self.file, self.polygons)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cache(self):
+        coastline = gshhg.GSHHG(self.file)
+        cache_file = self.file + '.gshhg.npy'
+        self.assertTrue(os.path.exists(cache_file))
+        self.assertEqual(coastline.total_shapes, len(self.polygons))
+
+        # The second object maps the cache and never reads the shapefile
+        cached = gshhg.GSHHG(self.file)
+        self.assertIsInstance(cached.vertices, np.memmap)
+        self.assertIsNone(cached._shapes)
+        np.testing.assert_array_equal(cached.getPoints(3), coastline.getPoints(3))
+        np.testing.assert_array_equal(cached.bbox_cache[3], [-21.0, 10.0, -20.0, 11.0])
+        np.testing.assert_array_equal(cached.offsets, coastline.offsets)
+        self.assertIsNone(cached._shapes)
+
+        # A new modification time of the shapefile rebuilds the cache
+        stat = os.stat(self.file + '.shp')
+        os.utime(self.file + '.shp', (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNotNone(gshhg.GSHHG(self.file)._shapes)
+        self.assertIsNone(gshhg.GSHHG(self.file)._shapes)
+
+        # So does a cache of another version, or a truncated cache
+        cache = np.load(cache_file)
+        cache[0] = gshhg.GSHHG.CACHE_VERSION + 1
+        np.save(cache_file, cache)
+        self.assertIsNotNone(gshhg.GSHHG(self.file)._shapes)
+        np.save(cache_file, np.load(cache_file)[:-2])
+        self.assertIsNotNone(gshhg.GSHHG(self.file)._shapes)
+        self.assertIsNone(gshhg.GSHHG(self.file)._shapes)
+        self.assertFalse([f for f in os.listdir(self.tmp_dir) if f.endswith('.tmp')])
+
+    def test_lazy_polygons(self):
+        coastline = gshhg.GSHHG(self.file)
+        self.assertEqual(coastline._polygon_ogr_cache, {})
+        self.assertTrue(coastline.isOverLand((-20.5, 10.5)))
+        self.assertFalse(coastline.isOverLand((-19.0, 10.5)))
+        self.assertEqual(list(coastline._polygon_ogr_cache.keys()), [3])
+
+        # Every vertex is added once, open rings are closed
+        points = coastline.getPoints(3)
+        ring = coastline._get_ogr_polygon(3).GetGeometryRef(0)
+        self.assertEqual(ring.GetPointCount(), len(points))
+        ring = coastline._create_ogr_polygon(points[:-1]).GetGeometryRef(0)
+        self.assertEqual(ring.GetPointCount(), len(points))
+
+    def test_compatibility_attributes(self):
+        coastline = gshhg.GSHHG(self.file)
+        self.assertEqual(len(coastline.polygon_ogr_cache), len(self.polygons))
+        self.assertIs(coastline.polygon_ogr_cache[-1], coastline._get_ogr_polygon(len(self.polygons) - 1))
+        self.assertRaises(IndexError, coastline.polygon_ogr_cache.__getitem__, len(self.polygons))
+        self.assertEqual(len(coastline.polygon_cache), len(self.polygons))
+        np.testing.assert_array_equal(coastline.polygon_cache[3], self.polygons[3])
+        self.assertEqual(len(coastline.polygon_cache[2:5]), 3)
+
+        # The shapefile is read on first access
+        self.assertIsNone(gshhg.GSHHG(self.file)._shapes)
+        self.assertEqual(len(coastline.shapes), len(self.polygons))
+        self.assertEqual(list(coastline.shape.shapes()[3].bbox), list(coastline.bbox_cache[3]))
+
+    def test_subset(self):
+        coastline = gshhg.GSHHG(self.file)
+        view = coastline.subset([-10.5, 9.0, 2.5, 12.0])
+        self.assertIs(coastline.subset((-10.5, 9, 2.5, 12)), view)
+        self.assertIsNone(coastline.relevant_index_set)
+        self.assertEqual(view.shape_indexes, (7, 8, 9, 10))
+        self.assertEqual(view.bbox, (-10.5, 9.0, 2.5, 12.0))
+        self.assertRaises(ValueError, view._shape_mask.__setitem__, 0, True)
+
+        # Land queries of the view match the full coastline inside its bbox
+        rand = np.random.RandomState(0)
+        points = np.column_stack((rand.uniform(-10.5, 2.5, 500), rand.uniform(9.0, 12.0, 500)))
+        over_land = view.isOverLand_many(points)
+        self.assertTrue(over_land.any())
+        np.testing.assert_array_equal(over_land, coastline.isOverLand_many(points))
+        self.assertEqual(view.isOverLand(points[0]), coastline.isOverLand(points[0]))
+        self.assertFalse(view.isOverLand((-20.5, 10.5)))
+
+    def test_subset_cache(self):
+        coastline = gshhg.GSHHG(self.file)
+        first = coastline.subset([-30.0, 9.0, -29.0, 12.0])
+        for i in range(gshhg.GSHHG.SUBSET_CACHE_SIZE):
+            coastline.subset([i, 9.0, i + 1.0, 12.0])
+        self.assertEqual(len(coastline._subset_cache), gshhg.GSHHG.SUBSET_CACHE_SIZE)
+        self.assertNotIn((-30.0, 9.0, -29.0, 12.0), coastline._subset_cache)
+        # The least recently used view is evicted
+        used = coastline.subset([0.0, 9.0, 1.0, 12.0])
+        self.assertIsNot(coastline.subset([-30.0, 9.0, -29.0, 12.0]), first)
+        self.assertIs(coastline.subset([0.0, 9.0, 1.0, 12.0]), used)
+        self.assertNotIn((1.0, 9.0, 2.0, 12.0), coastline._subset_cache)
@@ -0,0 +1,161 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..pytupi.layers import land_mask
+
+
+class PlaneSensor(object):
+    """ Sensor with lat = y / 100 and lon = (x + shift_x) / 100 wrapped to [-180, 180),
+        counting the geolocated points
+    """
+
+    def __init__(self, shift_x=0.0):
+        self.shift_x = shift_x
+        self.points = 0
+
+    def getGeoLocation(self, x, y):
+        self.points += np.size(x)
+        return [np.asarray(y) / 100.0, ((np.asarray(x) + self.shift_x) / 100.0 + 180.0) % 360.0 - 180.0]
+
+
+class PolygonLayer(object):
+    """ GSHHG-like layer of (lon, lat) polygons
+    """
+
+    def __init__(self, polygons):
+        self.polygons = polygons
+        self.shape_indexes = tuple(range(len(polygons)))
+
+    def getPoints(self, shape_index):
+        return self.polygons[shape_index]
+
+    def subset(self, bbox):
+        min_lon, min_lat, max_lon, max_lat = bbox
+        layer = PolygonLayer(self.polygons)
+        layer.shape_indexes = tuple(i for i, polygon in enumerate(np.asarray(p) for p in self.polygons)
+                                    if polygon[:, 0].max() >= min_lon and polygon[:, 0].min() <= max_lon and
+                                    polygon[:, 1].max() >= min_lat and polygon[:, 1].min() <= max_lat)
+        self.last_subset = layer
+        return layer
+
+
+def point_in_polygon(x, y, polygon):
+    inside = False
+    for i in range(len(polygon)):
+        x1, y1 = polygon[i - 1]
+        x2, y2 = polygon[i]
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / float(y2 - y1) + x1:
+            inside = not inside
+    return inside
+
+
+class TestFillPolygon(unittest.TestCase):
+
+    def test_same_as_point_in_polygon(self):
+        angles = np.linspace(0, 2 * np.pi, 15, endpoint=False)
+        radius = np.where(np.arange(15) % 2 == 0, 4.0, 1.5)
+        polygon = list(zip(5.2 + radius * np.cos(angles), 4.9 + radius * np.sin(angles)))
+        raster = np.zeros(shape=(40, 50), dtype=bool)
+        land_mask._fill_polygon(raster, polygon, 0.0, 0.0, 0.25, 0.25)
+        expected = np.zeros(shape=raster.shape, dtype=bool)
+        for row in range(40):
+            for col in range(50):
+                expected[row, col] = point_in_polygon((col + 0.5) * 0.25, (row + 0.5) * 0.25, polygon)
+        np.testing.assert_array_equal(raster, expected)
+        self.assertTrue(raster.any())
+
+
+class TestLandMask(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # Land in lon [5, 8], lat [2, 4], the image pixels x [500, 800], y [200, 400]
+        self.layer = PolygonLayer([[(5.0, 2.0), (5.0, 4.0), (8.0, 4.0), (8.0, 2.0), (5.0, 2.0)],
+                                   [(50.0, 50.0), (50.0, 51.0), (51.0, 51.0), (50.0, 50.0)]])
+        self.sensor = PlaneSensor()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_rasterize(self):
+        mask = land_mask.rasterize_land_mask(self.sensor, self.layer, (600, 1000), step=10)
+        self.assertEqual(mask.mask.shape, (60, 100))
+        self.assertEqual(self.layer.last_subset.shape_indexes, (0,))
+        self.assertEqual(self.layer.shape_indexes, (0, 1))
+        self.assertTrue(mask.is_land(650, 300))
+        self.assertFalse(mask.is_land(100, 100))
+        np.testing.assert_array_equal(mask.is_land([520, 780, 480, 820], [220, 380, 300, 300]),
+                                      [True, True, False, False])
+        self.assertEqual(mask.mask.sum(), 30 * 20)
+        np.testing.assert_array_equal(mask.keep_mask([(650, 300), (100, 100)]), [False, True])
+
+    def test_buffered(self):
+        mask = land_mask.rasterize_land_mask(self.sensor, self.layer, (600, 1000), step=10)
+        buffered = mask.buffered(100)
+        np.testing.assert_array_equal(buffered.is_land([450, 350, 650, 650, 890, 910], [300, 300, 130, 80, 300, 300]),
+                                      [True, False, True, False, True, False])
+        self.assertTrue(buffered.mask.sum() > mask.mask.sum())
+
+    def test_fill_land(self):
+        mask = land_mask.rasterize_land_mask(self.sensor, self.layer, (600, 1000), step=10)
+        roi = np.ones(shape=(100, 100), dtype=np.float32)
+        roi[50:, :] = 100.0
+        self.assertTrue(mask.get_window(450, 150, 550, 250)[50:, 50:].all())
+        self.assertEqual(mask.get_window(450, 150, 550, 250).sum(), 50 * 50)
+        mask.fill_land(roi, 450, 150)
+        # Sea mean of 5000 pixels at 1 and 2500 pixels at 100
+        self.assertTrue(np.all(roi[50:, 50:] == 34.0))
+        self.assertTrue(np.all(roi[:50] == 1.0))
+        self.assertTrue(np.all(roi[50:, :50] == 100.0))
+
+    def test_cache(self):
+        cache_file = os.path.join(self.tmp_dir, 'scene_land.npz')
+        mask = land_mask.get_land_mask(self.sensor, self.layer, (600, 1000), step=10, cache_file=cache_file)
+        self.assertTrue(os.path.exists(cache_file))
+        points = self.sensor.points
+        cached = land_mask.get_land_mask(self.sensor, self.layer, (600, 1000), step=10, cache_file=cache_file)
+        # Only the image corners are geolocated
+        self.assertEqual(self.sensor.points, points + 4)
+        np.testing.assert_array_equal(cached.mask, mask.mask)
+        land_mask.get_land_mask(self.sensor, self.layer, (600, 1000), step=20, cache_file=cache_file)
+        self.assertTrue(self.sensor.points > points + 8)
+
+    def test_cache_shifted_scene(self):
+        cache_file = os.path.join(self.tmp_dir, 'scene_land.npz')
+        mask = land_mask.get_land_mask(self.sensor, self.layer, (600, 1000), step=10, cache_file=cache_file)
+        self.assertTrue(mask.is_land(650, 300))
+        # Same image shape, footprint 3 degrees to the east
+        shifted_sensor = PlaneSensor(shift_x=300.0)
+        shifted = land_mask.get_land_mask(shifted_sensor, self.layer, (600, 1000), step=10, cache_file=cache_file)
+        self.assertTrue(shifted_sensor.points > 4)
+        self.assertFalse(shifted.is_land(650, 300))
+        self.assertTrue(shifted.is_land(350, 300))
+        np.testing.assert_allclose(land_mask.LandMask.load(cache_file).corners[:, 1], [3.0, 12.99, 3.0, 12.99])
+
+    def test_rasterize_antimeridian(self):
+        # Image lon from 175 to 180 and from -180 to -175, land east and west of the antimeridian
+        layer = PolygonLayer([[(177.0, 2.0), (177.0, 4.0), (178.0, 4.0), (178.0, 2.0), (177.0, 2.0)],
+                              [(-179.0, 2.0), (-179.0, 4.0), (-178.0, 4.0), (-178.0, 2.0), (-179.0, 2.0)],
+                              [(0.0, 2.0), (0.0, 4.0), (1.0, 4.0), (1.0, 2.0), (0.0, 2.0)]])
+        mask = land_mask.rasterize_land_mask(PlaneSensor(shift_x=17500.0), layer, (600, 1000), step=10)
+        self.assertEqual(layer.last_subset.shape_indexes, (1,))
+        np.testing.assert_array_equal(mask.is_land([250, 650, 450, 50, 950, 650], [300, 300, 300, 300, 300, 100]),
+                                      [True, True, False, False, False, False])
+        self.assertEqual(mask.mask.sum(), 2 * 10 * 20)
+
+    def test_save(self):
+        cache_file = os.path.join(self.tmp_dir, 'scene_land.npz')
+        mask = land_mask.rasterize_land_mask(self.sensor, self.layer, (600, 1000), step=10)
+        land_mask.LandMask(np.ones(shape=(2, 2)), 10, (20, 20)).save(cache_file)
+        mask.save(cache_file)
+        self.assertEqual(os.listdir(self.tmp_dir), ['scene_land.npz'])
+        np.testing.assert_array_equal(land_mask.LandMask.load(cache_file).mask, mask.mask)
+
+        # A failed write leaves no temporary file
+        self.assertRaises(IOError, land_mask.LandMask(mask.mask, 10, (600, 1000)).save,
+                          os.path.join(self.tmp_dir, 'missing', 'scene_land.npz'))
+        self.assertEqual(os.listdir(self.tmp_dir), ['scene_land.npz'])
@@ -0,0 +1,612 @@
+import bisect
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import numpy as np
+
+from ..pytupi.sar.sentinel import _annotation
+
+try:
+    from PIL import Image
+    from ..pytupi.sar.sentinel import sentinel
+except (ImportError, SyntaxError):
+    # sentinel needs GDAL and Python 2
+    sentinel = None
+
+
+FIRST_LINE_TIME = '2016-01-01T10:00:00.000000'
+
+PRODUCT_NAME = 'S1A_IW_SLC__1SDV_20160101T100000_20160101T100004_000001_000001_0001'
+
+PRODUCT_FILE = 's1a-iw1-slc-{0}-20160101t100000-20160101t100004-000001-000001-001'
+
+MANIFEST = ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1"><dataObjectSection>{0}</dataObjectSection></xfdu:XFDU>')
+
+DATA_OBJECT = ('<dataObject ID="{0}{1}" repID="{0}"><byteStream mimeType="text/xml">'
+               '<fileLocation locatorType="URL" href="./{2}"/></byteStream></dataObject>')
+
+
+def write_annotation_file(file_name, bursts):
+    """ Writes a minimal annotation XML with a geolocation grid of 3 azimuth lines and
+        4 range points, where latitude = line + pixel / 1000.0, and the list of
+        (azimuth seconds, first valid samples, last valid samples) bursts
+    """
+    points = []
+    for line in range(3):
+        for pixel in range(0, 400, 100):
+            points.append('<geolocationGridPoint><azimuthTime>2016-01-01T10:00:{0:02d}.500000</azimuthTime>'
+                          '<slantRangeTime>{1}</slantRangeTime><line>{2}</line><pixel>{3}</pixel>'
+                          '<latitude>{4}</latitude><longitude>{5}</longitude><height>0</height>'
+                          '<incidenceAngle>{6}</incidenceAngle><elevationAngle>0</elevationAngle>'
+                          '</geolocationGridPoint>'.format(line * 2, 0.005 + pixel * 1e-8, line * 10, pixel,
+                                                           line + pixel / 1000.0, -line, 30.0 + pixel / 100.0))
+    burst_list = []
+    for seconds, first_valid, last_valid in bursts:
+        burst_list.append('<burst><azimuthTime>2016-01-01T10:00:{0:09.6f}</azimuthTime>'
+                          '<firstValidSample count="4">{1}</firstValidSample>'
+                          '<lastValidSample count="4">{2}</lastValidSample></burst>'
+                          .format(seconds, ' '.join(map(str, first_valid)), ' '.join(map(str, last_valid))))
+    with open(file_name, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?><product>'
+                '<adsHeader><polarisation>VV</polarisation><productType>SLC</productType><swath>IW1</swath>'
+                '<mode>IW</mode></adsHeader>'
+                '<generalAnnotation><productInformation><rangeSamplingRate>64345238.1</rangeSamplingRate>'
+                '</productInformation></generalAnnotation>'
+                '<imageAnnotation><imageInformation><productFirstLineUtcTime>{0}</productFirstLineUtcTime>'
+                '<productLastLineUtcTime>2016-01-01T10:00:04.000000</productLastLineUtcTime>'
+                '<slantRangeTime>0.005</slantRangeTime><rangePixelSpacing>2.3</rangePixelSpacing>'
+                '<azimuthPixelSpacing>14.1</azimuthPixelSpacing><azimuthTimeInterval>0.002</azimuthTimeInterval>'
+                '<numberOfSamples>400</numberOfSamples><numberOfLines>30</numberOfLines></imageInformation>'
+                '</imageAnnotation>'
+                '<swathTiming><linesPerBurst>4</linesPerBurst><samplesPerBurst>400</samplesPerBurst>'
+                '<burstList count="{1}">{2}</burstList></swathTiming>'
+                '<geolocationGrid><geolocationGridPointList count="12">{3}</geolocationGridPointList>'
+                '</geolocationGrid></product>'.format(FIRST_LINE_TIME, len(bursts), ''.join(burst_list),
+                                                       ''.join(points)))
+
+
+def write_calibration_file(file_name, lines, pixels):
+    """ Writes a minimal calibration XML with one vector per line, where sigma = line + pixel
+    """
+    vectors = []
+    for line in lines:
+        values = [line + p for p in pixels]
+        vectors.append('<calibrationVector><azimuthTime>{0}</azimuthTime><line>{1}</line>'
+                       '<pixel count="{2}">{3}</pixel><sigmaNought count="{2}">{4}</sigmaNought>'
+                       '<betaNought count="{2}">{5}</betaNought><gamma count="{2}">{6}</gamma>'
+                       '<dn count="{2}">{7}</dn></calibrationVector>'
+                       .format(FIRST_LINE_TIME, line, len(pixels), ' '.join(map(str, pixels)),
+                               ' '.join(map(str, values)), ' '.join(['237.0'] * len(pixels)),
+                               ' '.join(['200.5'] * len(pixels)), ' '.join(['1.0'] * len(pixels))))
+    with open(file_name, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?><calibration><calibrationVectorList count="{0}">{1}'
+                '</calibrationVectorList></calibration>'.format(len(lines), ''.join(vectors)))
+
+
+def write_safe_dir(dir_path, polarisations=('vv', 'vh')):
+    """ Writes a minimal SAFE directory with the annotation, calibration and quick look
+        files of one IW1 swath per polarisation, the measurement files are not written
+    """
+    safe_dir = os.path.join(dir_path, PRODUCT_NAME + '.SAFE')
+    os.makedirs(os.path.join(safe_dir, 'annotation', 'calibration'))
+    os.makedirs(os.path.join(safe_dir, 'preview'))
+    data_objects = []
+    for i, polarisation in enumerate(polarisations):
+        file_name = PRODUCT_FILE.format(polarisation)
+        files = [('s1Level1ProductSchema', 'annotation/' + file_name + '.xml'),
+                 ('s1Level1CalibrationSchema', 'annotation/calibration/calibration-' + file_name + '.xml'),
+                 ('s1Level1MeasurementSchema', 'measurement/' + file_name + '.tiff')]
+        write_annotation_file(os.path.join(safe_dir, files[0][1]), [(0.25, [-1, 10, 10, 10], [-1, 390, 390, 390])])
+        write_calibration_file(os.path.join(safe_dir, files[1][1]), [0, 15, 29], [0, 100, 200, 300, 399])
+        data_objects.extend([DATA_OBJECT.format(schema, i, href) for schema, href in files])
+    data_objects.append(DATA_OBJECT.format('s1Level1QuickLookSchema', 0, 'preview/quick-look.png'))
+    Image.fromarray(np.arange(200, dtype=np.uint8).reshape(10, 20)).save(os.path.join(safe_dir, 'preview',
+                                                                                       'quick-look.png'))
+    with open(os.path.join(safe_dir, 'manifest.safe'), 'w') as f:
+        f.write(MANIFEST.format(''.join(data_objects)))
+    return safe_dir
+
+
+def write_zip_file(safe_dir):
+    """ Zips the SAFE directory as <product name>.zip next to it
+    """
+    zip_file = os.path.join(os.path.dirname(safe_dir), PRODUCT_NAME + '.zip')
+    with zipfile.ZipFile(zip_file, 'w') as z:
+        for root, _, files in os.walk(safe_dir):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                z.write(path, os.path.relpath(path, os.path.dirname(safe_dir)))
+    return zip_file
+
+
+class TestAnnotation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.xml_file = os.path.join(self.tmp_dir, 'annotation.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse_annotation(self):
+        write_annotation_file(self.xml_file, [(0.25, [-1, 10, 10, 10], [-1, 390, 390, 390]),
+                                              (1.5, [-1, -1, 12, 12], [-1, -1, 380, 380])])
+        annotation = _annotation.parse_annotation(self.xml_file)
+        self.assertEqual(annotation['polarisation'], 'VV')
+        self.assertEqual(annotation['numberOfLines'], 30)
+        self.assertAlmostEqual(annotation['azimuthTimeInterval'], 0.002)
+
+        # Range period detected from the repeated first pixel, 3 lines of 4 points
+        self.assertEqual(annotation['grid_pixel'].shape, (3, 4))
+        np.testing.assert_array_equal(annotation['grid_pixel'][2], [0, 100, 200, 300])
+        self.assertAlmostEqual(annotation['grid_lat'][2, 1], 2.1)
+        self.assertAlmostEqual(annotation['grid_lon'][1, 3], -1.0)
+        self.assertAlmostEqual(annotation['grid_inc'][0, 3], 33.0)
+        self.assertAlmostEqual(annotation['grid_slant_range_time'][1, 2], 0.005 + 200e-8)
+        np.testing.assert_allclose(annotation['grid_azimuth_time'][:, 0], [0.5, 2.5, 4.5])
+
+        np.testing.assert_allclose(annotation['burst_azimuth_time'], [0.25, 1.5])
+        self.assertEqual(annotation['burst_first_valid_sample'].shape, (2, 4))
+        np.testing.assert_array_equal(annotation['burst_first_valid_sample'][1], [-1, -1, 12, 12])
+        np.testing.assert_array_equal(annotation['burst_last_valid_sample'][0], [-1, 390, 390, 390])
+
+    def test_parse_annotation_without_bursts(self):
+        write_annotation_file(self.xml_file, [])
+        annotation = _annotation.parse_annotation(self.xml_file)
+        self.assertEqual(annotation['burst_azimuth_time'].shape, (0,))
+        self.assertEqual(annotation['burst_first_valid_sample'].shape, (0, 4))
+        self.assertEqual(annotation['burst_last_valid_sample'].shape, (0, 4))
+        self.assertEqual(annotation['grid_lat'].shape, (3, 4))
+
+    def test_iter_elements_releases_tree(self):
+        write_annotation_file(self.xml_file, [(0.25, [-1, 10, 10, 10], [-1, 390, 390, 390])])
+        records = []
+        for path, elem in _annotation._iter_elements(self.xml_file, (_annotation.GEOLOCATION_GRID_POINT,)):
+            if path == _annotation.GEOLOCATION_GRID_POINT:
+                # Record children are kept until the record is consumed
+                records.append(elem.findtext('latitude'))
+            root = elem
+        self.assertEqual(len(records), 12)
+        self.assertEqual(root.tag, 'product')
+        self.assertEqual(len(root), 0)
+
+    def test_parse_calibration(self):
+        write_calibration_file(self.xml_file, [0, 15, 29], [0, 40, 80, 120, 160])
+        calibration = _annotation.parse_calibration(self.xml_file)
+        np.testing.assert_array_equal(calibration['cal_line_index'], [0, 15, 29])
+        self.assertEqual(calibration['cal_pixels_index'].dtype, np.int64)
+        for name in ['cal_pixels_index', 'cal_sigma_mat', 'cal_beta_mat', 'cal_gamma_mat', 'cal_dn_mat']:
+            self.assertEqual(calibration[name].shape, (3, 5))
+        self.assertAlmostEqual(calibration['cal_sigma_mat'][1, 2], 95.0)
+        self.assertAlmostEqual(calibration['cal_gamma_mat'][2, 4], 200.5)
+
+
+class FakeBand(object):
+    """ GDAL-like raster band of an array
+    """
+
+    def __init__(self, img, block_size=None):
+        self.img = img
+        self.YSize, self.XSize = img.shape
+        # Strips of one line by default, as GeoTIFF files
+        self.block_size = block_size if block_size is not None else (self.XSize, 1)
+        self.reads = []
+
+    def GetBlockSize(self):
+        return list(self.block_size)
+
+    def ReadAsArray(self, x_off, y_off, x_size, y_size):
+        self.reads.append((y_off, y_off + y_size))
+        return self.img[y_off:y_off + y_size, x_off:x_off + x_size].copy()
+
+
+class FakeDataset(object):
+
+    def __init__(self, band):
+        self.band = band
+
+    def GetRasterBand(self, i):
+        return self.band
+
+
+def concatenate_deburst(img, lines_per_burst, burst_times, burst_first_valid_sample, interval):
+    """ Reference deburst, every burst without its invalid first lines is concatenated
+        after cutting the previous ones at its azimuth time
+    """
+    bursts = [img[0:lines_per_burst]]
+    times = [burst_times[0]]
+    for i in range(1, len(burst_times)):
+        invalid_lines = 0
+        for v in burst_first_valid_sample[i]:
+            if v != -1:
+                break
+            invalid_lines += 1
+        bursts.append(img[i * lines_per_burst:(i + 1) * lines_per_burst][invalid_lines:])
+        times.append(burst_times[i] + invalid_lines * interval)
+    deburst = bursts[0]
+    for i in range(1, len(burst_times)):
+        deburst = np.concatenate((deburst[0:int(round((times[i] - times[0]) / interval))], bursts[i]), axis=0)
+    return deburst
+
+
+def interpolate_lut(line_index, pixels_index, lut_mat, line, pixel):
+    """ Reference bi-linear interpolation of a calibration LUT at one raw image position
+    """
+    v = min(max(bisect.bisect_right(list(line_index), line) - 1, 0), len(line_index) - 2)
+    w = min(max((line - line_index[v]) * 1.0 / (line_index[v + 1] - line_index[v]), 0.0), 1.0)
+    before = np.interp(pixel, pixels_index[v], lut_mat[v])
+    after = np.interp(pixel, pixels_index[v + 1], lut_mat[v + 1])
+    return (1 - w) * before + w * after
+
+
+def scan_geolocation(product, x, y):
+    """ Reference geolocation of one point, the former scan of the flat tie-point tables
+    """
+    range_index_table = product.grid_pixel.ravel()
+    azimuth_time_table = product.grid_azimuth_time.ravel()
+    azimuth_period, range_period = product.grid_pixel.shape
+    y_time = y * product.azimuthTimeInterval
+    a_index = 0
+    for i in range(0, len(azimuth_time_table), range_period):
+        if y_time <= azimuth_time_table[i]:
+            break
+        a_index = i // range_period
+    r_index = 0
+    for i in range(range_period):
+        if x <= range_index_table[a_index * range_period + i]:
+            break
+        r_index = i
+    quad_a = max(min(a_index, azimuth_period - 2), 0)
+    quad_r = max(min(r_index, range_period - 2), 0)
+    r_min = product.grid_pixel[quad_a, quad_r]
+    r_max = product.grid_pixel[quad_a, quad_r + 1]
+    x_frac = (x - r_min) * 1.0 / (r_max - r_min)
+    a_min = product.grid_azimuth_time[quad_a, quad_r]
+    a_max = product.grid_azimuth_time[quad_a + 1, quad_r + 1]
+    y_frac = (y_time - a_min) / (a_max - a_min)
+    result = []
+    for grid in [product.grid_lat, product.grid_lon]:
+        f = [grid[quad_a, quad_r], grid[quad_a, quad_r + 1], grid[quad_a + 1, quad_r + 1], grid[quad_a + 1, quad_r]]
+        result.append(sentinel.SentinelProduct._bilinear(x_frac, y_frac, f))
+    return result
+
+
+@unittest.skipIf(sentinel is None, 'sentinel is not available')
+class TestGeolocation(unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        product = sentinel.SentinelProduct.__new__(sentinel.SentinelProduct)
+        product.numberOfLines = 90
+        product.numberOfSamples = 200
+        product.azimuthTimeInterval = 0.002
+        # 5 x 7 grid with irregular pixels, and azimuth times drifting along the range
+        pixels = np.append(0, np.cumsum(rand.randint(20, 40, size=6)))
+        product.grid_pixel = np.tile(pixels, (5, 1))
+        product.grid_azimuth_time = (np.arange(0, 100, 22)[:, np.newaxis] * 0.002 +
+                                     np.arange(7) * 1e-5 * rand.uniform(0.5, 1.5))
+        product.grid_lat = 50.0 + rand.uniform(0, 0.1, size=(5, 7)) + np.arange(5)[:, np.newaxis] * 0.1
+        product.grid_lon = 3.0 + rand.uniform(0, 0.1, size=(5, 7)) + np.arange(7) * 0.2
+        product.grid_inc = 30.0 + rand.uniform(0, 1, size=(5, 7))
+        product._build_geolocation_grid()
+        self.product = product
+        self.rand = rand
+
+    def test_scalar(self):
+        # Grid nodes, points between them, and points outside the grid
+        points = [(x, y) for x in self.product.grid_pixel[0] for y in [0, 22, 44, 88]]
+        points += [(-30, -7), (-30, 50), (250, 95), (250, -3), (100, 120), (0.5, 0.5), (17.25, 61.75)]
+        points += list(zip(self.rand.uniform(-20, 220, 100), self.rand.uniform(-10, 100, 100)))
+        for x, y in points:
+            lat, lon = self.product.getGeoLocation(x, y)
+            self.assertIsInstance(lat, float)
+            np.testing.assert_allclose([lat, lon], scan_geolocation(self.product, x, y), rtol=1e-12)
+        self.assertEqual(self.product.getGeoLocation(np.int64(40), 12), self.product.getGeoLocation(40.0, 12.0))
+
+    def test_array(self):
+        x = self.rand.uniform(-20, 220, size=(30, 40))
+        y = self.rand.uniform(-10, 100, size=(30, 40))
+        x[0, :7] = self.product.grid_pixel[0]
+        y[0, :7] = 44
+        lat, lon = self.product.getGeoLocation(x, y)
+        self.assertEqual(lat.shape, (30, 40))
+        self.assertEqual(lon.shape, (30, 40))
+        for i, j in np.ndindex(x.shape):
+            np.testing.assert_allclose([lat[i, j], lon[i, j]], scan_geolocation(self.product, x[i, j], y[i, j]),
+                                       rtol=1e-12)
+
+    def test_geolocation_planes(self):
+        covered = np.zeros(shape=(90, 200), dtype=np.int64)
+        for (x0, y0, x1, y1), lat, lon, inc in self.product.geolocation_planes(block_shape=(32, 64)):
+            self.assertEqual(lat.dtype, np.float32)
+            self.assertEqual(inc.shape, (y1 - y0, x1 - x0))
+            covered[y0:y1, x0:x1] += 1
+            xs, ys = np.meshgrid(np.arange(x0, x1), np.arange(y0, y1))
+            expected_lat, expected_lon = self.product.getGeoLocation(xs, ys)
+            np.testing.assert_array_equal(lat, expected_lat.astype(np.float32))
+            np.testing.assert_array_equal(lon, expected_lon.astype(np.float32))
+            np.testing.assert_array_equal(inc, self.product._interpolate_geolocation_grid(xs, ys)[2].astype(np.float32))
+            # Points of the partial edge blocks
+            self.assertEqual([lat[-1, -1], lon[-1, -1]],
+                             [np.float32(v) for v in self.product.getGeoLocation(x1 - 1, y1 - 1)])
+        # The blocks cover the image once, with partial blocks on the last row and column
+        self.assertTrue((covered == 1).all())
+        self.assertEqual((x0, y0, x1, y1), (192, 64, 200, 90))
+
+
+@unittest.skipIf(sentinel is None, 'sentinel is not available')
+class TestCalibration(unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        product = sentinel.SentinelProduct.__new__(sentinel.SentinelProduct)
+        product.numberOfLines = 30
+        product.numberOfSamples = 50
+        # The last vector is before the last line, every vector has its own pixel positions
+        product.cal_line_index = np.array([0, 7, 19, 24])
+        product.cal_pixels_index = np.array([np.sort(rand.choice(np.arange(1, 49), 6, replace=False))
+                                             for _ in range(4)])
+        product.cal_pixels_index[:, 0] = 0
+        product.cal_pixels_index[:, -1] = 49
+        for name in ['cal_sigma_mat', 'cal_beta_mat', 'cal_gamma_mat', 'cal_dn_mat']:
+            setattr(product, name, rand.uniform(200.0, 300.0, size=(4, 6)))
+        self.dn = (rand.randint(-500, 500, size=(30, 50)) + 1j * rand.randint(-500, 500, size=(30, 50)))
+        self.dn = self.dn.astype(np.complex64)
+        product._image_dataset = FakeDataset(FakeBand(self.dn, block_size=(16, 8)))
+        self.product = product
+
+    def expected_lut(self, lut):
+        lut_mat = getattr(self.product, sentinel.SentinelProduct.CALIBRATION_LUTS[lut])
+        expected = np.empty(shape=(30, 50))
+        for line in range(30):
+            for pixel in range(50):
+                expected[line, pixel] = interpolate_lut(self.product.cal_line_index, self.product.cal_pixels_index,
+                                                        lut_mat, line, pixel)
+        return expected
+
+    def test_calibration_lut(self):
+        for lut in ['sigma', 'beta', 'gamma', 'dn']:
+            expected = self.expected_lut(lut)
+            lut_window = self.product.get_calibration_lut(0, 0, 50, 30, lut)
+            self.assertEqual(lut_window.dtype, np.float32)
+            np.testing.assert_allclose(lut_window, expected, rtol=1e-6)
+            np.testing.assert_allclose(self.product.get_calibration_lut(13, 5, 41, 28, lut), expected[5:28, 13:41],
+                                       rtol=1e-6)
+        # Lines after the last vector keep its values
+        lut_window = self.product.get_calibration_lut(0, 24, 50, 30, 'sigma')
+        np.testing.assert_array_equal(lut_window, np.repeat(lut_window[:1], 6, axis=0))
+        np.testing.assert_allclose(self.product.get_expanded_sigma_mat(), self.expected_lut('sigma'), rtol=1e-6)
+
+    def test_calibrate(self):
+        expected = (np.abs(self.dn.astype(np.complex128)) / self.expected_lut('gamma')) ** 2
+        calibrated = self.product.calibrate(self.dn, 0, 0, 'gamma')
+        self.assertEqual(calibrated.dtype, np.float32)
+        np.testing.assert_allclose(calibrated, expected, rtol=1e-5)
+        np.testing.assert_allclose(self.product.calibrate(self.dn[3:9, 20:45], 20, 3, 'gamma'), expected[3:9, 20:45],
+                                   rtol=1e-5)
+        np.testing.assert_allclose(self.product.get_calibrated_window(-5, 10, 30, 40, 'gamma'), expected[10:, :30],
+                                   rtol=1e-5)
+
+        # The blocks cover the image once
+        mosaic = np.zeros(shape=(30, 50), dtype=np.float32)
+        for (x0, y0, x1, y1), block in self.product.calibrated_blocks('gamma', block_shape=(12, 20)):
+            self.assertEqual(block.dtype, np.float32)
+            mosaic[y0:y1, x0:x1] += block
+        np.testing.assert_allclose(mosaic, expected, rtol=1e-5)
+
+
+@unittest.skipIf(sentinel is None, 'sentinel is not available')
+class TestBlocks(unittest.TestCase):
+
+    def setUp(self):
+        product = sentinel.SentinelProduct.__new__(sentinel.SentinelProduct)
+        self.img = np.arange(45 * 70, dtype=np.int16).reshape(45, 70)
+        self.band = FakeBand(self.img, block_size=(16, 8))
+        product._image_dataset = FakeDataset(self.band)
+        self.product = product
+
+    def test_read_window(self):
+        np.testing.assert_array_equal(self.product.read_window(3, 5, 20, 9), self.img[5:9, 3:20])
+        # Windows are clipped to the image
+        np.testing.assert_array_equal(self.product.read_window(-4, 40, 100, 60), self.img[40:45])
+        self.assertEqual(self.band.reads[-1], (40, 45))
+        for window in [(5, 5, 5, 9), (5, 9, 20, 5), (-10, 0, 0, 10), (70, 0, 80, 10), (0, 45, 10, 50)]:
+            self.assertRaises(ValueError, self.product.read_window, *window)
+
+    def test_iter_blocks(self):
+        # Native blocks by default
+        windows = [window for window, _ in self.product.iter_blocks()]
+        self.assertEqual(windows[0], (0, 0, 16, 8))
+        self.assertEqual(len(windows), 5 * 6)
+
+        # Block shapes are rounded up to the native size, the last row and column are short
+        mosaic = np.zeros_like(self.img)
+        windows = []
+        for (x0, y0, x1, y1), block in self.product.iter_blocks(block_shape=(10, 20)):
+            windows.append((x0, y0, x1, y1))
+            np.testing.assert_array_equal(block, self.img[y0:y1, x0:x1])
+            mosaic[y0:y1, x0:x1] += block
+        self.assertEqual(sorted(set(w[0] for w in windows)), [0, 32, 64])
+        self.assertEqual(sorted(set(w[1] for w in windows)), [0, 16, 32])
+        self.assertEqual(windows[-1], (64, 32, 70, 45))
+        np.testing.assert_array_equal(mosaic, self.img)
+
+        for block_shape in [(0, 20), (10, -1)]:
+            self.assertRaises(ValueError, list, self.product.iter_blocks(block_shape))
+
+
+@unittest.skipIf(sentinel is None, 'sentinel is not available')
+class TestDeburst(unittest.TestCase):
+
+    def make_product(self, rand):
+        """ SLC product of random bursts, overlaps and invalid lines, read from a FakeBand
+        """
+        product = sentinel.SentinelProduct.__new__(sentinel.SentinelProduct)
+        product.linesPerBurst = lines_per_burst = rand.randint(4, 12)
+        bursts = rand.randint(1, 6)
+        product.numberOfLines = bursts * lines_per_burst - rand.randint(0, 3)
+        product.numberOfSamples = 5
+        product.azimuthTimeInterval = 0.002
+        overlaps = rand.randint(0, lines_per_burst // 2, size=bursts)
+        product.burst_azimuth_time = np.append(0, np.cumsum(lines_per_burst - overlaps[1:])) * 0.002
+        invalid_lines = rand.randint(0, 3, size=bursts)
+        product.burst_first_valid_sample = np.array([[-1] * n + [1] * (lines_per_burst - n) for n in invalid_lines])
+        product._burst_cut_table = None
+        img = rand.randint(-100, 100, size=(product.numberOfLines, product.numberOfSamples)).astype(np.int16)
+        product._image_dataset = FakeDataset(FakeBand(img))
+        return product, img
+
+    def test_deburst_matches_concatenate(self):
+        rand = np.random.RandomState(0)
+        for _ in range(100):
+            product, img = self.make_product(rand)
+            expected = concatenate_deburst(img, product.linesPerBurst, product.burst_azimuth_time,
+                                           product.burst_first_valid_sample, product.azimuthTimeInterval)
+            self.assertEqual(product.get_deburst_shape(), expected.shape)
+            np.testing.assert_array_equal(product._deburst_image(img), expected)
+            lines = expected.shape[0]
+            np.testing.assert_array_equal(product.read_deburst_window(0, 0, 5, lines), expected)
+            y0 = rand.randint(0, lines)
+            y1 = rand.randint(y0 + 1, lines + 3)
+            np.testing.assert_array_equal(product.read_deburst_window(1, y0, 4, y1), expected[y0:y1, 1:4])
+
+    def test_read_deburst_window_reads_window_lines(self):
+        product, img = self.make_product(np.random.RandomState(1))
+        band = product._get_image_band()
+        lines = product.get_deburst_shape()[0]
+        product.read_deburst_window(0, lines - 2, 5, lines)
+        self.assertEqual(sum([stop - start for start, stop in band.reads]), 2)
+
+
+@unittest.skipIf(sentinel is None, 'sentinel is not available')
+class TestSentinel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.safe_dir = write_safe_dir(self.tmp_dir)
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        os.makedirs(self.cache_dir)
+        self.annotation_file = os.path.join(self.safe_dir, 'annotation', PRODUCT_FILE.format('vv') + '.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def count_parses(self):
+        """ Records the files parsed by parse_annotation until the end of the test
+        """
+        parsed = []
+        parse_annotation = _annotation.parse_annotation
+
+        def counting_parse_annotation(xml_file):
+            parsed.append(xml_file)
+            return parse_annotation(xml_file)
+
+        _annotation.parse_annotation = counting_parse_annotation
+        self.addCleanup(setattr, _annotation, 'parse_annotation', parse_annotation)
+        return parsed
+
+    def test_process_all(self):
+        s1 = sentinel.Sentinel(self.safe_dir, cache_dir=self.cache_dir)
+        products = s1.process_all(workers=2)
+        self.assertEqual(sorted(products.keys()), [0, 1])
+        self.assertEqual(products[0].product_id, PRODUCT_NAME + '.SAFE.s1a-iw1-slc-vv')
+        self.assertEqual(products[1].product_id, PRODUCT_NAME + '.SAFE.s1a-iw1-slc-vh')
+        for index, product in products.items():
+            self.assertEqual(product.product_index, index)
+            self.assertEqual(product.numberOfLines, 30)
+            np.testing.assert_array_equal(product.cal_line_index, [0, 15, 29])
+        # The quick look is read once for all the products
+        self.assertIs(products[0].quick_img, products[1].quick_img)
+        self.assertEqual(products[0].quick_img.shape, (10, 20))
+        self.assertIsNone(s1.product)
+
+    def test_process(self):
+        s1 = sentinel.Sentinel(self.safe_dir, cache_dir=self.cache_dir)
+        self.assertRaises(AttributeError, getattr, s1, 'polarisation')
+        product = s1.process(1)
+        self.assertIs(s1.product, product)
+        # Attributes and methods of the current product are available on the Sentinel object
+        self.assertEqual(s1.product_id, product.product_id)
+        self.assertEqual(s1.swath, 'IW1')
+        self.assertIs(s1.grid_lat, product.grid_lat)
+        self.assertEqual(s1.getGeoLocation(150, 12), product.getGeoLocation(150, 12))
+        self.assertEqual(s1.get_sensor_name(), 'Sentinel')
+        self.assertRaises(AttributeError, getattr, s1, 'missing_attribute')
+
+    def test_cache(self):
+        parsed = self.count_parses()
+        s1 = sentinel.Sentinel(self.safe_dir, cache_dir=self.cache_dir)
+        product = s1.get_product(0)
+        cache_file = os.path.join(self.cache_dir, product.product_id + '.npz')
+        self.assertTrue(os.path.exists(cache_file))
+        self.assertEqual(len(parsed), 1)
+
+        # The cache is reused while the annotation and calibration files are unchanged
+        cached = sentinel.Sentinel(self.safe_dir, cache_dir=self.cache_dir).get_product(0)
+        self.assertEqual(len(parsed), 1)
+        for name in ['grid_lat', 'burst_first_valid_sample', 'cal_sigma_mat']:
+            np.testing.assert_array_equal(getattr(cached, name), getattr(product, name))
+        self.assertEqual(cached.productFirstLineUtcTime, product.productFirstLineUtcTime)
+
+        # A new modification time invalidates the cache
+        stat = os.stat(self.annotation_file)
+        os.utime(self.annotation_file, (stat.st_atime, stat.st_mtime + 10))
+        sentinel.Sentinel(self.safe_dir, cache_dir=self.cache_dir).get_product(0)
+        self.assertEqual(len(parsed), 2)
+        sentinel.Sentinel(self.safe_dir, cache_dir=self.cache_dir).get_product(0)
+        self.assertEqual(len(parsed), 2)
+
+        # So does a new size with the same modification time
+        stat = os.stat(self.annotation_file)
+        with open(self.annotation_file, 'a') as f:
+            f.write('\n')
+        os.utime(self.annotation_file, (stat.st_atime, stat.st_mtime))
+        sentinel.Sentinel(self.safe_dir, cache_dir=self.cache_dir).get_product(0)
+        self.assertEqual(len(parsed), 3)
+
+        # Products are parsed every time without cache
+        sentinel.Sentinel(self.safe_dir, cache_dir=self.cache_dir, use_cache=False).get_product(0)
+        self.assertEqual(len(parsed), 4)
+
+    def test_zip_file(self):
+        zip_dir = os.path.join(self.tmp_dir, 'zip')
+        os.makedirs(zip_dir)
+        zip_file = write_zip_file(write_safe_dir(zip_dir))
+        shutil.rmtree(os.path.join(zip_dir, PRODUCT_NAME + '.SAFE'))
+        parsed = self.count_parses()
+
+        s1 = sentinel.Sentinel(zip_file)
+        self.assertTrue(s1.is_zip)
+        self.assertEqual(s1.safe_dir, PRODUCT_NAME + '.SAFE')
+        self.assertEqual(s1.base_name_id, PRODUCT_NAME + '.SAFE')
+        vsizip = '/vsizip/{0}/{1}.SAFE/'.format(os.path.abspath(zip_file), PRODUCT_NAME)
+        self.assertEqual(s1.sentinel_input_file, vsizip + 'manifest.safe')
+        self.assertFalse(sentinel.Sentinel(self.safe_dir).is_zip)
+
+        # Annotation, calibration and quick look are read from the zip file without extraction
+        product = s1.get_product(0)
+        self.assertEqual(product.product_id, PRODUCT_NAME + '.SAFE.s1a-iw1-slc-vv')
+        self.assertEqual(product.image_file, vsizip + 'measurement/' + PRODUCT_FILE.format('vv') + '.tiff')
+        self.assertEqual(product.metadata_file, vsizip + 'annotation/' + PRODUCT_FILE.format('vv') + '.xml')
+        self.assertEqual(len(parsed), 1)
+        self.assertEqual(product.numberOfSamples, 400)
+        np.testing.assert_array_equal(product.cal_line_index, [0, 15, 29])
+        np.testing.assert_array_equal(product.quick_img, np.arange(200).reshape(10, 20))
+        reference = sentinel.Sentinel(self.safe_dir, use_cache=False).get_product(0)
+        for name in ['grid_lat', 'burst_azimuth_time', 'cal_sigma_mat']:
+            np.testing.assert_array_equal(getattr(product, name), getattr(reference, name))
+
+        # The cache is written next to the zip file, and keyed on the zip file
+        cache_file = os.path.join(zip_dir, product.product_id + '.npz')
+        self.assertEqual(sorted(os.listdir(zip_dir)), sorted([os.path.basename(zip_file),
+                                                              os.path.basename(cache_file)]))
+        sentinel.Sentinel(zip_file).get_product(0)
+        self.assertEqual(len(parsed), 2)
+        stat = os.stat(zip_file)
+        os.utime(zip_file, (stat.st_atime, stat.st_mtime + 10))
+        sentinel.Sentinel(zip_file).get_product(0)
+        self.assertEqual(len(parsed), 3)
@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+
+from ..pytupi.layers import _strtree
+
+
+class TestSTRTree(unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        corner = rand.uniform(-180, 170, size=(1000, 2))
+        size = rand.exponential(2.0, size=(1000, 2))
+        self.bboxes = np.column_stack((corner, corner + size))
+        self.tree = _strtree.STRTree(self.bboxes, node_capacity=8)
+
+    def test_query_points(self):
+        rand = np.random.RandomState(1)
+        x = rand.uniform(-180, 180, 500)
+        y = rand.uniform(-180, 180, 500)
+        point_index, box_index = self.tree.query_points(x, y)
+        contains = ((x[:, np.newaxis] >= self.bboxes[:, 0]) & (x[:, np.newaxis] <= self.bboxes[:, 2]) &
+                    (y[:, np.newaxis] >= self.bboxes[:, 1]) & (y[:, np.newaxis] <= self.bboxes[:, 3]))
+        expected_point, expected_box = np.nonzero(contains)
+        self.assertGreater(len(expected_point), 0)
+        np.testing.assert_array_equal(point_index, expected_point)
+        np.testing.assert_array_equal(box_index, expected_box)
+
+    def test_query_bbox(self):
+        bbox = [-20.0, 10.0, 15.0, 40.0]
+        expected = np.nonzero((self.bboxes[:, 0] <= bbox[2]) & (self.bboxes[:, 2] >= bbox[0]) &
+                              (self.bboxes[:, 1] <= bbox[3]) & (self.bboxes[:, 3] >= bbox[1]))[0]
+        np.testing.assert_array_equal(self.tree.query_bbox(bbox), expected)
+
+    def test_levels(self):
+        self.assertEqual(len(self.tree), 1000)
+        self.assertEqual([len(level[0]) for level in self.tree.levels], [125, 16, 2, 1])
+        np.testing.assert_array_equal(np.sort(self.tree.order), np.arange(1000))
+
+    def test_small_trees(self):
+        empty = _strtree.STRTree(np.zeros(shape=(0, 4)))
+        self.assertEqual(len(empty.query_points([0.0], [0.0])[0]), 0)
+        self.assertEqual(len(empty.query_bbox([0, 0, 1, 1])), 0)
+        single = _strtree.STRTree([[0, 0, 1, 1]])
+        np.testing.assert_array_equal(single.query_points([0.5, 2.0], [0.5, 0.5])[0], [0])
@@ -0,0 +1,206 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..pytupi.sar.terrasar import _cos
+from ..pytupi.sar.terrasar import _georef
+from ..pytupi.sar.terrasar import _tsximage
+
+
+def write_cos_file(file_name, bursts):
+    """ Writes a minimal COS file from a list of (azimuth, range) complex bursts
+    """
+    dt = np.dtype([('r', '>i2'), ('i', '>i2')])
+    with open(file_name, 'wb') as f:
+        for burst in bursts:
+            azimuth_size, range_size = burst.shape
+            line_size = range_size + 2
+            header = np.zeros(shape=(4, line_size), dtype=dt)
+            header_bytes = bytearray(header.tobytes())
+            struct.pack_into('>lllll', header_bytes, 0, 0, 0, range_size, azimuth_size, 1)
+            f.write(header_bytes)
+            lines = np.zeros(shape=(azimuth_size, line_size), dtype=dt)
+            lines['r'][:, 2:] = burst.real
+            lines['i'][:, 2:] = burst.imag
+            f.write(lines.tobytes())
+
+
+def write_georef_file(file_name, num_range, num_azimuth):
+    """ Writes a minimal GEOREF.xml where lat = irg + iaz / 100.0 and lon = -lat
+    """
+    points = []
+    for irg in range(1, num_range + 1):
+        for iaz in range(1, num_azimuth + 1):
+            lat = irg + iaz / 100.0
+            points.append('<gridPoint iaz="{0}" irg="{1}"><t>{2}</t><tau>{3}</tau><lat>{4}</lat><lon>{5}</lon>'
+                          '<inc>{6}</inc><elev>0.0</elev><height>0.0</height></gridPoint>'
+                          .format(iaz, irg, iaz * 0.5, irg * 1e-6, lat, -lat, 20.0 + irg))
+    with open(file_name, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?><geoReference><geolocationGrid>'
+                '<numberOfGridPoints><total>{0}</total><azimuth>{1}</azimuth><range>{2}</range></numberOfGridPoints>'
+                '<spacingOfGridPoints><azimuth>0.5</azimuth><range>1e-06</range></spacingOfGridPoints>'
+                '<gridReferenceTime><tReferenceTimeUTC>2016-01-01T10:00:00.000000Z</tReferenceTimeUTC>'
+                '<tauReferenceTime>0.005</tauReferenceTime></gridReferenceTime>{3}'
+                '</geolocationGrid></geoReference>'.format(num_range * num_azimuth, num_azimuth, num_range,
+                                                           ''.join(points)))
+
+
+class TestCOSFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cos_file = os.path.join(self.tmp_dir, 'IMAGE_HH.cos')
+        rand = np.random.RandomState(0)
+        self.bursts = [rand.randint(-500, 500, size=(7, 11)) + 1j * rand.randint(-500, 500, size=(7, 11)),
+                       rand.randint(-500, 500, size=(5, 11)) + 1j * rand.randint(-500, 500, size=(5, 11))]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_single_burst_is_memmap_view(self):
+        write_cos_file(self.cos_file, self.bursts[:1])
+        cos_file = _cos.COSFile(self.cos_file)
+        img = cos_file.get_image()
+        self.assertEqual(img.shape, (7, 11))
+        self.assertIsInstance(img, np.memmap)
+        np.testing.assert_array_equal(img['r'] + 1j * img['i'], self.bursts[0])
+
+    def test_multi_burst(self):
+        write_cos_file(self.cos_file, self.bursts)
+        cos_file = _cos.COSFile(self.cos_file)
+        img = cos_file.get_image()
+        self.assertEqual(img.shape, (12, 11))
+        self.assertEqual([b.shape for b in cos_file.get_bursts()], [(7, 11), (5, 11)])
+        np.testing.assert_array_equal(img['r'] + 1j * img['i'], np.vstack(self.bursts))
+
+    def test_equal_bursts_are_strided_view(self):
+        bursts = self.bursts[:1] + [self.bursts[0][::-1]]
+        write_cos_file(self.cos_file, bursts)
+        cos_file = _cos.COSFile(self.cos_file)
+        stack = cos_file.get_bursts()
+        self.assertEqual(stack.shape, (2, 7, 11))
+        self.assertIsInstance(stack, np.memmap)
+        np.testing.assert_array_equal(stack['r'] + 1j * stack['i'], np.array(bursts))
+        img = cos_file.get_image()
+        np.testing.assert_array_equal(img['r'] + 1j * img['i'], np.vstack(bursts))
+
+    def test_read_window(self):
+        write_cos_file(self.cos_file, self.bursts)
+        cos_file = _cos.COSFile(self.cos_file)
+        window = cos_file.read_window(3, 5, 9, 10)
+        self.assertEqual(window.shape, (5, 6))
+        np.testing.assert_array_equal(window['r'] + 1j * window['i'], np.vstack(self.bursts)[5:10, 3:9])
+
+
+class TestTSXImage(unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        self.data = np.empty(shape=(20, 30), dtype=_cos.COSFile.COS_DTYPE)
+        self.data['r'] = rand.randint(-500, 500, size=(20, 30))
+        self.data['i'] = rand.randint(-500, 500, size=(20, 30))
+        self.sar_img = _tsximage.TSXImage()
+        self.sar_img.img = self.data
+        self.sar_img.shape = self.data.shape
+        lat = 40.0 + np.add.outer(np.arange(6) * 0.1, np.arange(5) * 0.05) + rand.rand(6, 5) * 0.01
+        lon = 10.0 + np.add.outer(np.arange(6) * 0.07, -np.arange(5) * 0.03)
+        self.sar_img.latlon_grid = np.dstack((lat, lon))
+        self.sar_img.inc_grid = (20.0 + np.add.outer(np.arange(6), np.arange(5) * 0.1))[:, :, np.newaxis]
+        self.sar_img.range_size = 1000
+        self.sar_img.azimuth_size = 800
+        self.sar_img.range_time = [0.0, 1e-4]
+        self.sar_img.azimuth_time = [0.0, 4.0]
+        self.sar_img.range_grid_spacing = 2e-5
+        self.sar_img.azimuth_grid_spacing = 1.0
+
+    def test_get_roi(self):
+        expected = (self.data['r'] + 1j * self.data['i'])[2:12, 5:25]
+        roi = self.sar_img.get_roi(5, 2, 25, 12)
+        self.assertEqual(roi.dtype, np.complex64)
+        np.testing.assert_array_equal(roi, expected)
+        out = np.empty(shape=(10, 20), dtype=np.float32)
+        amplitude = self.sar_img.get_amplitude_roi(5, 2, 25, 12, out=out)
+        self.assertIs(amplitude, out)
+        np.testing.assert_allclose(amplitude, np.abs(expected), rtol=1e-6)
+        intensity = self.sar_img.get_intensity_roi(5, 2, 25, 12, out=out)
+        np.testing.assert_array_equal(intensity, expected.real ** 2 + expected.imag ** 2)
+
+    def test_convert_to_geo_coordinates_batch(self):
+        rand = np.random.RandomState(1)
+        xs = rand.uniform(0, 1000, 50)
+        ys = rand.uniform(0, 800, 50)
+        lons, lats = self.sar_img.convert_to_geo_coordinates(xs, ys)
+        incs = self.sar_img.get_incidence_angle(xs, ys)
+        self.assertEqual(lons.shape, (50,))
+        for i in range(50):
+            lon, lat = self.sar_img.convert_to_geo_coordinates(xs[i], ys[i])
+            self.assertAlmostEqual(lon, lons[i])
+            self.assertAlmostEqual(lat, lats[i])
+            self.assertAlmostEqual(self.sar_img.get_incidence_angle(xs[i], ys[i]), incs[i])
+        lon, lat = self.sar_img.convert_to_geo_coordinates(0, 0)
+        self.assertAlmostEqual(lat, self.sar_img.latlon_grid[0][0][0])
+        self.assertAlmostEqual(lon, self.sar_img.latlon_grid[0][0][1])
+
+    def test_convert_to_img_coordinates(self):
+        rand = np.random.RandomState(2)
+        xs = rand.randint(0, 1000, 200)
+        ys = rand.randint(0, 800, 200)
+        lons, lats = self.sar_img.convert_to_geo_coordinates(xs, ys)
+        img_xs, img_ys = self.sar_img.convert_to_img_coordinates(lons, lats)
+        np.testing.assert_array_equal(img_xs, xs)
+        np.testing.assert_array_equal(img_ys, ys)
+        self.assertEqual(self.sar_img.convert_to_img_coordinates(lons[0], lats[0]), [xs[0], ys[0]])
+
+    def test_convert_to_img_coordinates_degenerate_cells(self):
+        # The first two grid rows collapse to one point, their cells have a null Jacobian
+        lat = np.array(self.sar_img.latlon_grid)
+        lat[0:2] = lat[0, 0]
+        self.sar_img.latlon_grid = lat
+        x, y = self.sar_img._geo_to_t_tau([lat[0, 0, 1], lat[4, 2, 1]], [lat[0, 0, 0], lat[4, 2, 0]])
+        self.assertTrue(np.all(np.isfinite(x)) and np.all(np.isfinite(y)))
+        # Any of the collapsed grid points
+        self.assertIn(x[0], (0.0, 1.0))
+        self.assertEqual(y[0], np.round(y[0]))
+        self.assertAlmostEqual(x[1], 4.0)
+        self.assertAlmostEqual(y[1], 2.0)
+
+    def test_geolocation_planes(self):
+        blocks = list(self.sar_img.geolocation_planes(block_shape=(300, 400)))
+        self.assertEqual(len(blocks), 9)
+        (x0, y0, x1, y1), lat, lon, inc = blocks[-1]
+        self.assertEqual((x0, y0, x1, y1), (800, 600, 1000, 800))
+        self.assertEqual(lat.shape, (200, 200))
+        self.assertEqual(lat.dtype, np.float32)
+        expected_lon, expected_lat = self.sar_img.convert_to_geo_coordinates(x0 + 5, y0 + 7)
+        self.assertAlmostEqual(lat[7, 5], expected_lat, places=4)
+        self.assertAlmostEqual(lon[7, 5], expected_lon, places=4)
+        self.assertAlmostEqual(inc[7, 5], self.sar_img.get_incidence_angle(x0 + 5, y0 + 7), places=4)
+
+
+class TestGeoRef(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.georef_file = os.path.join(self.tmp_dir, 'GEOREF.xml')
+        write_georef_file(self.georef_file, 4, 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_grids(self):
+        georef = _georef.GeoRef(self.georef_file)
+        lat = georef.getGrid(georef.TAG_POINT_LAT)
+        self.assertEqual(lat.shape, (4, 3))
+        self.assertEqual(lat.dtype, np.float64)
+        self.assertAlmostEqual(lat[2, 1], 3.02)
+        latlon = georef.getLatLonGrid()
+        self.assertAlmostEqual(latlon[3][0][0], 4.01)
+        self.assertAlmostEqual(latlon[3][0][1], -4.01)
+        self.assertAlmostEqual(georef.getIncGrid()[1][2][0], 22.0)
+        self.assertAlmostEqual(georef.getSpacingGridAzimuth(), 0.5)
+        self.assertAlmostEqual(georef.getTauReferenceTime(), 0.005)
+        self.assertEqual(georef.getTReferenceTimeUTC().hour, 10)